@@ -1,10 +1,12 @@
-import yt_dlp
+import startup # First, so start-up timing covers the imports below
 import sys
 import os
 import threading
-import queue
-import re
 import subprocess
+import logging
+from collections import deque
+from itertools import islice
+from logging.handlers import RotatingFileHandler
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.recycleview import RecycleView
@@ -12,10 +14,16 @@ from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.properties import StringProperty, ListProperty, DictProperty, BooleanProperty, NumericProperty
 from kivy.clock import Clock
 from kivy.lang import Builder
-from kivy.uix.popup import Popup
-from kivy.core.window import Window
-from kivy.metrics import dp # Import the dp function
-from kivy.uix.label import Label # Import the Label widget
+from kivy.factory import Factory
+from archive import DownloadArchive
+from dispatcher import DownloadDispatcher
+from engine import DownloadEngine, warm_up
+from metadata_cache import MetadataCache
+from journal import JobJournal
+from jobstore import ACTIVE_STATES, EVENT_STATES, JobState, JobStore
+from limits import parse_rate
+from metrics import MetricsRegistry
+from transcode import Transcoder
 
 # --- Kivy UI Layout (KV Language) ---
 KV = '''
@@ -55,94 +63,6 @@ KV = '''
         height: self.minimum_height
         orientation: 'vertical'
 
-<SettingsPopup>:
-    title: 'Settings'
-    size_hint: 0.8, 0.8
-    BoxLayout:
-        orientation: 'vertical'
-        padding: dp(20)
-        spacing: dp(20)
-        
-        BoxLayout:
-            size_hint_y: None
-            height: dp(40)
-            Label:
-                text: 'Theme:'
-            Spinner:
-                id: theme_spinner
-                text: app.theme_name
-                values: ['Dark', 'Light']
-                on_text: app.change_theme(self.text)
-
-        BoxLayout:
-            size_hint_y: None
-            height: dp(40)
-            Label:
-                text: 'Speed Limit (e.g., 500K, 2M):'
-            TextInput:
-                id: rate_limit_input
-                multiline: False
-        
-        BoxLayout:
-            size_hint_y: None
-            height: dp(40)
-            Label:
-                text: 'Concurrent Downloads:'
-            Spinner:
-                id: workers_spinner
-                text: str(app.max_concurrent_downloads)
-                values: [str(i) for i in range(1, 11)]
-                on_text: app.max_concurrent_downloads = int(self.text)
-
-        BoxLayout:
-            size_hint_y: None
-            height: dp(40)
-            Label:
-                text: 'After Queue Finishes:'
-            Spinner:
-                id: post_dl_spinner
-                text: app.post_dl_action
-                values: ['Do Nothing', 'Shutdown', 'Sleep']
-                on_text: app.post_dl_action = self.text
-
-        Button:
-            text: 'Update Download Engine (yt-dlp)'
-            on_press: app.update_ytdlp()
-        Label: # Spacer
-
-<AboutPopup>:
-    title: 'About'
-    size_hint: 0.8, 0.8
-    BoxLayout:
-        orientation: 'vertical'
-        padding: dp(20)
-        spacing: dp(10)
-        Label:
-            text: 'About This Application'
-            font_size: '20sp'
-            bold: True
-            size_hint_y: None
-            height: dp(40)
-        Label:
-            text: "This Universal Video Converter is a versatile tool for downloading video and audio from a wide range of websites. Simply paste the URL of the content you want, choose your desired format and quality, and add it to the queue."
-            text_size: self.width, None
-            size_hint_y: None
-            height: self.texture_size[1]
-        Label:
-            text: 'Developed By: PHC-Cathy'
-            size_hint_y: None
-            height: dp(30)
-        Label: # Spacer
-
-<LogPopup>:
-    title: 'Log'
-    size_hint: 0.9, 0.9
-    TextInput:
-        id: log_text
-        readonly: True
-        background_color: app.colors['bg_light']
-        foreground_color: app.colors['fg']
-
 # --- Main App Layout ---
 BoxLayout:
     orientation: 'vertical'
@@ -228,6 +148,13 @@ BoxLayout:
                     id: bitrate_spinner
                     text: '192kbps'
                     values: ['128kbps', '192kbps', '256kbps', '320kbps']
+                    disabled: keep_audio_check.active
+                CheckBox:
+                    id: keep_audio_check
+                    size_hint_x: None
+                    width: dp(40)
+                Label:
+                    text: 'Keep original (no re-encode)'
             BoxLayout:
                 opacity: 0 if app.is_mp3 else 1
                 disabled: app.is_mp3
@@ -276,12 +203,41 @@ def get_output_path():
     os.makedirs(output_folder, exist_ok=True)
     return output_folder
 
+class LogStore:
+    """Keeps the newest log records in memory and every record in a rotating log file."""
+    def __init__(self, path, capacity=1000, max_bytes=1024 * 1024, backup_count=3):
+        self.records = deque(maxlen=capacity)
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('ytconverter.log')
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self._logger.addHandler(handler)
+
+    def append(self, message):
+        message = message.rstrip('\n')
+        with self._lock:
+            self.records.append((self._next_seq, message))
+            self._next_seq += 1
+        self._logger.error(message)
+
+    def page(self, count, before=None):
+        """Returns up to `count` (seq, message) records older than seq `before` (the tail if None)."""
+        with self._lock:
+            if not self.records:
+                return []
+            end = len(self.records) if before is None else max(0, before - self.records[0][0])
+            return list(islice(self.records, max(0, end - count), end))
+
 # --- Kivy Widgets ---
 class DownloadItem(RecycleDataViewBehavior, BoxLayout):
     """A widget representing a single download item in the list."""
     title = StringProperty('')
     status = StringProperty('')
     index = NumericProperty(0)
+    job_id = NumericProperty(0)
 
     def refresh_view_attrs(self, rv, index, data):
         """Catch and handle the view changes."""
@@ -294,14 +250,9 @@ class RV(RecycleView):
         super(RV, self).__init__(**kwargs)
         self.data = []
 
-class SettingsPopup(Popup):
-    pass
-
-class AboutPopup(Popup):
-    pass
-
-class LogPopup(Popup):
-    pass
+# Popups and their layout are only imported and parsed the first time one is opened.
+for popup_name in ('SettingsPopup', 'AboutPopup', 'LogPopup'):
+    Factory.register(popup_name, module='apk_popups')
 
 # --- Main Kivy Application ---
 class UniversalConverterApp(App):
@@ -322,21 +273,48 @@ class UniversalConverterApp(App):
     is_mp3 = BooleanProperty(True)
     theme_name = StringProperty("Dark")
     post_dl_action = StringProperty("Do Nothing")
+    max_concurrent_downloads = NumericProperty(3)
 
     def build(self):
-        self.download_queue = queue.Queue()
-        self.active_downloads = 0
-        self.max_concurrent_downloads = 3
-        self.item_map = {}
-        self.log_buffer = ""
+        self.dispatcher = DownloadDispatcher(self.process_job, max_workers=self.max_concurrent_downloads, on_idle=self.check_queue_finished,
+                                             gate=lambda job: self.engine.admit(job.url))
+        self.jobs = JobStore()
+        self.rv_rows = {} # job id -> position in rv.data
+        self.rv_updates = {}
+        self.rv_updates_lock = threading.Lock()
+        self.trigger_rv_flush = Clock.create_trigger(self.flush_rv_updates)
+        self.metadata_cache = MetadataCache(os.path.join(self.user_data_dir, 'metadata.sqlite'))
+        self.journal = JobJournal(os.path.join(self.user_data_dir, 'jobs.sqlite'))
+        self.archive = DownloadArchive(os.path.join(self.user_data_dir, 'archive.sqlite'))
+        self.transcoder = Transcoder(on_idle=self.check_queue_finished)
+        self.metrics = MetricsRegistry(self.user_data_dir, gauges=self.queue_gauges)
+        self.metrics.start()
+        self.engine = DownloadEngine(get_output_path(), self.metadata_cache, self.journal, archive=self.archive,
+                                     transcoder=self.transcoder, metrics=self.metrics)
+        self.log_store = LogStore(os.path.join(self.user_data_dir, 'log.txt'))
         self.is_paused = False
-        
-        for _ in range(20): # Create a pool of worker threads
-            thread = threading.Thread(target=self.worker, daemon=True)
-            thread.start()
 
         return Builder.load_string(KV)
 
+    def on_start(self):
+        self.restore_unfinished_jobs()
+        Clock.schedule_once(self.on_window_shown)
+
+    def on_window_shown(self, dt):
+        """Loads yt-dlp in the background once the first frame is on screen."""
+        startup.mark("Window shown")
+        threading.Thread(target=self.warm_up_engine, daemon=True).start()
+
+    def warm_up_engine(self):
+        warm_up()
+        startup.mark("yt-dlp ready")
+        if startup.timing_enabled():
+            Clock.schedule_once(lambda dt: self.stop())
+
+    def on_max_concurrent_downloads(self, instance, value):
+        """Applies the 'Concurrent Downloads' setting to the dispatcher."""
+        self.dispatcher.set_max_workers(value)
+
     def add_links_to_queue(self):
         """Adds links from the main input box to the queue."""
         urls = self.root.ids.url_input.text.strip().splitlines()
@@ -344,118 +322,119 @@ class UniversalConverterApp(App):
         
         download_format = 'mp3' if self.is_mp3 else 'mp4'
         quality = self.root.ids.bitrate_spinner.text if self.is_mp3 else self.root.ids.resolution_spinner.text
+        if self.is_mp3 and self.root.ids.keep_audio_check.active:
+            download_format, quality = 'audio', 'Original'
 
         urls = [url for url in urls if url.strip()]
         if not urls:
             return
 
         for url in urls:
-            item_id = len(self.root.ids.rv.data)
-            self.root.ids.rv.data.append({'title': 'Fetching title...', 'status': 'Queued', 'index': item_id})
-            self.item_map[item_id] = {'url': url, 'cancelled': False}
-            self.download_queue.put((item_id, url, download_format, quality))
-        
-        self.start_next_download()
-
-    def worker(self):
-        """Worker thread to process downloads."""
-        while True:
-            item_id, url, download_format, quality = self.download_queue.get()
-            if self.item_map.get(item_id, {}).get('cancelled'):
-                self.download_queue.task_done()
-                self.active_downloads -= 1
-                self.start_next_download()
-                continue
-            self.run_download(url, download_format, quality, item_id)
-
-    def start_next_download(self):
-        """Starts the next download if a worker is free."""
-        if self.is_paused:
-            return
-        while self.active_downloads < self.max_concurrent_downloads and not self.download_queue.empty():
-            self.active_downloads += 1
-
-    def run_download(self, url, download_format, quality, item_id):
-        """The core download logic."""
+            journal_id = self.journal.add(url, download_format, quality)
+            self.enqueue_job(journal_id, url, download_format, quality)
+
+    def enqueue_job(self, journal_id, url, download_format, quality, title=None, output_template=None):
+        """Adds a journaled job to the store and the list and hands it to the dispatcher."""
+        job = self.jobs.add(url, download_format, quality, journal_id=journal_id, title=title, output_template=output_template)
+        self.rv_rows[job.id] = len(self.root.ids.rv.data)
+        self.root.ids.rv.data.append({'title': title or 'Fetching title...', 'status': job.status, 'job_id': job.id})
+        self.dispatcher.submit(job, key=job.id)
+
+    def restore_unfinished_jobs(self):
+        """Re-queues the jobs a previous session left unfinished, resuming their partial files."""
+        for journal_id, url, download_format, quality, title, output_template in self.journal.unfinished():
+            self.enqueue_job(journal_id, url, download_format, quality, title, output_template)
+
+    def on_engine_event(self, job_id, event, value):
+        """Turns download engine events into job and row updates; called on worker threads."""
+        if event in EVENT_STATES:
+            self.jobs.set_state(job_id, EVENT_STATES[event])
+            job = self.jobs.get(job_id)
+            if job is not None and event != 'retry':
+                job.metrics = None # The engine reports finished jobs to the registry itself
+        if event == 'title':
+            self.queue_rv_update(job_id, title=value)
+        elif event == 'status':
+            self.queue_rv_update(job_id, status=value)
+        elif event == 'complete':
+            self.queue_rv_update(job_id, status="✅ Complete")
+        elif event == 'skipped':
+            self.queue_rv_update(job_id, status="⏭ Already downloaded")
+        elif event == 'cancelled':
+            self.queue_rv_update(job_id, status="Cancelled")
+        elif event == 'error':
+            self.queue_rv_update(job_id, status="❌ Error")
+            self.log_store.append(value)
+            print(value, file=sys.stderr)
+        elif event == 'retry':
+            self.queue_rv_update(job_id, status=f"Retrying in {value:.0f}s")
+            self.dispatcher.submit(self.jobs.get(job_id), key=job_id, delay=value)
+
+    def process_job(self, job):
+        """Runs one queued Job; called by the dispatcher on a worker thread."""
+        self.jobs.set_state(job.id, JobState.RUNNING)
+        if job.metrics is None:
+            job.metrics = self.metrics.new_job(job.url, job.queued_at)
+        self.engine.download(
+            job.url, job.download_format, job.quality,
+            lambda event, value: self.on_engine_event(job.id, event, value),
+            job_id=job.journal_id,
+            output_template=job.output_template,
+            is_cancelled=lambda: job.cancelled,
+            metrics=job.metrics,
+            reserved=True,
+        )
+
+    def queue_gauges(self):
+        """Queue-wide values for the metrics export."""
+        return {'active_jobs': self.dispatcher.active, 'queue_depth': self.dispatcher.pending(),
+                'converting_jobs': self.transcoder.pending()}
+
+    def queue_rv_update(self, job_id, status=None, title=None):
+        """Records the latest status/title of a job and its row; safe to call from any thread.
+
+        Row updates are merged per job and applied once on the next frame.
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.status = job.status if status is None else status
+            job.title = job.title if title is None else title
+        with self.rv_updates_lock:
+            update = self.rv_updates.setdefault(job_id, {})
+            if status is not None:
+                update['status'] = status
+            if title is not None:
+                update['title'] = title
+        self.trigger_rv_flush()
+
+    def flush_rv_updates(self, dt):
+        """Applies the rows changed since the last frame."""
+        with self.rv_updates_lock:
+            updates, self.rv_updates = self.rv_updates, {}
+        data = self.root.ids.rv.data
+        for job_id, update in updates.items():
+            row = self.rv_rows.get(job_id)
+            if row is not None:
+                self._update_rv_item(row, update.get('title', data[row]['title']), update.get('status', data[row]['status']))
+
+    def _update_rv_item(self, row, title, status):
+        """Updates a row's data and, if it is on screen, only its view."""
+        rv = self.root.ids.rv
+        if row < len(rv.data):
+            rv.data[row]['title'] = title
+            rv.data[row]['status'] = status
+            view = rv.view_adapter.get_visible_view(row)
+            if view is not None:
+                view.title = title
+                view.status = status
+
+    def set_rate_limit(self, text):
+        """Applies the global speed limit shared by all active downloads."""
         try:
-            output_path = get_output_path()
-
-            def update_ui(text, status):
-                Clock.schedule_once(lambda dt: self._update_rv_item(item_id, text, status))
-
-            update_ui("Fetching...", "Fetching...")
-
-            with yt_dlp.YoutubeDL({'noplaylist': True, 'quiet': True}) as ydl:
-                info_dict = ydl.extract_info(url, download=False)
-                video_title = info_dict.get('title', 'Unknown Title')
-                video_id = info_dict.get('id', 'unknown_id')
-                update_ui(video_title, "Fetching...")
-
-            safe_title = re.sub(r'[\\/*?:"<>|]', "", video_title)
-            safe_title = safe_title.encode('ascii', 'ignore').decode('ascii').strip()
-            if len(safe_title) > 80:
-                safe_title = safe_title[:80].strip()
-            if not safe_title:
-                safe_title = video_id
-            
-            output_template = os.path.join(output_path, f'{safe_title}.%(ext)s')
-
-            ydl_opts = {
-                'noplaylist': True,
-                'progress_hooks': [lambda d: self.progress_hook(d, item_id, video_title)],
-                'outtmpl': output_template,
-            }
-            
-            # rate_limit = self.root.ids.rate_limit_input.text.strip()
-            # if rate_limit:
-            #     ydl_opts['ratelimit'] = rate_limit
-
-            if download_format == 'mp3':
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': quality.replace('kbps', '')}],
-                })
-            else: # MP4
-                if quality == 'Best':
-                    format_string = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-                else:
-                    height = quality.replace('p', '')
-                    format_string = f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<={height}]'
-                ydl_opts['format'] = format_string
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            
-            update_ui(video_title, "✅ Complete")
-
-        except Exception as e:
-            update_ui(video_title, "❌ Error")
-            error_message = f"Error downloading {url}: {e}\n"
-            self.log_buffer += error_message
-            print(error_message, file=sys.stderr)
-        finally:
-            self.download_queue.task_done()
-            self.active_downloads -= 1
-            self.check_queue_finished()
-            self.start_next_download()
-
-    def progress_hook(self, d, item_id, title):
-        """Updates the UI with download progress."""
-        if d['status'] == 'downloading':
-            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
-            if total_bytes:
-                percent = (d['downloaded_bytes'] / total_bytes) * 100
-                status = f"Downloading {percent:.1f}%"
-                Clock.schedule_once(lambda dt: self._update_rv_item(item_id, title, status))
-        elif d['status'] == 'finished':
-            Clock.schedule_once(lambda dt: self._update_rv_item(item_id, title, "Processing..."))
-
-    def _update_rv_item(self, item_id, title, status):
-        """Helper to safely update the RecycleView from a thread."""
-        if item_id < len(self.root.ids.rv.data):
-            self.root.ids.rv.data[item_id]['title'] = title
-            self.root.ids.rv.data[item_id]['status'] = status
-            self.root.ids.rv.refresh_from_data()
+            self.engine.bandwidth.set_rate(parse_rate(text))
+        except ValueError as e:
+            self.log_store.append(str(e))
+            print(e, file=sys.stderr)
 
     def change_theme(self, theme_name):
         """Changes the color palette of the app."""
@@ -463,9 +442,8 @@ class UniversalConverterApp(App):
         self.colors = self.themes[theme_name]
 
     def open_log_popup(self):
-        """Opens the log popup and populates it with the buffered log."""
-        popup = LogPopup()
-        popup.ids.log_text.text = self.log_buffer
+        """Opens the log popup, showing the most recent records first."""
+        popup = Factory.LogPopup(self.log_store)
         popup.open()
 
     def update_ytdlp(self):
@@ -483,30 +461,38 @@ class UniversalConverterApp(App):
     def toggle_pause(self):
         self.is_paused = not self.is_paused
         if self.is_paused:
+            self.dispatcher.pause()
             self.root.ids.pause_button.text = "Resume"
         else:
+            self.dispatcher.resume()
             self.root.ids.pause_button.text = "Pause"
-            self.start_next_download()
 
     def cancel_selected_download(self):
         # This requires selection in RecycleView, which is more complex.
-        # For now, we'll cancel the first non-finished item as a placeholder.
-        for i, item in enumerate(self.root.ids.rv.data):
-            if item['status'] not in ["✅ Complete", "❌ Error", "Cancelled"]:
-                self.item_map[i]['cancelled'] = True
-                self._update_rv_item(i, item['title'], "Cancelling...")
-                break
+        # For now, we'll cancel the oldest unfinished job as a placeholder.
+        job = self.jobs.oldest(*ACTIVE_STATES, where=lambda job: not job.cancelled)
+        if job is None:
+            return
+        job.cancelled = True
+        if self.dispatcher.remove(job.id):
+            self.jobs.set_state(job.id, JobState.CANCELLED)
+            self.journal.update(job.journal_id, state='cancelled')
+            (job.metrics or self.metrics.new_job(job.url, job.queued_at)).finish('cancelled')
+            job.metrics = None
+            self.queue_rv_update(job.id, status="Cancelled")
+        else:
+            self.queue_rv_update(job.id, status="Cancelling...")
 
     def clear_finished(self):
-        new_data = []
-        new_item_map = {}
-        for i, item in enumerate(self.root.ids.rv.data):
-            if item['status'] not in ["✅ Complete", "❌ Error", "Cancelled"]:
-                new_data.append(item)
-                new_item_map[len(new_data)-1] = self.item_map[i]
-        
-        self.root.ids.rv.data = new_data
-        self.item_map = new_item_map
+        cleared = self.jobs.remove_finished()
+        if not cleared:
+            return
+        # Rows follow job ids, so the jobs left in the store give the new rows in order
+        rv = self.root.ids.rv
+        rows = [rv.data[self.rv_rows[job_id]] for job_id in self.jobs.ids(*JobState)]
+        self.rv_rows = {row['job_id']: i for i, row in enumerate(rows)}
+        rv.data = rows
+        self.journal.remove([job.journal_id for job in cleared])
 
     def open_download_folder(self):
         path = get_output_path()
@@ -518,7 +504,7 @@ class UniversalConverterApp(App):
             subprocess.Popen(["xdg-open", path])
     
     def check_queue_finished(self):
-        if self.active_downloads == 0 and self.download_queue.empty():
+        if self.dispatcher.is_idle() and self.transcoder.is_idle():
             action = self.post_dl_action
             if action == "Shutdown":
                 os.system("shutdown /s /t 1")
@@ -0,0 +1,133 @@
+from kivy.lang import Builder
+from kivy.uix.popup import Popup
+
+# --- Popup Layouts (KV Language) ---
+# Parsed when apk.py opens the first popup, not at start-up.
+POPUPS_KV = '''
+<SettingsPopup>:
+    title: 'Settings'
+    size_hint: 0.8, 0.8
+    BoxLayout:
+        orientation: 'vertical'
+        padding: dp(20)
+        spacing: dp(20)
+        
+        BoxLayout:
+            size_hint_y: None
+            height: dp(40)
+            Label:
+                text: 'Theme:'
+            Spinner:
+                id: theme_spinner
+                text: app.theme_name
+                values: ['Dark', 'Light']
+                on_text: app.change_theme(self.text)
+
+        BoxLayout:
+            size_hint_y: None
+            height: dp(40)
+            Label:
+                text: 'Speed Limit (e.g., 500K, 2M):'
+            TextInput:
+                id: rate_limit_input
+                multiline: False
+                on_text_validate: app.set_rate_limit(self.text)
+        
+        BoxLayout:
+            size_hint_y: None
+            height: dp(40)
+            Label:
+                text: 'Concurrent Downloads:'
+            Spinner:
+                id: workers_spinner
+                text: str(app.max_concurrent_downloads)
+                values: [str(i) for i in range(1, 11)]
+                on_text: app.max_concurrent_downloads = int(self.text)
+
+        BoxLayout:
+            size_hint_y: None
+            height: dp(40)
+            Label:
+                text: 'After Queue Finishes:'
+            Spinner:
+                id: post_dl_spinner
+                text: app.post_dl_action
+                values: ['Do Nothing', 'Shutdown', 'Sleep']
+                on_text: app.post_dl_action = self.text
+
+        Button:
+            text: 'Update Download Engine (yt-dlp)'
+            on_press: app.update_ytdlp()
+        Label: # Spacer
+
+<AboutPopup>:
+    title: 'About'
+    size_hint: 0.8, 0.8
+    BoxLayout:
+        orientation: 'vertical'
+        padding: dp(20)
+        spacing: dp(10)
+        Label:
+            text: 'About This Application'
+            font_size: '20sp'
+            bold: True
+            size_hint_y: None
+            height: dp(40)
+        Label:
+            text: "This Universal Video Converter is a versatile tool for downloading video and audio from a wide range of websites. Simply paste the URL of the content you want, choose your desired format and quality, and add it to the queue."
+            text_size: self.width, None
+            size_hint_y: None
+            height: self.texture_size[1]
+        Label:
+            text: 'Developed By: PHC-Cathy'
+            size_hint_y: None
+            height: dp(30)
+        Label: # Spacer
+
+<LogPopup>:
+    title: 'Log'
+    size_hint: 0.9, 0.9
+    BoxLayout:
+        orientation: 'vertical'
+        spacing: dp(10)
+        Button:
+            id: older_button
+            text: 'Load Older'
+            size_hint_y: None
+            height: dp(40)
+            on_press: root.load_older()
+        TextInput:
+            id: log_text
+            readonly: True
+            background_color: app.colors['bg_light']
+            foreground_color: app.colors['fg']
+'''
+
+
+class SettingsPopup(Popup):
+    pass
+
+class AboutPopup(Popup):
+    pass
+
+class LogPopup(Popup):
+    """Shows the tail of the log first and loads older pages on demand."""
+    page_size = 200
+
+    def __init__(self, log_store, **kwargs):
+        super(LogPopup, self).__init__(**kwargs)
+        self.log_store = log_store
+        self.oldest_seq = None
+        self.load_older()
+
+    def load_older(self):
+        records = self.log_store.page(self.page_size, before=self.oldest_seq)
+        if records:
+            self.oldest_seq = records[0][0]
+            older_text = '\n'.join(message for _, message in records) + '\n'
+            self.ids.log_text.text = older_text + self.ids.log_text.text
+        if len(records) < self.page_size:
+            self.ids.older_button.disabled = True
+
+
+Builder.load_string(POPUPS_KV)
@@ -0,0 +1,97 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Cheap URL -> (extractor, video id) rules for the sites we see most, so duplicates can
+# be recognised without running an extractor. Names and ids match yt-dlp's
+# extractor_key (lowercased) and id fields.
+CANONICAL_PATTERNS = [
+    ('youtube', re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([\w-]{11})')),
+    ('instagram', re.compile(r'instagram\.com/(?:[\w.]+/)?(?:p|reels?|tv)/([\w-]+)')),
+    ('facebook', re.compile(r'facebook\.com/(?:.*/videos/(?:[\w.-]+/)?|reel/|watch/?\?(?:.*&)?v=)(\d+)')),
+    ('tiktok', re.compile(r'tiktok\.com/@[\w.-]+/video/(\d+)')),
+    ('vimeo', re.compile(r'vimeo\.com/(\d+)(?:$|[/?#])')),
+]
+
+# Extensions a finished download of each format can end up with. No two formats share
+# one, so the file of one format is never taken for another of the same title.
+OUTPUT_EXTS = {'mp3': ('mp3',), 'mp4': ('mp4', 'webm', 'mkv'), 'audio': ('m4a', 'opus', 'ogg', 'flac', 'mka')}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS archive (
+    extractor TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    download_format TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (extractor, video_id, download_format, quality)
+);
+'''
+
+
+def canonical_id(url):
+    """Returns (extractor, video_id) for URLs we can recognise without a network request."""
+    for extractor, pattern in CANONICAL_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return extractor, match.group(1)
+    return None
+
+
+def existing_output(output_template, download_format):
+    """Returns the path of a finished file for `output_template`, if one is on disk."""
+    for ext in OUTPUT_EXTS.get(download_format, (download_format,)):
+        path = output_template.replace('%(ext)s', ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class DownloadArchive:
+    """An index of finished downloads: (extractor, video id, format, quality) -> file path."""
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def lookup(self, url, download_format, quality):
+        """Returns the file a URL was already downloaded to, or None.
+
+        Only URLs that `canonical_id` understands can be matched; entries whose
+        file has since been deleted are dropped.
+        """
+        key = canonical_id(url)
+        if key is None:
+            return None
+        return self.lookup_id(key[0], key[1], download_format, quality)
+
+    def lookup_id(self, extractor, video_id, download_format, quality):
+        key = (extractor.lower(), str(video_id), download_format, quality)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT path FROM archive WHERE extractor = ? AND video_id = ? AND download_format = ? AND quality = ?', key
+            ).fetchone()
+        if row is None:
+            return None
+        if os.path.exists(row[0]):
+            return row[0]
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM archive WHERE extractor = ? AND video_id = ? AND download_format = ? AND quality = ?', key
+            )
+        return None
+
+    def record(self, extractor, video_id, download_format, quality, path):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?, ?, ?)',
+                (extractor.lower(), str(video_id), download_format, quality, path, time.time())
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,272 @@
+"""Offline download benchmark: python benchmark.py [-k mp4,hls,dash] [-w 1,4] [-n 8] [-s 2M]
+
+Serves synthetic progressive MP4, HLS and DASH media from a local HTTP server
+in a separate process and downloads it with the same engine as the apps.
+Every scenario reports jobs/minute, bytes/s, CPU per job and the latency of
+progress events on their way to a UI thread. Results are appended to a JSON
+lines file and compared with the previous run of the same scenario.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dispatcher import DownloadDispatcher
+from engine import DownloadEngine, get_data_path, warm_up
+from limits import parse_rate
+
+KINDS = ('mp4', 'hls', 'dash')
+SEGMENT_SECONDS = 2
+# Random bytes that every synthetic file is cut from.
+BLOCK_SIZE = 1024 * 1024
+# Options that keep yt-dlp from printing or post-processing while it is being measured.
+BENCH_YDL_PARAMS = {'quiet': True, 'no_warnings': True, 'noprogress': True, 'fixup': 'never'}
+
+
+# --- Synthetic media server ---
+
+def hls_playlist(segments):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}', '#EXT-X-MEDIA-SEQUENCE:0']
+    for n in range(segments):
+        lines += [f'#EXTINF:{SEGMENT_SECONDS}.0,', f'seg{n}.ts']
+    return '\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n'
+
+
+def dash_manifest(segments):
+    # A single muxed representation, so no ffmpeg merge is needed after the download
+    segment_urls = ''.join(f'<SegmentURL media="seg{n}.m4s"/>' for n in range(segments))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S" '
+        f'mediaPresentationDuration="PT{segments * SEGMENT_SECONDS}S" profiles="urn:mpeg:dash:profile:isoff-main:2011">'
+        '<Period><AdaptationSet mimeType="video/mp4" codecs="avc1.4d401f,mp4a.40.2">'
+        '<Representation id="muxed" bandwidth="2000000" width="640" height="360">'
+        f'<SegmentList timescale="1" duration="{SEGMENT_SECONDS}"><Initialization sourceURL="init.mp4"/>{segment_urls}</SegmentList>'
+        '</Representation></AdaptationSet></Period></MPD>'
+    )
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Answers /mp4/<name>.mp4, /hls/<i>/... and /dash/<i>/... from a shared block of random bytes."""
+    block = b''
+    size = 0
+    segments = 0
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        parts = self.path.strip('/').split('/')
+        if parts[0] == 'mp4' and len(parts) == 2:
+            self._send(self._payload(self.size), 'video/mp4')
+        elif parts[0] == 'hls' and len(parts) == 3:
+            if parts[2].endswith('.m3u8'):
+                self._send(hls_playlist(self.segments).encode(), 'application/vnd.apple.mpegurl')
+            else:
+                self._send(self._payload(self.size // self.segments), 'video/mp2t')
+        elif parts[0] == 'dash' and len(parts) == 3:
+            if parts[2].endswith('.mpd'):
+                self._send(dash_manifest(self.segments).encode(), 'application/dash+xml')
+            else:
+                self._send(self._payload(self.size // self.segments), 'video/iso.segment')
+        else:
+            self.send_error(404)
+
+    def _payload(self, length):
+        repeats, rest = divmod(length, len(self.block))
+        return self.block * repeats + self.block[:rest]
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Extractors often hang up after sniffing the first bytes of a file
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(port_queue, size, segments, latency):
+    """Runs the media server; meant to be the target of a separate process."""
+    MediaHandler.block = os.urandom(BLOCK_SIZE)
+    MediaHandler.size, MediaHandler.segments, MediaHandler.latency = size, segments, latency
+    server = MediaServer(('127.0.0.1', 0), MediaHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def media_urls(port, kind, count):
+    # The generic extractor names files after the last path part, so each one is unique
+    base = f'http://127.0.0.1:{port}'
+    if kind == 'mp4':
+        return [f'{base}/mp4/video{i}.mp4' for i in range(count)]
+    if kind == 'hls':
+        return [f'{base}/hls/{i}/hls{i}.m3u8' for i in range(count)]
+    return [f'{base}/dash/{i}/dash{i}.mpd' for i in range(count)]
+
+
+# --- Measurement ---
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_scenario(urls, workers):
+    """Downloads `urls` with `workers` concurrent jobs and returns the measurements."""
+    output_path = tempfile.mkdtemp(prefix='ytconverter-bench-')
+    engine = DownloadEngine(output_path, ydl_params=BENCH_YDL_PARAMS)
+    events = queue.Queue()
+    latencies = []
+    states = {}
+    done = threading.Event()
+
+    def ui_thread():
+        # Stands in for the GUI thread: how long do progress events wait to be seen?
+        while True:
+            sent_at = events.get()
+            if sent_at is None:
+                return
+            latencies.append(time.perf_counter() - sent_at)
+
+    def run(job):
+        index, url = job
+        def on_event(event, value):
+            events.put(time.perf_counter())
+            if event in ('complete', 'skipped', 'cancelled', 'error'):
+                states[index] = event
+        engine.download(url, 'mp4', 'Best', on_event)
+
+    consumer = threading.Thread(target=ui_thread, daemon=True)
+    consumer.start()
+    dispatcher = DownloadDispatcher(run, max_workers=workers, on_idle=done.set)
+    dispatcher.pause()
+    for job in enumerate(urls):
+        dispatcher.submit(job)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    dispatcher.resume()
+    done.wait()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    events.put(None)
+    consumer.join()
+    engine.close()
+
+    total_bytes = sum(os.path.getsize(os.path.join(output_path, name)) for name in os.listdir(output_path))
+    shutil.rmtree(output_path, ignore_errors=True)
+    completed = sum(1 for state in states.values() if state == 'complete')
+    return {
+        'jobs': len(urls), 'completed': completed, 'seconds': round(wall, 3),
+        'jobs_per_minute': round(completed / wall * 60, 1),
+        'bytes_per_second': round(total_bytes / wall),
+        'cpu_seconds_per_job': round(cpu / max(completed, 1), 4),
+        'ui_latency_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'max': round(max(latencies, default=0) * 1000, 2),
+        },
+    }
+
+
+# --- Results ---
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def previous_results(path):
+    """Returns the latest stored result for each scenario key."""
+    latest = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                latest[json.dumps(record['scenario'], sort_keys=True)] = record
+    return latest
+
+
+def change(new, old):
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the download engine against a local media server.")
+    parser.add_argument('-k', '--kinds', default='mp4,hls,dash', help="comma separated media kinds: mp4, hls, dash")
+    parser.add_argument('-w', '--workers', default='1,4', help="comma separated concurrency levels")
+    parser.add_argument('-n', '--files', type=int, default=8, help="files per scenario (default: 8)")
+    parser.add_argument('-s', '--size', type=parse_rate, default=2 * 1024 * 1024, help="size of each file, e.g. 500K or 2M")
+    parser.add_argument('--segments', type=int, default=20, help="segments per HLS/DASH file (default: 20)")
+    parser.add_argument('--latency', type=float, default=0, help="delay added to every request, in milliseconds")
+    parser.add_argument('--results', default=os.path.join(get_data_path(), 'benchmarks.jsonl'), help="JSON lines file the results are appended to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    kinds = [kind for kind in args.kinds.split(',') if kind]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        print(f"Unknown media kinds: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue, args.size, args.segments, args.latency / 1000), daemon=True)
+    server.start()
+    port = port_queue.get(timeout=10)
+    previous = previous_results(args.results)
+    revision = git_revision()
+    # Load yt-dlp up front so the first scenario does not include the import
+    warm_up()
+
+    try:
+        for kind in kinds:
+            for workers in [int(w) for w in args.workers.split(',') if w]:
+                scenario = {'kind': kind, 'workers': workers, 'files': args.files, 'size': args.size,
+                            'segments': args.segments if kind != 'mp4' else None, 'latency_ms': args.latency}
+                result = run_scenario(media_urls(port, kind, args.files), workers)
+                record = {'time': time.time(), 'revision': revision, 'scenario': scenario, 'result': result}
+                with open(args.results, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record) + '\n')
+
+                line = (f"{kind:>4} x{workers:<3} {result['completed']}/{result['jobs']} jobs  "
+                        f"{result['jobs_per_minute']:>7} jobs/min  {result['bytes_per_second'] / 1024 / 1024:>7.1f} MB/s  "
+                        f"{result['cpu_seconds_per_job'] * 1000:>7.1f} ms CPU/job  UI p95 {result['ui_latency_ms']['p95']} ms")
+                old = previous.get(json.dumps(scenario, sort_keys=True))
+                if old:
+                    line += (f"  (vs {old.get('revision') or 'previous'}: jobs/min {change(result['jobs_per_minute'], old['result']['jobs_per_minute'])}, "
+                             f"CPU/job {change(result['cpu_seconds_per_job'], old['result']['cpu_seconds_per_job'])})")
+                print(line)
+    finally:
+        server.terminate()
+    print(f"Results appended to {args.results}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Headless batch downloader: python cli.py [-i urls.txt] [-f mp3|audio|mp4] [-q QUALITY] [-w N]
+
+Reads one URL per line from a file or stdin and downloads them with the same
+engine as the desktop and Android apps, without importing Tk or Kivy.
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from archive import DownloadArchive
+from dispatcher import DownloadDispatcher
+from engine import DownloadEngine, get_data_path
+from limits import parse_rate
+from metadata_cache import MetadataCache
+from metrics import MetricsRegistry
+from transcode import Transcoder
+
+DEFAULT_QUALITY = {'mp3': '192kbps', 'audio': 'Original', 'mp4': 'Best'}
+# Qualities -q accepts for each format, and how to describe them: MPEG audio bitrates for MP3,
+# the original stream for audio, and Best or a maximum height for MP4.
+QUALITIES = {
+    'mp3': (re.compile(r'(?:32|40|48|56|64|80|96|112|128|160|192|224|256|320)kbps'), "an MP3 bitrate such as 128kbps, 192kbps, 256kbps or 320kbps"),
+    'audio': (re.compile(r'Original'), "Original"),
+    'mp4': (re.compile(r'Best|[1-9]\d*p'), "Best or a resolution such as 1080p, 720p or 480p"),
+}
+FINAL_EVENTS = ('complete', 'skipped', 'cancelled', 'error')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download a batch of URLs without a GUI.")
+    parser.add_argument('-i', '--input', default='-', help="file with one URL per line ('-' for stdin, the default)")
+    parser.add_argument('-f', '--format', dest='download_format', choices=['mp3', 'audio', 'mp4'], default='mp4',
+                        help="'audio' keeps the original audio stream (m4a/opus) without re-encoding")
+    parser.add_argument('-q', '--quality', help="bitrate for mp3 (e.g. 192kbps), resolution for mp4 (Best, 1080p, 720p, 480p); audio only takes Original")
+    parser.add_argument('-w', '--workers', type=int, default=3, help="concurrent downloads (default: 3)")
+    parser.add_argument('-r', '--rate-limit', type=parse_rate, help="combined speed limit for all downloads, e.g. 500K or 2M")
+    parser.add_argument('-o', '--output', default=os.path.join(os.path.expanduser("~"), 'Downloads', 'YTConverter'))
+    args = parser.parse_args(argv)
+    if args.quality is not None:
+        pattern, expected = QUALITIES[args.download_format]
+        if not pattern.fullmatch(args.quality):
+            parser.error(f"argument -q/--quality: {args.quality!r} is not a quality for -f {args.download_format} (expected {expected})")
+    return args
+
+
+def read_urls(source):
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    with stream:
+        return [line.strip() for line in stream if line.strip() and not line.lstrip().startswith('#')]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    quality = args.quality or DEFAULT_QUALITY[args.download_format]
+    urls = read_urls(args.input)
+    if not urls:
+        print("No URLs given.", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output, exist_ok=True)
+    results = {}
+    done = threading.Event()
+
+    def check_done():
+        # MP3 jobs leave the dispatcher before their conversion finishes
+        if dispatcher.is_idle() and transcoder.is_idle():
+            done.set()
+
+    transcoder = Transcoder(on_idle=check_done)
+    metrics = MetricsRegistry(get_data_path(), gauges=lambda: {
+        'active_jobs': dispatcher.active, 'queue_depth': dispatcher.pending(), 'converting_jobs': transcoder.pending(),
+    })
+    engine = DownloadEngine(args.output, MetadataCache(os.path.join(get_data_path(), 'metadata.sqlite')),
+                            archive=DownloadArchive(os.path.join(get_data_path(), 'archive.sqlite')),
+                            transcoder=transcoder, metrics=metrics)
+    engine.bandwidth.set_rate(args.rate_limit)
+
+    job_metrics = {} # index -> JobMetrics of the jobs that have started
+
+    def run(job):
+        index, url, queued_at = job
+        if index not in job_metrics:
+            job_metrics[index] = metrics.new_job(url, queued_at)
+        def on_event(event, value):
+            if event == 'title':
+                print(f"[{index}/{len(urls)}] {value}")
+            elif event == 'error':
+                print(f"[{index}/{len(urls)}] {value}", file=sys.stderr)
+            elif event == 'retry':
+                dispatcher.submit(job, delay=value)
+            if event in FINAL_EVENTS:
+                results[index] = event
+                job_metrics.pop(index, None)
+                print(f"[{index}/{len(urls)}] {event}: {url}")
+        engine.download(url, args.download_format, quality, on_event, metrics=job_metrics.get(index), reserved=True)
+
+    dispatcher = DownloadDispatcher(run, max_workers=args.workers, on_idle=check_done,
+                                    gate=lambda job: engine.admit(job[1]))
+    # Queue everything before starting so the dispatcher cannot go idle between submissions
+    dispatcher.pause()
+    for index, url in enumerate(urls, 1):
+        dispatcher.submit((index, url, time.monotonic()))
+    dispatcher.resume()
+    metrics.start()
+    done.wait()
+    metrics.write()
+    engine.close()
+
+    failed = [index for index in range(1, len(urls) + 1) if results.get(index) not in ('complete', 'skipped')]
+    print(f"{len(urls) - len(failed)} of {len(urls)} downloads completed.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+DEFAULT_PRIORITY = 0
+# Stale heap entries are dropped once they outnumber live jobs by this factor.
+COMPACT_RATIO = 2
+
+
+class JobQueue:
+    """Pending jobs ordered by priority, with removal and reordering by key.
+
+    Higher priorities run first and equal priorities run in the order they were
+    queued. Removed or re-prioritised jobs leave a stale heap entry behind that
+    is skipped when it reaches the top, so removal is O(1) and reordering
+    O(log n). A second heap keeps the lowest queued priority at hand for
+    moving jobs to the bottom.
+    """
+    def __init__(self):
+        self._heap = []
+        self._lowest = [] # (priority, seq, entry), lowest priority first
+        self._entries = {}
+        self._order = itertools.count()
+        self._seq = itertools.count()
+        self._stale = 0 # Dead entries left in _heap
+        self._stale_lowest = 0 # Dead entries left in _lowest
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def push(self, key, job, priority=DEFAULT_PRIORITY):
+        """Queues `job` under `key`, replacing a job already queued under it."""
+        self._push(key, job, priority, next(self._order))
+
+    def _push(self, key, job, priority, order):
+        self.remove(key)
+        entry = [-priority, order, key, job, True]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        heapq.heappush(self._lowest, (priority, next(self._seq), entry))
+
+    def remove(self, key):
+        """Drops the job queued under `key`; returns it, or None if it was not queued."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._stale += 1
+        self._retire(entry)
+        return entry[3]
+
+    def _retire(self, entry):
+        """Marks an entry that left the queue as dead and compacts heaps full of dead entries."""
+        entry[4] = False
+        self._stale_lowest += 1
+        limit = COMPACT_RATIO * max(len(self._entries), 1)
+        if self._stale > limit:
+            self._heap = [e for e in self._heap if e[4]]
+            heapq.heapify(self._heap)
+            self._stale = 0
+        if self._stale_lowest > limit:
+            self._lowest = [item for item in self._lowest if item[2][4]]
+            heapq.heapify(self._lowest)
+            self._stale_lowest = 0
+
+    def pop(self):
+        """Removes and returns the next (key, job); raises IndexError when empty."""
+        self._drop_stale()
+        if not self._heap:
+            raise IndexError("pop from an empty job queue")
+        entry = heapq.heappop(self._heap)
+        del self._entries[entry[2]]
+        self._retire(entry)
+        return entry[2], entry[3]
+
+    def pop_ready(self, gate):
+        """Removes and returns the next (key, job) that `gate` lets start, with the shortest hold-up.
+
+        `gate(job)` returns how many seconds a job must still wait (0 or None to
+        start now). Jobs it holds back keep their place in the queue. Returns
+        (None, wait) when every queued job is held back.
+        """
+        held = []
+        item, wait = None, None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if not entry[4]:
+                self._stale -= 1
+                continue
+            delay = gate(entry[3])
+            if delay and delay > 0:
+                held.append(entry)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            del self._entries[entry[2]]
+            self._retire(entry)
+            item = (entry[2], entry[3])
+            break
+        for entry in held:
+            heapq.heappush(self._heap, entry)
+        return item, wait
+
+    def _drop_stale(self):
+        while self._heap and not self._heap[0][4]:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+
+    def priority(self, key):
+        return -self._entries[key][0]
+
+    def priorities(self):
+        """Returns the priority of every queued job by key."""
+        return {key: -entry[0] for key, entry in self._entries.items()}
+
+    def set_priority(self, key, priority):
+        """Changes the priority of a queued job, keeping its place among equal priorities."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if -entry[0] != priority:
+            self._push(key, entry[3], priority, entry[1])
+        return True
+
+    def move_to_top(self, key):
+        """Makes a queued job the next one to run."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        self._drop_stale()
+        top = -self._heap[0][0]
+        # A negative order places it ahead of every job queued normally at that priority
+        self._push(key, entry[3], max(top, -entry[0]), -next(self._order))
+        return True
+
+    def move_to_bottom(self, key):
+        """Makes a queued job the last one to run."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        # Entries that left the queue are dropped from the bottom heap only once they reach its top
+        while not self._lowest[0][2][4]:
+            heapq.heappop(self._lowest)
+            self._stale_lowest -= 1
+        self._push(key, entry[3], min(self._lowest[0][0], -entry[0]), next(self._order))
+        return True
+
+
+class DownloadDispatcher:
+    """Runs queued jobs on a resizable pool of worker threads.
+
+    At most `max_workers` jobs run at the same time. Changing the limit grows
+    the pool right away; shrinking lets running jobs finish and retires the
+    surplus threads afterwards. Queued jobs can be reordered or removed by
+    the key they were submitted with. A job submitted with a delay joins the
+    queue once the delay has passed. `gate(job)`, if given, returns how many
+    seconds a queued job must still wait; held jobs keep their place while
+    the jobs behind them run.
+    """
+    def __init__(self, handler, max_workers=3, on_idle=None, gate=None):
+        self.handler = handler
+        self.on_idle = on_idle
+        self.gate = gate
+        self._pending = JobQueue()
+        self._delayed = {} # key -> (order, job, priority)
+        self._timers = [] # (due, order, key), soonest first
+        self._keys = itertools.count()
+        self._cond = threading.Condition()
+        self._max_workers = max(1, int(max_workers))
+        self._workers = 0
+        self._active = 0
+        self._paused = False
+        self._adjust_pool()
+
+    @property
+    def active(self):
+        with self._cond:
+            return self._active
+
+    @property
+    def max_workers(self):
+        with self._cond:
+            return self._max_workers
+
+    def pending(self):
+        """Returns the number of jobs waiting for a free slot or for their delay to pass."""
+        with self._cond:
+            return len(self._pending) + len(self._delayed)
+
+    def is_idle(self):
+        """True when nothing is running and nothing is waiting."""
+        with self._cond:
+            return self._is_idle()
+
+    def _is_idle(self):
+        return self._active == 0 and not self._pending and not self._delayed
+
+    def submit(self, job, key=None, priority=DEFAULT_PRIORITY, delay=0):
+        """Queues a job; it runs as soon as a slot is free and no job with a higher priority waits.
+
+        With a `delay` in seconds the job is only queued once that time has passed.
+        """
+        with self._cond:
+            key = ('job', next(self._keys)) if key is None else key
+            self._delayed.pop(key, None)
+            if delay > 0:
+                self._pending.remove(key)
+                order = next(self._keys)
+                self._delayed[key] = (order, job, priority)
+                heapq.heappush(self._timers, (time.monotonic() + delay, order, key))
+            else:
+                self._pending.push(key, job, priority)
+            self._cond.notify()
+
+    def remove(self, key):
+        """Removes a job that has not started yet; returns False if it is not queued."""
+        with self._cond:
+            removed = self._pending.remove(key) is not None or self._delayed.pop(key, None) is not None
+            idle = removed and self._is_idle()
+        if idle and self.on_idle:
+            self.on_idle()
+        return removed
+
+    def priorities(self):
+        with self._cond:
+            return self._pending.priorities()
+
+    def set_priority(self, key, priority):
+        with self._cond:
+            return self._pending.set_priority(key, priority)
+
+    def move_to_top(self, key):
+        with self._cond:
+            return self._pending.move_to_top(key)
+
+    def move_to_bottom(self, key):
+        with self._cond:
+            return self._pending.move_to_bottom(key)
+
+    def set_max_workers(self, max_workers):
+        """Changes the concurrency limit, growing or shrinking the pool."""
+        with self._cond:
+            self._max_workers = max(1, int(max_workers))
+            self._adjust_pool()
+            self._cond.notify_all()
+
+    def pause(self):
+        with self._cond:
+            self._paused = True
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def _adjust_pool(self):
+        # Called with the lock held. Surplus workers retire themselves in _next_job.
+        while self._workers < self._max_workers:
+            self._workers += 1
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _release_due(self):
+        """Queues the delayed jobs that are due; returns the seconds until the next one (None if none)."""
+        now = time.monotonic()
+        released = 0
+        while self._timers:
+            due, order, key = self._timers[0]
+            delayed = self._delayed.get(key)
+            if delayed is None or delayed[0] != order:
+                # Removed or submitted again since
+                heapq.heappop(self._timers)
+                continue
+            if due > now:
+                break
+            heapq.heappop(self._timers)
+            del self._delayed[key]
+            self._pending.push(key, delayed[1], delayed[2])
+            released += 1
+        if released:
+            self._cond.notify(released)
+        return self._timers[0][0] - now if self._timers else None
+
+    def _next_job(self):
+        """Blocks until a job may start; returns None when this worker should retire."""
+        with self._cond:
+            while True:
+                if self._workers > self._max_workers:
+                    self._workers -= 1
+                    return None
+                timeout = self._release_due()
+                if not self._paused and self._pending and self._active < self._max_workers:
+                    if self.gate is None:
+                        item, held = self._pending.pop(), None
+                    else:
+                        item, held = self._pending.pop_ready(self.gate)
+                    if item is not None:
+                        self._active += 1
+                        return item[1]
+                    timeout = held if timeout is None else min(timeout, held)
+                self._cond.wait(timeout)
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self.handler(job)
+            except Exception as e:
+                print(f"Unhandled error in download worker: {e}", file=sys.stderr)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    idle = self._is_idle()
+                    self._cond.notify()
+                if idle and self.on_idle:
+                    self.on_idle()
@@ -0,0 +1,844 @@
+import copy
+import glob
+import os
+import re
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from archive import OUTPUT_EXTS, existing_output
+from limits import (MAX_RETRIES, RETRY_MAX_SECONDS, CircuitBreaker, FragmentTuner, HostLimiter, TokenBucket, backoff_delay,
+                    site_key)
+from metadata_cache import normalize_url
+from metrics import JobMetrics
+from transcode import COPY_AUDIO, TranscodeCancelled, Transcoder, audio_extension, merge_streams, mp3_encoding
+
+CANCELLED_MESSAGE = "Download cancelled by user."
+# How often blocking steps check whether their job was cancelled, in seconds.
+CANCEL_POLL_SECONDS = 0.25
+# How long the dispatcher holds back a job whose site is busy before checking again;
+# a job finishing wakes it sooner.
+SITE_BUSY_RECHECK_SECONDS = 5.0
+
+# Background metadata lookups for playlist entries, and how many may hit one site at once.
+RESOLVE_WORKERS = 8
+RESOLVE_PER_HOST = 3
+
+# How far a file's size may be from the size yt-dlp gives for a format and still count as
+# that format; sizes are often estimates and merging adds container overhead.
+SIZE_TOLERANCE = 0.1
+
+# Extensions that only ever hold audio, for formats that do not report their codecs.
+AUDIO_FILE_EXTS = ('m4a', 'mp3', 'opus', 'ogg', 'oga', 'aac', 'flac', 'wav')
+
+# HTTP statuses worth retrying: timeouts, rate limiting and server-side failures.
+RETRYABLE_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+# Transient network failures, for errors that only describe what happened in their message.
+RETRYABLE_MESSAGES = re.compile(
+    r'HTTP Error (?:408|425|429|5\d\d)|timed out|connection (?:reset|aborted|refused)|remote end closed|'
+    r'incomplete ?read|temporary failure in name resolution|broken pipe', re.IGNORECASE)
+
+# Stream protocols that yt-dlp downloads fragment by fragment.
+FRAGMENTED_PROTOCOLS = ('m3u8', 'dash', 'ism')
+# Name yt-dlp reports for FragmentConcurrencyPP in postprocessor hooks.
+FRAGMENT_PP_KEY = 'FragmentConcurrency'
+
+# Idle YoutubeDL instances kept for reuse, about one per download and lookup thread.
+MAX_IDLE_DOWNLOADERS = 16
+# YoutubeDL options that are set per job; everything else is shared by all jobs of an engine.
+JOB_PARAMS = ('format', 'ffmpeg_location', 'quiet', 'concurrent_fragment_downloads')
+
+# Imported on first use; yt-dlp and its extractors dominate the app's start-up time.
+_yt_dlp = None
+_fragment_pp_class = None
+_youtube_dl_class = None
+
+
+def load_yt_dlp():
+    """Imports yt-dlp on first use and returns the module."""
+    global _yt_dlp
+    if _yt_dlp is None:
+        import yt_dlp
+        _yt_dlp = yt_dlp
+    return _yt_dlp
+
+
+def warm_up():
+    """Imports yt-dlp and its extractor registry so the first job does not wait for them.
+
+    Meant to run on a background thread once the window is showing.
+    """
+    try:
+        load_yt_dlp().extractor.gen_extractor_classes()
+    except Exception as e:
+        print(f"Could not preload yt-dlp: {e}")
+
+
+def get_data_path():
+    """Creates and returns the folder for the app's own state (caches, journals)."""
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser("~"), '.cache')
+    data_folder = os.path.join(base, 'YTConverter')
+    os.makedirs(data_folder, exist_ok=True)
+    return data_folder
+
+
+def sanitize_title(title, fallback):
+    """Turns a video title into a safe, ASCII-only file name (at most 80 characters)."""
+    safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
+    safe_title = safe_title.encode('ascii', 'ignore').decode('ascii').strip()
+    if len(safe_title) > 80:
+        safe_title = safe_title[:80].strip()
+    return safe_title or fallback
+
+
+def build_format(download_format, quality):
+    """Returns the yt-dlp format selector for a format ('mp3'/'audio'/'mp4') and quality."""
+    if download_format == 'mp3':
+        return 'bestaudio/best'
+    if download_format == 'audio':
+        # The original audio stream, preferring containers most players accept
+        return 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best'
+    if quality == 'Best':
+        return 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+    height = quality.replace('p', '')
+    return f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<={height}]'
+
+
+def describe_title(info):
+    """Returns the title with duration and estimated size appended when they are known."""
+    details = []
+    duration = info.get('duration')
+    if duration:
+        minutes, seconds = divmod(int(duration), 60)
+        hours, minutes = divmod(minutes, 60)
+        details.append(f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}")
+    size = info.get('filesize') or info.get('filesize_approx')
+    if size:
+        details.append(f"~{size / (1024 * 1024):.1f} MB")
+    title = info.get('title', 'Unknown Title')
+    return f"{title} ({', '.join(details)})" if details else title
+
+
+def has_video(download):
+    """Returns False only for downloaded formats that are known to be audio only."""
+    vcodec = download.get('vcodec')
+    if vcodec is None:
+        return download.get('ext') not in AUDIO_FILE_EXTS
+    return vcodec != 'none'
+
+
+class JobCancelled(Exception):
+    """Raised from yt-dlp hooks to stop a cancelled job.
+
+    It deliberately does not derive from yt-dlp's DownloadError, which the
+    fragment downloader swallows for non-fatal fragments and keeps going.
+    """
+
+
+def is_cancel_error(error):
+    if any(isinstance(cause, JobCancelled) for cause in error_causes(error)):
+        return True
+    # yt-dlp sometimes reports a hook's exception as a new error carrying only its message
+    return CANCELLED_MESSAGE.lower() in str(error).lower()
+
+
+def cancelled_error():
+    return JobCancelled(CANCELLED_MESSAGE)
+
+
+def error_causes(error):
+    """Yields `error` and the exceptions it wraps; yt-dlp keeps the original in exc_info or cause."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        exc_info = getattr(error, 'exc_info', None)
+        wrapped = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+        error = wrapped or getattr(error, 'cause', None) or error.__cause__ or error.__context__
+
+
+def is_retryable_error(error):
+    """True for failures that may go away on their own: rate limits, 5xx, timeouts and resets."""
+    for cause in error_causes(error):
+        status = getattr(cause, 'status', None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUSES
+        if isinstance(cause, (TimeoutError, ConnectionError)):
+            return True
+    return bool(RETRYABLE_MESSAGES.search(str(error)))
+
+
+def retry_after(error):
+    """Returns the seconds a server asked for in a Retry-After header, or 0."""
+    for cause in error_causes(error):
+        headers = getattr(getattr(cause, 'response', None), 'headers', None) or getattr(cause, 'headers', None)
+        value = str(headers.get('Retry-After') or '').strip() if hasattr(headers, 'get') else ''
+        if value.isdigit():
+            return min(int(value), RETRY_MAX_SECONDS)
+    return 0
+
+
+def remove_temp_files(filenames):
+    """Deletes the given download files with their .part, .ytdl and fragment leftovers."""
+    for filename in filenames:
+        leftovers = [filename, filename + '.part', filename + '.ytdl', *glob.glob(glob.escape(filename) + '.part-Frag*')]
+        for path in leftovers:
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"Could not remove {path}: {e}")
+
+
+def fragment_concurrency_pp(reserve):
+    """Returns a postprocessor that sets the fragment concurrency to `reserve()` once
+    yt-dlp has picked the streams to download.
+
+    The class derives from yt-dlp's PostProcessor, so it is only defined once yt-dlp is loaded.
+    """
+    global _fragment_pp_class
+    if _fragment_pp_class is None:
+        class FragmentConcurrencyPP(load_yt_dlp().postprocessor.PostProcessor):
+            def __init__(self, reserve):
+                super().__init__()
+                self._reserve = reserve
+
+            def run(self, info):
+                protocol = info.get('protocol') or ''
+                if any(name in protocol for name in FRAGMENTED_PROTOCOLS):
+                    self._downloader.params['concurrent_fragment_downloads'] = self._reserve()
+                return [], info
+
+        _fragment_pp_class = FragmentConcurrencyPP
+    return _fragment_pp_class(reserve)
+
+
+class MergeStep:
+    """Stands in for yt-dlp's FFmpegMergerPP; run_pp only ever calls its run()."""
+    def __init__(self, run):
+        self.run = run
+
+
+def youtube_dl_class():
+    """Returns the YoutubeDL subclass that lets a job take over merging separately downloaded formats.
+
+    Like FragmentConcurrencyPP it is only defined once yt-dlp is loaded.
+    """
+    global _youtube_dl_class
+    if _youtube_dl_class is None:
+        yt_dlp = load_yt_dlp()
+
+        class JobYoutubeDL(yt_dlp.YoutubeDL):
+            # Set per job; takes the info dict and returns (files to delete, info) like a postprocessor
+            merge_formats = None
+
+            def run_pp(self, pp, infodict):
+                if self.merge_formats is not None and isinstance(pp, yt_dlp.postprocessor.FFmpegMergerPP):
+                    pp = MergeStep(self.merge_formats)
+                return super().run_pp(pp, infodict)
+
+        _youtube_dl_class = JobYoutubeDL
+    return _youtube_dl_class
+
+
+class DownloaderContext:
+    """A long-lived YoutubeDL whose per-job options and hooks are swapped in for each use.
+
+    Reusing the instance keeps its cookie jar, HTTP connection pool and
+    extractor instances, so keep-alive and TLS sessions carry over from one
+    job to the next. The hooks and the fragment postprocessor are registered
+    once and forward to whatever the current job set.
+    """
+    def __init__(self, params):
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        self.reserve_fragments = None
+        self.ydl = youtube_dl_class()({
+            **params,
+            'progress_hooks': [self._on_progress],
+            'postprocessor_hooks': [self._on_postprocess],
+        })
+        self.ydl.add_post_processor(fragment_concurrency_pp(self._reserve), when='before_dl')
+        self._defaults = {key: self.ydl.params[key] for key in JOB_PARAMS if key in self.ydl.params}
+        self._default_outtmpl = self.ydl.params['outtmpl']['default']
+
+    def prepare(self, options, reserve_fragments=None):
+        """Applies the options of a job: 'outtmpl', 'format', the hook lists, 'merge_formats' and JOB_PARAMS."""
+        params = self.ydl.params
+        for key in JOB_PARAMS:
+            value = options.get(key, self._defaults.get(key))
+            if value is None:
+                params.pop(key, None)
+            else:
+                params[key] = value
+        params['outtmpl']['default'] = options.get('outtmpl') or self._default_outtmpl
+        # yt-dlp parses the format once when it is constructed; None means its default choice
+        self.ydl.format_selector = self.ydl.build_format_selector(options['format']) if options.get('format') else None
+        self.progress_hooks = list(options.get('progress_hooks') or [])
+        self.postprocessor_hooks = list(options.get('postprocessor_hooks') or [])
+        self.ydl.merge_formats = options.get('merge_formats')
+        self.reserve_fragments = reserve_fragments
+
+    def _on_progress(self, d):
+        for hook in self.progress_hooks:
+            hook(d)
+
+    def _on_postprocess(self, d):
+        for hook in self.postprocessor_hooks:
+            hook(d)
+
+    def _reserve(self):
+        return self.reserve_fragments() if self.reserve_fragments else 1
+
+    def close(self):
+        self.ydl.close()
+
+
+class DownloaderPool:
+    """Idle DownloaderContexts, each checked out by one job at a time.
+
+    A job gets the most recently used context of its own site if there is one,
+    then any idle context, and only builds a new one when none is free. At
+    most `max_idle` contexts are kept; the least recently used are closed.
+    """
+    def __init__(self, params, max_idle=MAX_IDLE_DOWNLOADERS):
+        self.params = params
+        self.max_idle = max_idle
+        self._idle = [] # (site, context), most recently used last
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def downloader(self, url, options=None, reserve_fragments=None):
+        """Yields a YoutubeDL prepared with the job `options`; returns it to the pool afterwards."""
+        site = site_key(url)
+        context = self._checkout(site)
+        try:
+            context.prepare(options or {}, reserve_fragments)
+            yield context.ydl
+        finally:
+            # Drop the job's hooks so they do not keep its state alive while idle
+            context.prepare({})
+            self._checkin(site, context)
+
+    def _checkout(self, site):
+        with self._lock:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][0] == site:
+                    return self._idle.pop(i)[1]
+            if self._idle:
+                return self._idle.pop()[1]
+        return DownloaderContext(self.params)
+
+    def _checkin(self, site, context):
+        with self._lock:
+            self._idle.append((site, context))
+            evicted = self._idle[:-self.max_idle] if len(self._idle) > self.max_idle else []
+            del self._idle[:len(evicted)]
+        for _, old in evicted:
+            old.close()
+
+    def close(self):
+        """Closes the idle contexts, saving cookies and dropping their connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, context in idle:
+            context.close()
+
+
+class DownloadEngine:
+    """Resolves and downloads single jobs without any GUI dependency.
+
+    Progress is reported through `on_event(event, value)`, where event is one of
+    'title', 'status', 'complete', 'skipped', 'cancelled', 'error' or 'retry'.
+    'retry' means the job failed in a way that may pass and should be queued
+    again after `value` seconds; sites that keep failing trip
+    `circuit_breaker`. Callers that queue jobs use `admit` as their
+    dispatcher gate, which holds back jobs for failing sites and for sites
+    already at their connection cap. When a journal is given, job states are
+    recorded in it as well; when an archive is given, videos it already lists
+    are skipped without touching the network.
+    MP3 conversions are handed to `transcoder`, so the final event of an MP3
+    job may arrive after `download` has returned. Phase timings and transfer
+    statistics go to the job's metrics, and from there to `metrics` if given.
+    `ydl_params` are extra YoutubeDL options applied to every download. Lookups
+    and downloads run on pooled YoutubeDL instances; call `close` when done.
+    """
+    def __init__(self, output_path, metadata_cache=None, journal=None, ffmpeg_location=None, archive=None, transcoder=None, metrics=None,
+                 ydl_params=None):
+        self.output_path = output_path
+        self.metadata_cache = metadata_cache
+        self.journal = journal
+        self.archive = archive
+        self.ffmpeg_location = ffmpeg_location
+        self.transcoder = transcoder or Transcoder(ffmpeg_location)
+        self.metrics = metrics
+        self.ydl_params = dict(ydl_params or {})
+        self._resolve_pool = ThreadPoolExecutor(max_workers=RESOLVE_WORKERS)
+        self._inflight = {}
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self.bandwidth = TokenBucket()
+        self.host_limiter = HostLimiter()
+        self.fragment_tuner = FragmentTuner()
+        self.circuit_breaker = CircuitBreaker()
+        self.downloaders = DownloaderPool({**self.ydl_params, 'noplaylist': True, 'continuedl': True})
+
+    def close(self):
+        self.downloaders.close()
+
+    def _journal(self, job_id, **fields):
+        if self.journal is not None and job_id is not None:
+            self.journal.update(job_id, **fields)
+
+    def _output_template(self, title, fallback, suffix=''):
+        return os.path.join(self.output_path, f'{sanitize_title(title, fallback)}{suffix}.%(ext)s')
+
+    def find_downloaded(self, url, download_format, quality, output_template=None):
+        """Returns the file an earlier download of `url` produced, using only local state.
+
+        A file on disk only counts without an archive entry for a resumed job,
+        whose `output_template` this very job chose for the same format and
+        quality; a file that merely has the same title may be of another quality.
+        """
+        if self.archive is not None:
+            path = self.archive.lookup(url, download_format, quality)
+            if path:
+                return path
+        if output_template:
+            return existing_output(output_template, download_format)
+        return None
+
+    def _matches_selection(self, url, info_dict, download_format, quality, path):
+        """Tells whether `path`, a file named like this job's output, holds what the job would download.
+
+        The format is picked the way the download picks it. The file matches when
+        it has the extension the job would produce and, where the size of that
+        format is known, is within SIZE_TOLERANCE of it; otherwise the name has
+        to do, as it does for yt-dlp.
+        """
+        with self.downloaders.downloader(url, {'format': build_format(download_format, quality)}) as ydl:
+            selected = ydl.process_ie_result(copy.deepcopy(info_dict), download=False)
+        download = {**selected, **(selected.get('requested_downloads') or [{}])[-1]}
+        ext = download.get('ext')
+        if download_format == 'mp3':
+            ext = 'mp3'
+            duration = download.get('duration')
+            size = int(quality.replace('kbps', '')) * 1000 / 8 * duration if duration else None
+        elif download_format == 'audio' and (has_video(download) or ext not in OUTPUT_EXTS['audio']):
+            # Only the audio track is copied out, so the stream size says nothing about the file
+            ext, size = audio_extension(download.get('acodec')), None
+        else:
+            size = download.get('filesize') or download.get('filesize_approx')
+        if os.path.splitext(path)[1][1:] != ext:
+            return False
+        return not size or abs(os.path.getsize(path) - size) <= SIZE_TOLERANCE * size
+
+    def _record_download(self, info_dict, download_format, quality, path):
+        if self.archive is not None and path and info_dict.get('id'):
+            extractor = info_dict.get('extractor_key') or info_dict.get('extractor') or 'generic'
+            self.archive.record(extractor, info_dict['id'], download_format, quality, path)
+
+    def _skip(self, job_id, path, on_event):
+        self._journal(job_id, state='skipped')
+        on_event('skipped', path)
+        return 'skipped'
+
+    def _run_cancellable(self, is_cancelled, func, *args):
+        """Runs `func` on a helper thread and stops waiting for it once the job is cancelled.
+
+        yt-dlp cannot interrupt an extraction, so an abandoned call finishes in
+        the background; its result still lands in the metadata cache.
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        while not wait([future], timeout=CANCEL_POLL_SECONDS).done:
+            if is_cancelled():
+                raise cancelled_error()
+        return future.result()
+
+    def _host_slot(self, url):
+        with self._lock:
+            return self._host_slots.setdefault(site_key(url), threading.Semaphore(RESOLVE_PER_HOST))
+
+    def resolve_info(self, url):
+        """Returns (info_dict, from_cache), extracting only when the cache has nothing usable.
+
+        Concurrent calls for the same URL share a single extraction.
+        """
+        if self.metadata_cache is not None:
+            info_dict = self.metadata_cache.get_info(url)
+            if info_dict is not None:
+                return info_dict, True
+
+        key = normalize_url(url)
+        with self._lock:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._inflight[key] = Future()
+        if not is_owner:
+            # Each caller gets its own copy since yt-dlp modifies the dict while downloading
+            return copy.deepcopy(future.result()), False
+
+        try:
+            with self._host_slot(url):
+                with self.downloaders.downloader(url, {'quiet': True}) as ydl:
+                    info_dict = ydl.extract_info(url, download=False)
+                    if info_dict.get('_type', 'video') == 'video':
+                        info_dict = ydl.sanitize_info(info_dict, remove_private_keys=True)
+                        if self.metadata_cache is not None:
+                            self.metadata_cache.put_info(url, info_dict)
+            future.set_result(copy.deepcopy(info_dict))
+            return info_dict, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def prefetch(self, urls, on_resolved=None):
+        """Resolves metadata for `urls` in the background so downloads start with it in hand.
+
+        `on_resolved(url, info_dict)` is called from a pool thread for each URL that resolves.
+        """
+        for url in urls:
+            self._resolve_pool.submit(self._prefetch_one, url, on_resolved)
+
+    def _prefetch_one(self, url, on_resolved):
+        try:
+            info_dict, _ = self.resolve_info(url)
+        except Exception:
+            return # The download itself reports the error
+        if on_resolved:
+            on_resolved(url, info_dict)
+
+    def iter_playlist(self, url):
+        """Yields the flat entries of a playlist as its pages are fetched.
+
+        Stopping the iteration early stops fetching pages. Complete listings are
+        cached; a ValueError is raised if `url` is not a playlist.
+        """
+        if self.metadata_cache is not None:
+            cached = self.metadata_cache.get_playlist(url)
+            if cached:
+                yield from cached[1]
+                return
+
+        with load_yt_dlp().YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
+            # process=False keeps 'entries' lazy, so pages are requested only as we iterate
+            info = ydl.extract_info(url, download=False, process=False)
+            while info.get('_type') in ('url', 'url_transparent'):
+                info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+            if 'entries' not in info:
+                raise ValueError("Could not find any videos in the playlist.")
+
+            entries = []
+            for entry in info['entries']:
+                if not entry:
+                    continue
+                entry = {
+                    'url': entry.get('url') or entry.get('webpage_url'), 'id': entry.get('id'),
+                    'title': entry.get('title'), 'duration': entry.get('duration'),
+                }
+                entries.append(entry)
+                yield entry
+        if self.metadata_cache is not None:
+            self.metadata_cache.put_playlist(url, info.get('title'), entries)
+
+    def build_options(self, download_format, quality, output_template, progress_hook, postprocessor_hook=None, merge_formats=None):
+        """Returns the per-job YoutubeDL options, as applied by DownloaderContext.prepare."""
+        ydl_opts = {
+            'progress_hooks': [progress_hook],
+            'postprocessor_hooks': [postprocessor_hook] if postprocessor_hook else [],
+            'merge_formats': merge_formats,
+            'outtmpl': output_template,
+            'format': build_format(download_format, quality),
+        }
+
+        if download_format == 'mp3':
+            if self.ffmpeg_location:
+                if not os.path.exists(self.ffmpeg_location):
+                    raise FileNotFoundError(f"{os.path.basename(self.ffmpeg_location)} not found!")
+                ydl_opts['ffmpeg_location'] = self.ffmpeg_location
+            # The audio is converted afterwards by the transcoder, outside the download slot
+        elif download_format == 'audio' and self.ffmpeg_location and os.path.exists(self.ffmpeg_location):
+            # Only used to remux or copy streams, so a missing ffmpeg is not fatal here
+            ydl_opts['ffmpeg_location'] = self.ffmpeg_location
+        return ydl_opts
+
+    def admit(self, url):
+        """Returns how many seconds a job for `url` must still wait before it may start (0 to start now).
+
+        Meant as the dispatcher's `gate`, so jobs for a busy or failing site keep
+        their place without taking a worker. A job it admits has its site's
+        connection slot reserved; run it with `download(..., reserved=True)`.
+        """
+        slot = self.host_limiter.slot(url)
+        if not slot.acquire(blocking=False):
+            return SITE_BUSY_RECHECK_SECONDS
+        # Asked only once the job could start, so a half-open circuit's probe is not wasted
+        wait = self.circuit_breaker.retry_after(url)
+        if wait:
+            slot.release()
+        return wait
+
+    def _acquire_host_slot(self, url, on_event, is_cancelled):
+        """Waits for a free connection slot on the site of `url`."""
+        slot = self.host_limiter.slot(url)
+        if not slot.acquire(blocking=False):
+            on_event('status', f"Waiting for {site_key(url)}...")
+            while not slot.acquire(timeout=CANCEL_POLL_SECONDS):
+                if is_cancelled():
+                    raise cancelled_error()
+
+    def _merge_formats(self, info, on_event, is_cancelled, metrics):
+        """Merges the separately downloaded formats of a job in place of yt-dlp's FFmpegMergerPP.
+
+        yt-dlp lets a started merge run to the end; the transcoder kills ffmpeg
+        as soon as the job is cancelled.
+        """
+        on_event('status', "Merging...")
+        metrics.end('download')
+        metrics.start('merge')
+        try:
+            self.transcoder.merge(info['__files_to_merge'], info['filepath'], merge_streams(info['requested_formats']), is_cancelled)
+        except TranscodeCancelled:
+            raise cancelled_error()
+        finally:
+            metrics.end('merge')
+        return info['__files_to_merge'], info
+
+    def _transcode(self, url, info_dict, download_format, quality, source, target, codec_args, job_id, on_event, is_cancelled, metrics):
+        """Queues the audio conversion of a finished download and returns 'converting'."""
+        def on_start():
+            metrics.start('transcode')
+            on_event('status', "Converting...")
+
+        def on_done(error):
+            if isinstance(error, TranscodeCancelled):
+                remove_temp_files([source])
+                state = 'cancelled'
+                on_event('cancelled', None)
+            elif error:
+                # The source is an intermediate file in the user's output folder; a retry downloads it again
+                remove_temp_files([source])
+                state = 'error'
+                on_event('error', f"Error converting {url}: {error}")
+            else:
+                if os.path.exists(source):
+                    os.remove(source)
+                self._record_download(info_dict, download_format, quality, target)
+                state = 'complete'
+                on_event('complete', None)
+            self._journal(job_id, state=state)
+            metrics.finish(state)
+
+        on_event('status', "Waiting to convert...")
+        self.transcoder.submit(source, target, codec_args, on_done, on_start=on_start, is_cancelled=is_cancelled)
+        return 'converting'
+
+    def download(self, url, download_format, quality, on_event, job_id=None, output_template=None, is_cancelled=None, metrics=None,
+                 reserved=False):
+        """Downloads one URL and returns its state: 'complete', 'skipped', 'cancelled', 'error',
+        'retry' when it should be queued again, or 'converting' when an MP3 conversion was
+        queued and will report the final state.
+
+        `metrics` is the JobMetrics of the job's earlier attempts, if any. The job
+        holds a connection slot on its site until its download ends; `reserved`
+        says `admit` already took it, otherwise the job waits for one here.
+        """
+        if metrics is None:
+            metrics = self.metrics.new_job(url) if self.metrics is not None else JobMetrics(url)
+        metrics.begin()
+        state = self._download(url, download_format, quality, on_event, job_id, output_template, is_cancelled or (lambda: False), metrics,
+                               reserved)
+        if state == 'retry':
+            metrics.requeue()
+        elif state != 'converting':
+            metrics.finish(state)
+        return state
+
+    def _download(self, url, download_format, quality, on_event, job_id, output_template, is_cancelled, metrics, reserved):
+        holds_slot = reserved
+        bytes_seen = {}
+        fragment_counts = {}
+        fragments = {'count': 0, 'size': 0, 'elapsed': 0, 'total': 0}
+        written = set()
+
+        def reserve_fragments():
+            if not fragments['count']:
+                fragments['count'] = self.fragment_tuner.acquire(url)
+            return fragments['count']
+
+        def progress_hook(d):
+            written.update(name for name in (d.get('filename'), d.get('tmpfilename')) if name)
+            if is_cancelled():
+                raise cancelled_error()
+
+            if d['status'] == 'downloading':
+                # Charge the shared bandwidth budget for the bytes received since the last call.
+                # The first report only sets the baseline, so resumed bytes are not charged.
+                downloaded = d.get('downloaded_bytes') or 0
+                filename = d.get('filename')
+                received = max(0, downloaded - bytes_seen.setdefault(filename, downloaded))
+                bytes_seen[filename] = downloaded
+                metrics.add_bytes(received, d.get('speed'))
+                self.bandwidth.consume(received)
+                if d.get('fragment_count'):
+                    fragment_counts[filename] = d['fragment_count']
+
+                total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+                if total_bytes:
+                    percent = (d['downloaded_bytes'] / total_bytes) * 100
+                    on_event('status', f"Downloading {percent:.1f}%")
+            elif d['status'] == 'finished':
+                if d.get('filename') in fragment_counts:
+                    fragments['size'] += d.get('total_bytes') or 0
+                    fragments['elapsed'] += d.get('elapsed') or 0
+                    fragments['total'] += fragment_counts.pop(d['filename'])
+                on_event('status', "Processing...")
+            elif d['status'] == 'error':
+                on_event('status', "Error")
+
+        def postprocessor_hook(d):
+            # Stops the job before yt-dlp starts fixing up the files; merges run
+            # through the transcoder instead, which stops ffmpeg by itself.
+            if is_cancelled():
+                raise cancelled_error()
+            if d.get('postprocessor') == FRAGMENT_PP_KEY:
+                return
+            if d['status'] == 'started':
+                metrics.end('download')
+                metrics.start('merge')
+            elif d['status'] == 'finished':
+                metrics.end('merge')
+
+        def merge_formats(info):
+            return self._merge_formats(info, on_event, is_cancelled, metrics)
+
+        try:
+            if is_cancelled():
+                raise cancelled_error()
+            if not holds_slot:
+                self._acquire_host_slot(url, on_event, is_cancelled)
+                holds_slot = True
+
+            existing = self.find_downloaded(url, download_format, quality, output_template)
+            if existing:
+                return self._skip(job_id, existing, on_event)
+
+            on_event('status', "Fetching...")
+            self._journal(job_id, state='running')
+
+            metrics.start('extract')
+            info_dict, from_cache = self._run_cancellable(is_cancelled, self.resolve_info, url)
+            metrics.end('extract')
+            video_title = info_dict.get('title', 'Unknown Title')
+            on_event('title', describe_title(info_dict))
+
+            # The cheap check above misses URL forms we cannot parse; now the real id is known
+            if self.archive is not None and info_dict.get('id'):
+                existing = self.archive.lookup_id(info_dict.get('extractor_key') or info_dict.get('extractor') or 'generic',
+                                                  info_dict['id'], download_format, quality)
+                if existing:
+                    return self._skip(job_id, existing, on_event)
+
+            # A resumed job keeps its original file name so its .part file is picked up again
+            if not output_template:
+                output_template = self._output_template(video_title, info_dict.get('id', 'unknown_id'))
+                existing = existing_output(output_template, download_format)
+                if existing:
+                    if self._matches_selection(url, info_dict, download_format, quality, existing):
+                        # Downloaded before the archive knew about it; let the archive find it from now on
+                        self._record_download(info_dict, download_format, quality, existing)
+                        return self._skip(job_id, existing, on_event)
+                    # The file of that name holds another quality; keep it and save beside it
+                    output_template = self._output_template(video_title, info_dict.get('id', 'unknown_id'), f' ({quality})')
+            self._journal(job_id, title=video_title, output_template=output_template)
+
+            # Audio sources get their own name so an existing video of the same title is never touched
+            is_audio = download_format in ('mp3', 'audio')
+            download_template = output_template.replace('%(ext)s', 'source.%(ext)s') if is_audio else output_template
+            ydl_opts = self.build_options(download_format, quality, download_template, progress_hook, postprocessor_hook,
+                                          merge_formats)
+            try:
+                yt_dlp = load_yt_dlp()
+                with self.downloaders.downloader(url, ydl_opts, reserve_fragments) as ydl:
+                    # Reuse the info extracted above instead of resolving the URL a second time
+                    metrics.start('download')
+                    try:
+                        result = ydl.process_ie_result(info_dict, download=True)
+                    except yt_dlp.utils.DownloadError as e:
+                        if not from_cache or is_cancel_error(e):
+                            raise
+                        # The cached stream URLs went stale; resolve once more and retry
+                        self.metadata_cache.invalidate_streams(url)
+                        metrics.add_retry()
+                        metrics.end('download')
+                        metrics.start('extract')
+                        info_dict, _ = self._run_cancellable(is_cancelled, self.resolve_info, url)
+                        metrics.end('extract')
+                        metrics.start('download')
+                        result = ydl.process_ie_result(info_dict, download=True)
+                    metrics.end('download')
+            finally:
+                if fragments['count']:
+                    # Throttled transfers say nothing about what the site could deliver
+                    measured = 0 if self.bandwidth.rate else fragments['total']
+                    self.fragment_tuner.release(url, fragments['count'], fragments['size'], fragments['elapsed'], measured)
+            self.circuit_breaker.record_success(url)
+
+            # yt-dlp drops the fields a download shares with the video from requested_downloads
+            result = result or {}
+            download = {**result, **(result.get('requested_downloads') or [{}])[-1]}
+            filepath = download.get('filepath')
+            if is_audio and filepath:
+                if download_format == 'mp3':
+                    return self._transcode(url, info_dict, download_format, quality, filepath, output_template.replace('%(ext)s', 'mp3'),
+                                           mp3_encoding(quality.replace('kbps', '')), job_id, on_event, is_cancelled, metrics)
+                ext = download.get('ext') or os.path.splitext(filepath)[1][1:]
+                if has_video(download) or ext not in OUTPUT_EXTS['audio']:
+                    # Only a stream with video was available, or the audio came as .webm or .mp3,
+                    # which belong to the other formats; copy its audio track out as it is
+                    target = output_template.replace('%(ext)s', audio_extension(download.get('acodec')))
+                    return self._transcode(url, info_dict, download_format, quality, filepath, target,
+                                           COPY_AUDIO, job_id, on_event, is_cancelled, metrics)
+                target = output_template.replace('%(ext)s', ext)
+                os.replace(filepath, target)
+                filepath = target
+            self._record_download(info_dict, download_format, quality, filepath)
+
+        except Exception as e:
+            if is_cancel_error(e):
+                remove_temp_files(written)
+                self._journal(job_id, state='cancelled')
+                on_event('cancelled', None)
+                return 'cancelled'
+            if is_retryable_error(e):
+                self.circuit_breaker.record_failure(url)
+                if metrics.retries < MAX_RETRIES:
+                    # Partial files stay behind so the next attempt resumes them
+                    delay = max(backoff_delay(metrics.retries), retry_after(e))
+                    metrics.add_retry()
+                    self._journal(job_id, state='queued')
+                    print(f"Retrying {url} in {delay:.0f}s: {e}", file=sys.stderr)
+                    on_event('retry', delay)
+                    return 'retry'
+            self._journal(job_id, state='error')
+            on_event('error', f"Error downloading {url}: {e}")
+            return 'error'
+        finally:
+            if holds_slot:
+                self.host_limiter.slot(url).release()
+
+        self._journal(job_id, state='complete')
+        on_event('complete', None)
+        return 'complete'
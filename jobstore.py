@@ -0,0 +1,142 @@
+import itertools
+import threading
+import time
+from enum import Enum
+
+
+class JobState(Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    RETRYING = 'retrying'
+    COMPLETE = 'complete'
+    SKIPPED = 'skipped'
+    CANCELLED = 'cancelled'
+    ERROR = 'error'
+
+
+# States a job never leaves again; "Clear Finished" removes them.
+FINISHED_STATES = (JobState.COMPLETE, JobState.SKIPPED, JobState.CANCELLED, JobState.ERROR)
+# States of jobs that are still waiting or running.
+ACTIVE_STATES = (JobState.QUEUED, JobState.RUNNING, JobState.RETRYING)
+
+# Engine events that end a job, and the state each one leaves it in.
+EVENT_STATES = {
+    'complete': JobState.COMPLETE,
+    'skipped': JobState.SKIPPED,
+    'cancelled': JobState.CANCELLED,
+    'error': JobState.ERROR,
+    'retry': JobState.RETRYING,
+}
+
+
+class Job:
+    """One queued URL and everything the frontends track about it.
+
+    `metrics` stays None until the job first starts and is dropped again when it finishes.
+    """
+    __slots__ = ('id', 'journal_id', 'url', 'download_format', 'quality', 'title', 'status', 'state',
+                 'output_template', 'cancelled', 'queued_at', 'metrics')
+
+    def __init__(self, job_id, url, download_format, quality, journal_id=None, title=None, output_template=None):
+        self.id = job_id
+        self.journal_id = journal_id
+        self.url = url
+        self.download_format = download_format
+        self.quality = quality
+        self.title = title
+        self.status = 'Queued'
+        self.state = JobState.QUEUED
+        self.output_template = output_template
+        self.cancelled = False
+        self.queued_at = time.monotonic()
+        self.metrics = None
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+
+class JobStore:
+    """The jobs of a session by id, with the set of ids in each state.
+
+    Ids are assigned in the order jobs are added and never reused, so they can
+    key list rows and dispatcher entries for the life of the session. Looking
+    up, counting or clearing jobs by state only touches the jobs concerned.
+    `version` changes whenever a job is added, removed or changes state.
+    """
+    def __init__(self):
+        self.version = 0
+        self._jobs = {}
+        self._by_state = {state: set() for state in JobState}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def add(self, url, download_format, quality, **fields):
+        """Creates a queued job; `fields` are the optional Job arguments."""
+        with self._lock:
+            job = Job(next(self._ids), url, download_format, quality, **fields)
+            self._jobs[job.id] = job
+            self._by_state[job.state].add(job.id)
+            self.version += 1
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Returns every job, oldest first."""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def set_state(self, job_id, state):
+        """Moves a job to `state`; returns the job, or None if it is no longer in the store."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.state is not state:
+                self._by_state[job.state].discard(job_id)
+                self._by_state[state].add(job_id)
+                job.state = state
+                self.version += 1
+            return job
+
+    def ids(self, *states):
+        """Returns the ids of the jobs in any of `states`, oldest first."""
+        with self._lock:
+            return sorted(itertools.chain.from_iterable(self._by_state[state] for state in states))
+
+    def oldest(self, *states, where=None):
+        """Returns the oldest job in any of `states` for which `where(job)` holds, or None."""
+        with self._lock:
+            candidates = (job_id for state in states for job_id in self._by_state[state]
+                          if where is None or where(self._jobs[job_id]))
+            return self._jobs.get(min(candidates, default=None))
+
+    def count(self, *states):
+        with self._lock:
+            return sum(len(self._by_state[state]) for state in states)
+
+    def remove(self, job_ids):
+        """Removes the given jobs; returns the ones that were in the store."""
+        removed = []
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.pop(job_id, None)
+                if job is not None:
+                    self._by_state[job.state].discard(job_id)
+                    removed.append(job)
+            if removed:
+                self.version += 1
+        return removed
+
+    def remove_finished(self):
+        """Removes every finished job and returns them."""
+        return self.remove(self.ids(*FINISHED_STATES))
@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+import time
+
+# Jobs in these states were not finished when the app last exited.
+UNFINISHED_STATES = ('queued', 'running')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    download_format TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    state TEXT NOT NULL,
+    title TEXT,
+    output_template TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state);
+'''
+
+
+class JobJournal:
+    """A crash-safe record of every queued job and its state.
+
+    Each change is committed immediately (SQLite in WAL mode), so after a crash or
+    restart `unfinished()` returns exactly the jobs that still need to run, along
+    with the output template they were using so `.part` files can be resumed.
+    """
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+
+    def add(self, url, download_format, quality):
+        """Records a newly queued job and returns its journal id."""
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT INTO jobs (url, download_format, quality, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, download_format, quality, 'queued', now, now)
+            )
+            return cursor.lastrowid
+
+    def update(self, job_id, state=None, title=None, output_template=None):
+        """Updates the given fields of a job; fields left as None are unchanged."""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE jobs SET state = COALESCE(?, state), title = COALESCE(?, title), '
+                'output_template = COALESCE(?, output_template), updated_at = ? WHERE id = ?',
+                (state, title, output_template, time.time(), job_id)
+            )
+
+    def unfinished(self):
+        """Returns (id, url, download_format, quality, title, output_template) for jobs to resume."""
+        with self._lock:
+            return self._db.execute(
+                f"SELECT id, url, download_format, quality, title, output_template FROM jobs "
+                f"WHERE state IN ({', '.join('?' * len(UNFINISHED_STATES))}) ORDER BY id",
+                UNFINISHED_STATES
+            ).fetchall()
+
+    def remove(self, job_ids):
+        """Forgets jobs that were cleared from the queue."""
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in job_ids])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,232 @@
+import random
+import re
+import threading
+import time
+from metadata_cache import host_key
+
+# Maximum concurrent downloads per site; sites not listed get DEFAULT_HOST_LIMIT.
+HOST_LIMITS = {
+    'instagram.com': 2,
+    'facebook.com': 3,
+    'tiktok.com': 3,
+    'youtube.com': 6,
+}
+DEFAULT_HOST_LIMIT = 4
+
+# Short or alternate domains that belong to a site in HOST_LIMITS.
+SITE_ALIASES = {
+    'youtu.be': 'youtube.com',
+    'fb.watch': 'facebook.com',
+    'instagr.am': 'instagram.com',
+}
+
+
+def parse_rate(text):
+    """Parses a speed limit such as '500K', '2M' or '1.5MB' into bytes per second.
+
+    Returns None for an empty string and raises ValueError for anything else it cannot read.
+    """
+    text = (text or '').strip()
+    if not text:
+        return None
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?', text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid speed limit: {text}")
+    multiplier = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2).upper()]
+    return int(float(match.group(1)) * multiplier)
+
+
+def site_key(url):
+    """Returns the site a URL is counted against, e.g. 'youtube.com' for youtu.be links."""
+    host = host_key(url)
+    host = SITE_ALIASES.get(host, host)
+    for site in HOST_LIMITS:
+        if host == site or host.endswith('.' + site):
+            return site
+    return host
+
+
+class TokenBucket:
+    """A bandwidth budget shared by every active download.
+
+    Downloads report the bytes they receive through `consume`, which sleeps the
+    calling thread whenever the combined rate runs ahead of the budget.
+    """
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self.rate = None
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Sets the budget in bytes per second; None removes the limit."""
+        with self._lock:
+            self.rate = rate or None
+            self._tokens = float(self.rate or 0)
+            self._last = time.monotonic()
+
+    def consume(self, amount):
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            # At most one second's worth of bandwidth can be saved up as a burst
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """Caps how many downloads may talk to the same site at once."""
+    def __init__(self, limits=None, default_limit=DEFAULT_HOST_LIMIT):
+        self.limits = dict(HOST_LIMITS if limits is None else limits)
+        self.default_limit = default_limit
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def slot(self, url):
+        """Returns the semaphore guarding the site of `url`; use it as a context manager."""
+        site = site_key(url)
+        with self._lock:
+            if site not in self._slots:
+                self._slots[site] = threading.BoundedSemaphore(self.limits.get(site, self.default_limit))
+            return self._slots[site]
+
+
+# Parallel fragment connections shared by all HLS/DASH downloads, and the most one job may use.
+MAX_FRAGMENT_CONNECTIONS = 16
+MAX_FRAGMENTS_PER_JOB = 8
+DEFAULT_FRAGMENTS = 4
+# Downloads with fewer fragments than this say little about the best concurrency.
+MIN_TUNING_FRAGMENTS = 10
+# Weight of the newest measurement in the per-site moving averages.
+TUNING_ALPHA = 0.3
+# Doubling the concurrency is worth trying while per-fragment latency grew by less than this.
+LATENCY_GROWTH = 1.3
+
+
+class FragmentTuner:
+    """Chooses how many fragments of an HLS/DASH stream are fetched in parallel.
+
+    For every site it keeps moving averages of the throughput and the
+    per-fragment latency measured at each concurrency level it has used. Jobs
+    get the fewest connections that reached the best throughput, step up while
+    latency shows the connections are not yet competing for bandwidth, and
+    never take more than their share of `max_connections`.
+    """
+    def __init__(self, max_connections=MAX_FRAGMENT_CONNECTIONS, max_per_job=MAX_FRAGMENTS_PER_JOB):
+        self.max_connections = max_connections
+        self.max_per_job = max_per_job
+        self._sites = {}
+        self._jobs = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def _level(self, site):
+        levels = self._sites.get(site)
+        if not levels:
+            return DEFAULT_FRAGMENTS
+        top = max(stats['throughput'] for stats in levels.values())
+        best = min(count for count, stats in levels.items() if stats['throughput'] >= top * 0.9)
+        higher = min(best * 2, self.max_per_job)
+        if higher not in levels:
+            # If fragments took about as long with half the connections, the link is
+            # not saturated yet and more requests in flight should raise throughput
+            lower = levels.get(best // 2)
+            if lower is None or levels[best]['latency'] < LATENCY_GROWTH * lower['latency']:
+                return higher
+        return best
+
+    def acquire(self, url):
+        """Returns the fragment concurrency for a job on the site of `url` and reserves it."""
+        with self._lock:
+            self._jobs += 1
+            fair_share = max(1, self.max_connections // self._jobs)
+            count = max(1, min(self._level(site_key(url)), fair_share, self.max_connections - self._in_use))
+            self._in_use += count
+            return count
+
+    def release(self, url, count, size=0, elapsed=0, fragments=0):
+        """Returns the reservation made by `acquire` and learns from the measured transfer."""
+        with self._lock:
+            self._jobs -= 1
+            self._in_use -= count
+            if fragments < MIN_TUNING_FRAGMENTS or elapsed <= 0 or size <= 0:
+                return
+            # Each connection fetched fragments/count fragments one after another
+            measured = {'throughput': size / elapsed, 'latency': elapsed * count / fragments}
+            levels = self._sites.setdefault(site_key(url), {})
+            stats = levels.setdefault(count, dict(measured))
+            for key, value in measured.items():
+                stats[key] += TUNING_ALPHA * (value - stats[key])
+
+
+# Attempts a job gets after transient failures, and the backoff between them in seconds.
+MAX_RETRIES = 5
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+
+def backoff_delay(attempt, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS):
+    """Returns the wait before retry number `attempt` (0-based): exponential, capped, jittered.
+
+    Half of the delay is random so jobs that failed together do not come back together.
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# Transient failures in a row that stop dispatch to a site, and how long it pauses at most.
+CIRCUIT_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 30
+CIRCUIT_MAX_COOLDOWN = 600
+
+
+class CircuitBreaker:
+    """Pauses dispatch to a site that keeps failing while other sites carry on.
+
+    After `threshold` transient failures in a row the circuit of the site opens
+    for `cooldown` seconds. Then a single job is let through as a probe: its
+    success closes the circuit, another failure opens it again for twice as
+    long, up to `max_cooldown`. A probe that reports neither is replaced by a
+    new one after a cooldown.
+    """
+    def __init__(self, threshold=CIRCUIT_THRESHOLD, cooldown=CIRCUIT_COOLDOWN, max_cooldown=CIRCUIT_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def retry_after(self, url):
+        """Returns how many seconds a job for `url` must wait; 0 lets it start (possibly as the probe)."""
+        with self._lock:
+            state = self._sites.get(site_key(url))
+            if state is None or state['failures'] < self.threshold:
+                return 0
+            now = time.monotonic()
+            wait = max(state['open_until'], (state['probe_at'] or 0) + state['cooldown']) - now
+            if wait > 0:
+                return wait
+            state['probe_at'] = now
+            return 0
+
+    def record_success(self, url):
+        with self._lock:
+            self._sites.pop(site_key(url), None)
+
+    def record_failure(self, url):
+        with self._lock:
+            state = self._sites.setdefault(site_key(url), {'failures': 0, 'cooldown': 0, 'open_until': 0, 'probe_at': None})
+            state['failures'] += 1
+            if state['failures'] == self.threshold:
+                state['cooldown'] = self.cooldown
+            elif state['failures'] < self.threshold or state['probe_at'] is None:
+                # Still closed, or a job that started before the circuit opened
+                return
+            else:
+                state['cooldown'] = min(self.max_cooldown, state['cooldown'] * 2)
+            state['open_until'] = time.monotonic() + state['cooldown']
+            state['probe_at'] = None
@@ -0,0 +1,193 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that never change which video a URL points to.
+TRACKING_PARAMS = {'t', 'si', 'feature', 'pp', 'ab_channel', 'fbclid', 'igshid', 'igsh', 'mibextid', 'rdid', 'share_url'}
+
+# Bulky fields run_download never reads; dropping them keeps cache rows small.
+DROPPED_FIELDS = ('thumbnails', 'subtitles', 'automatic_captions', 'heatmap', 'description', 'comments', 'chapters', 'tags', 'categories')
+
+# How long stream URLs are trusted when the site does not say when they expire.
+DEFAULT_STREAM_TTL = 30 * 60
+# Stream URLs expiring within this margin are treated as already expired.
+STREAM_EXPIRY_MARGIN = 5 * 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+    key TEXT PRIMARY KEY,
+    title TEXT,
+    info TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    streams_expire REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    entries TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_key ON urls(key);
+CREATE INDEX IF NOT EXISTS videos_accessed ON videos(accessed_at);
+CREATE INDEX IF NOT EXISTS playlists_accessed ON playlists(accessed_at);
+'''
+
+
+def normalize_url(url):
+    """Returns a canonical form of `url` so trivially different links share a cache entry."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS and not k.startswith('utm_')
+    )
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https', host, path, urlencode(query), ''))
+
+
+def host_key(url):
+    """Returns the site a URL belongs to, e.g. 'youtube.com' for 'https://m.youtube.com/...'."""
+    host = urlsplit(url.strip()).netloc.lower().split(':')[0]
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return host
+
+
+def _stream_expiry(info, now):
+    """Returns when the earliest stream URL in `info` stops working."""
+    expiries = []
+    for fmt in info.get('formats') or [info]:
+        match = re.search(r'[?&/]expire[=/](\d+)', fmt.get('url') or '')
+        if match:
+            expiries.append(int(match.group(1)))
+    if expiries:
+        return min(expiries) - STREAM_EXPIRY_MARGIN
+    return now + DEFAULT_STREAM_TTL
+
+
+class MetadataCache:
+    """A persistent cache of resolved video and playlist metadata.
+
+    Videos are stored once per extractor id and reached through any number of
+    normalized URLs. Entries stay valid for `ttl` seconds; the info dict is
+    only handed out while its stream URLs are still fresh. The oldest rows are
+    evicted once the cache grows past `max_bytes`.
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+            self._expire(time.time())
+
+    def _lookup(self, url):
+        return self._db.execute(
+            'SELECT v.key, v.title, v.info, v.fetched_at, v.streams_expire FROM urls u JOIN videos v ON v.key = u.key WHERE u.url = ?',
+            (normalize_url(url),)
+        ).fetchone()
+
+    def get_info(self, url):
+        """Returns a cached info dict that is still downloadable, or None."""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._lookup(url)
+            if not row or row[3] <= now - self.ttl or row[4] <= now:
+                return None
+            self._db.execute('UPDATE videos SET accessed_at = ? WHERE key = ?', (now, row[0]))
+        return json.loads(row[2])
+
+    def put_info(self, url, info):
+        """Caches a sanitized (JSON-safe) info dict under `url` and its video id."""
+        info = {k: v for k, v in info.items() if k not in DROPPED_FIELDS}
+        key = f"{info.get('extractor_key') or info.get('extractor') or 'generic'}:{info.get('id') or normalize_url(url)}"
+        data = json.dumps(info)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, info.get('title'), data, len(data), now, _stream_expiry(info, now), now)
+            )
+            for alias in {url, info.get('webpage_url'), info.get('original_url')}:
+                if alias:
+                    self._db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)', (normalize_url(alias), key))
+            self._evict()
+
+    def invalidate_streams(self, url):
+        """Marks the stream URLs cached for `url` as expired, keeping its title."""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE videos SET streams_expire = 0 WHERE key = (SELECT key FROM urls WHERE url = ?)',
+                (normalize_url(url),)
+            )
+
+    def get_playlist(self, url):
+        """Returns the cached (title, entries) of a playlist, or None."""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT title, entries, fetched_at FROM playlists WHERE url = ?', (normalize_url(url),)
+            ).fetchone()
+            if not row or row[2] <= now - self.ttl:
+                return None
+            self._db.execute('UPDATE playlists SET accessed_at = ? WHERE url = ?', (now, normalize_url(url)))
+        return row[0], json.loads(row[1])
+
+    def put_playlist(self, url, title, entries):
+        """Caches the flat entries of a playlist, keeping only the fields the UI uses."""
+        entries = [
+            {'url': e.get('url'), 'id': e.get('id'), 'title': e.get('title'), 'duration': e.get('duration')}
+            for e in entries if e
+        ]
+        data = json.dumps(entries)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?, ?)',
+                (normalize_url(url), title, data, len(data), now, now)
+            )
+            self._evict()
+
+    def _expire(self, now):
+        self._db.execute('DELETE FROM videos WHERE fetched_at <= ?', (now - self.ttl,))
+        self._db.execute('DELETE FROM playlists WHERE fetched_at <= ?', (now - self.ttl,))
+        self._db.execute('DELETE FROM urls WHERE key NOT IN (SELECT key FROM videos)')
+
+    def _evict(self):
+        # Called with the lock held. Drops least recently used rows until under max_bytes.
+        total = self._db.execute(
+            'SELECT (SELECT COALESCE(SUM(size), 0) FROM videos) + (SELECT COALESCE(SUM(size), 0) FROM playlists)'
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT 'videos', key, size, accessed_at FROM videos UNION ALL "
+            "SELECT 'playlists', url, size, accessed_at FROM playlists ORDER BY accessed_at"
+        ).fetchall()
+        for table, key, size, _ in rows:
+            if total <= self.max_bytes:
+                break
+            column = 'key' if table == 'videos' else 'url'
+            self._db.execute(f'DELETE FROM {table} WHERE {column} = ?', (key,))
+            total -= size
+        self._db.execute('DELETE FROM urls WHERE key NOT IN (SELECT key FROM videos)')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
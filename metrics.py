@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+PHASES = ('queued', 'extract', 'download', 'merge', 'transcode', 'total')
+# Finished jobs kept for the JSON export.
+RECENT_JOBS = 200
+
+
+class JobMetrics:
+    """Phase timings and transfer statistics of one job; safe to update from any thread.
+
+    `queued_since` is the time.monotonic() at which the job was queued, so
+    metrics created when it starts still time its wait in the queue.
+    """
+    def __init__(self, url, registry=None, queued_since=None):
+        now = time.monotonic()
+        queued_since = now if queued_since is None else queued_since
+        self.url = url
+        self.registry = registry
+        self.state = 'queued'
+        self.queued_at = time.time() - (now - queued_since)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.bytes = 0
+        self.peak_speed = 0.0
+        self.retries = 0
+        self._open = {'queued': queued_since, 'total': queued_since}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Ends the job's wait in the queue and lists it with the registry's running jobs."""
+        self.end('queued')
+        self.state = 'running'
+        if self.registry is not None:
+            self.registry.running(self)
+
+    def requeue(self):
+        """Puts the job back in the queue, e.g. to wait for a retry."""
+        self.start('queued')
+        self.state = 'queued'
+        if self.registry is not None:
+            self.registry.waiting(self)
+
+    def start(self, phase):
+        with self._lock:
+            self._open.setdefault(phase, time.monotonic())
+
+    def end(self, phase):
+        with self._lock:
+            started = self._open.pop(phase, None)
+            if started is not None:
+                self.phases[phase] += time.monotonic() - started
+
+    def add_bytes(self, amount, speed=None):
+        with self._lock:
+            self.bytes += amount
+            if speed and speed > self.peak_speed:
+                self.peak_speed = speed
+        if self.registry is not None:
+            self.registry.add_bytes(amount)
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def finish(self, state):
+        """Closes every open phase and reports the job to its registry."""
+        for phase in list(self._open):
+            self.end(phase)
+        self.state = state
+        if self.registry is not None:
+            self.registry.finished(self)
+
+    def as_dict(self):
+        with self._lock:
+            phases = dict(self.phases)
+            now = time.monotonic()
+            for phase, started in self._open.items():
+                phases[phase] += now - started
+        return {
+            'url': self.url, 'state': self.state, 'queued_at': self.queued_at,
+            'phases': {phase: round(seconds, 3) for phase, seconds in phases.items()},
+            'bytes': self.bytes,
+            'avg_throughput': round(self.bytes / phases['download']) if phases['download'] else 0,
+            'peak_throughput': round(self.peak_speed),
+            'retries': self.retries,
+        }
+
+
+class MetricsRegistry:
+    """Collects job metrics and periodically writes them to metrics.json and metrics.prom.
+
+    Only running jobs are listed one by one. `gauges()` should return
+    queue-wide values such as active jobs and queue depth, which is how queued
+    jobs are reported; aggregate bandwidth is measured here from the bytes jobs
+    report.
+    """
+    def __init__(self, folder, interval=5.0, gauges=None):
+        self.json_path = os.path.join(folder, 'metrics.json')
+        self.prom_path = os.path.join(folder, 'metrics.prom')
+        self.interval = interval
+        self.gauges = gauges
+        self._jobs = set()
+        self._recent = deque(maxlen=RECENT_JOBS)
+        self._states = {}
+        self._phase_sums = dict.fromkeys(PHASES, 0.0)
+        self._finished_count = 0
+        self._bytes = 0
+        self._last_bytes = 0
+        self._last_time = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def new_job(self, url, queued_since=None):
+        """Creates the metrics of a job as it starts; see JobMetrics for `queued_since`."""
+        return JobMetrics(url, self, queued_since)
+
+    def running(self, job):
+        with self._lock:
+            self._jobs.add(job)
+
+    def waiting(self, job):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def add_bytes(self, amount):
+        with self._lock:
+            self._bytes += amount
+
+    def finished(self, job):
+        record = job.as_dict()
+        with self._lock:
+            self._jobs.discard(job)
+            self._recent.append(record)
+            self._states[job.state] = self._states.get(job.state, 0) + 1
+            self._finished_count += 1
+            for phase, seconds in record['phases'].items():
+                self._phase_sums[phase] += seconds
+
+    def start(self):
+        """Writes the metrics files every `interval` seconds on a background thread."""
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                print(f"Could not write metrics: {e}")
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            bandwidth = (self._bytes - self._last_bytes) / max(now - self._last_time, 1e-6)
+            self._last_bytes, self._last_time = self._bytes, now
+            running = list(self._jobs)
+            snapshot = {
+                'updated_at': time.time(),
+                'gauges': dict(self.gauges() if self.gauges else {}, bandwidth_bytes_per_second=round(bandwidth)),
+                'totals': {
+                    'bytes': self._bytes, 'jobs': dict(self._states), 'finished_jobs': self._finished_count,
+                    'phase_seconds': {phase: round(seconds, 3) for phase, seconds in self._phase_sums.items()},
+                },
+                'recent_jobs': list(self._recent),
+            }
+        snapshot['running_jobs'] = [job.as_dict() for job in running]
+        return snapshot
+
+    def write(self):
+        """Writes both metrics files now; each is replaced atomically."""
+        snapshot = self.snapshot()
+        self._replace(self.json_path, json.dumps(snapshot, indent=1))
+        self._replace(self.prom_path, self._prometheus(snapshot))
+
+    @staticmethod
+    def _replace(path, text):
+        partial = path + '.tmp'
+        with open(partial, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(partial, path)
+
+    @staticmethod
+    def _prometheus(snapshot):
+        lines = []
+        for name, value in snapshot['gauges'].items():
+            lines += [f"# TYPE ytconverter_{name} gauge", f"ytconverter_{name} {value}"]
+        totals = snapshot['totals']
+        lines += ["# TYPE ytconverter_downloaded_bytes_total counter", f"ytconverter_downloaded_bytes_total {totals['bytes']}"]
+        lines.append("# TYPE ytconverter_jobs_total counter")
+        lines += [f'ytconverter_jobs_total{{state="{state}"}} {count}' for state, count in totals['jobs'].items()]
+        lines.append("# TYPE ytconverter_job_phase_seconds summary")
+        for phase, seconds in totals['phase_seconds'].items():
+            lines.append(f'ytconverter_job_phase_seconds_sum{{phase="{phase}"}} {seconds}')
+            lines.append(f'ytconverter_job_phase_seconds_count{{phase="{phase}"}} {totals["finished_jobs"]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,18 @@
+import os
+import sys
+import time
+
+# Entry points import this module before anything heavy, so this is close to process start.
+STARTED_AT = time.perf_counter()
+# Set to 1 to print start-up milestones and quit once the app is ready.
+TIMING_ENV = 'YTCONVERTER_STARTUP_TIMING'
+
+
+def timing_enabled():
+    return bool(os.environ.get(TIMING_ENV))
+
+
+def mark(milestone):
+    """Prints the time since start-up at `milestone` when start-up timing is enabled."""
+    if timing_enabled():
+        print(f"{milestone}: {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms", file=sys.stderr)
@@ -0,0 +1,42 @@
+import itertools
+from archive import OUTPUT_EXTS, DownloadArchive, canonical_id, existing_output
+from transcode import AUDIO_EXTENSIONS, audio_extension
+
+
+def test_formats_do_not_share_extensions():
+    for first, second in itertools.combinations(OUTPUT_EXTS, 2):
+        assert not set(OUTPUT_EXTS[first]) & set(OUTPUT_EXTS[second]), (first, second)
+
+
+def test_copied_audio_tracks_keep_to_audio_extensions():
+    for acodec in [*AUDIO_EXTENSIONS, 'mp3', 'mp4a.40.2', None]:
+        assert audio_extension(acodec) in OUTPUT_EXTS['audio']
+
+
+def test_an_mp3_conversion_is_not_taken_for_the_original_audio(tmp_path):
+    template = str(tmp_path / 'song.%(ext)s')
+    (tmp_path / 'song.mp3').write_bytes(b'mp3')
+    assert existing_output(template, 'audio') is None
+    assert existing_output(template, 'mp3') == str(tmp_path / 'song.mp3')
+
+
+def test_audio_only_webm_is_not_taken_for_a_video(tmp_path):
+    template = str(tmp_path / 'song.%(ext)s')
+    (tmp_path / 'song.opus').write_bytes(b'opus')
+    assert existing_output(template, 'mp4') is None
+    assert existing_output(template, 'audio') == str(tmp_path / 'song.opus')
+
+
+def test_archive_entries_are_keyed_on_format_and_quality(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'mp4')
+    archive = DownloadArchive(str(tmp_path / 'archive.sqlite'))
+    url = 'https://youtu.be/dQw4w9WgXcQ'
+    assert canonical_id(url) == ('youtube', 'dQw4w9WgXcQ')
+    archive.record('Youtube', 'dQw4w9WgXcQ', 'mp4', '480p', str(path))
+    assert archive.lookup('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'mp4', '480p') == str(path)
+    assert archive.lookup(url, 'mp4', '1080p') is None
+    assert archive.lookup(url, 'mp3', '480p') is None
+    path.unlink()
+    assert archive.lookup(url, 'mp4', '480p') is None
+    archive.close()
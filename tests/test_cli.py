@@ -0,0 +1,31 @@
+import pytest
+from cli import parse_args
+
+
+@pytest.mark.parametrize('argv, quality', [
+    (['-f', 'mp3', '-q', '192kbps'], '192kbps'),
+    (['-f', 'mp3', '-q', '320kbps'], '320kbps'),
+    (['-f', 'mp4', '-q', 'Best'], 'Best'),
+    (['-f', 'mp4', '-q', '1080p'], '1080p'),
+    (['-q', '360p'], '360p'),
+    (['-f', 'audio', '-q', 'Original'], 'Original'),
+    (['-f', 'mp3'], None),
+])
+def test_quality_matching_the_format_is_accepted(argv, quality):
+    assert parse_args(argv).quality == quality
+
+
+@pytest.mark.parametrize('argv', [
+    ['-f', 'mp4', '-q', '192kbps'],
+    ['-f', 'mp3', '-q', '720p'],
+    ['-f', 'mp3', '-q', '200kbps'],
+    ['-f', 'mp3', '-q', '192'],
+    ['-f', 'audio', '-q', 'Best'],
+    ['-f', 'mp4', '-q', '0p'],
+    ['-f', 'mp4', '-q', 'best'],
+])
+def test_quality_for_another_format_is_rejected(argv, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        parse_args(argv)
+    assert exit_info.value.code == 2
+    assert 'is not a quality for -f' in capsys.readouterr().err
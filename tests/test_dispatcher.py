@@ -0,0 +1,126 @@
+import threading
+import pytest
+from dispatcher import COMPACT_RATIO, DownloadDispatcher, JobQueue
+
+
+def drain(queue):
+    keys = []
+    while queue:
+        keys.append(queue.pop()[0])
+    return keys
+
+
+def filled(*keys, priority=0):
+    queue = JobQueue()
+    for key in keys:
+        queue.push(key, f'job {key}', priority)
+    return queue
+
+
+def test_higher_priorities_first_then_queue_order():
+    queue = filled('a', 'b')
+    queue.push('urgent', 'job urgent', 5)
+    queue.push('c', 'job c')
+    queue.push('later', 'job later', -1)
+    assert drain(queue) == ['urgent', 'a', 'b', 'c', 'later']
+
+
+def test_pop_returns_key_and_job_and_raises_when_empty():
+    queue = filled('a')
+    assert queue.pop() == ('a', 'job a')
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_removed_jobs_are_skipped():
+    queue = filled('a', 'b', 'c')
+    assert queue.remove('b') == 'job b'
+    assert queue.remove('b') is None
+    assert 'b' not in queue and len(queue) == 2
+    assert drain(queue) == ['a', 'c']
+
+
+def test_pushing_an_existing_key_replaces_the_job():
+    queue = filled('a', 'b')
+    queue.push('a', 'new a')
+    assert len(queue) == 2
+    assert [queue.pop(), queue.pop()] == [('b', 'job b'), ('a', 'new a')]
+
+
+def test_stale_entries_are_compacted():
+    queue = filled(*range(10))
+    for key in range(9):
+        queue.remove(key)
+    # Compaction runs as soon as stale entries exceed COMPACT_RATIO times the live ones
+    assert len(queue._heap) <= len(queue) * (COMPACT_RATIO + 1)
+    assert len(queue._lowest) <= len(queue) * (COMPACT_RATIO + 1)
+    assert drain(queue) == [9]
+
+
+def test_heaps_stay_bounded_while_jobs_pass_through():
+    queue = filled('stuck', priority=-1)
+    for key in range(1000):
+        queue.push(key, key)
+        queue.pop()
+    assert len(queue._heap) <= COMPACT_RATIO + 2
+    assert len(queue._lowest) <= COMPACT_RATIO + 2
+
+
+def test_set_priority_keeps_place_among_equal_priorities():
+    queue = filled('a', 'b', 'c')
+    queue.push('d', 'job d', 1)
+    assert queue.set_priority('c', 1)
+    assert queue.set_priority('a', 0)
+    assert not queue.set_priority('missing', 3)
+    assert queue.priority('c') == 1
+    assert queue.priorities() == {'a': 0, 'b': 0, 'c': 1, 'd': 1}
+    assert drain(queue) == ['c', 'd', 'a', 'b']
+
+
+def test_move_to_top_and_bottom():
+    queue = filled('a', 'b', 'c', 'd')
+    queue.push('low', 'job low', -2)
+    assert queue.move_to_top('c')
+    assert queue.move_to_bottom('a')
+    assert not queue.move_to_top('missing')
+    assert not queue.move_to_bottom('missing')
+    assert drain(queue) == ['c', 'b', 'd', 'low', 'a']
+
+
+def test_move_to_bottom_ignores_jobs_that_left_the_queue():
+    queue = JobQueue()
+    queue.push('gone', 'job gone', -9)
+    assert queue.pop() == ('gone', 'job gone')
+    queue.push('a', 'job a')
+    queue.push('b', 'job b')
+    queue.push('low', 'job low', -5)
+    queue.remove('low')
+    assert queue.move_to_bottom('a')
+    # The lowest priority still queued is 0, so 'a' keeps it rather than sinking to -9
+    assert queue.priority('a') == 0
+    assert drain(queue) == ['b', 'a']
+
+
+def test_pop_ready_skips_held_jobs_and_keeps_their_place():
+    queue = filled('a', 'b', 'c')
+    holds = {'job a': 30, 'job b': 0, 'job c': 10}
+    assert queue.pop_ready(holds.get) == (('b', 'job b'), 30)
+    assert queue.pop_ready(holds.get) == (None, 10)
+    assert len(queue) == 2
+    holds['job a'] = 0
+    assert queue.pop_ready(holds.get) == (('a', 'job a'), None)
+    assert drain(queue) == ['c']
+
+
+def test_dispatcher_runs_delayed_jobs_after_their_delay():
+    done = threading.Event()
+    ran = []
+    dispatcher = DownloadDispatcher(ran.append, max_workers=1, on_idle=done.set)
+    dispatcher.pause()
+    dispatcher.submit('later', key='later', delay=0.2)
+    dispatcher.submit('now', key='now')
+    assert dispatcher.pending() == 2
+    assert dispatcher.remove('now')
+    dispatcher.resume()
+    assert done.wait(5)
+    assert ran == ['later']
@@ -0,0 +1,392 @@
+import importlib.util
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+import pytest
+from archive import DownloadArchive
+from benchmark import BENCH_YDL_PARAMS, MediaHandler, MediaServer
+from dispatcher import DownloadDispatcher
+from engine import SITE_BUSY_RECHECK_SECONDS, DownloadEngine, DownloaderContext, DownloaderPool, is_cancel_error, is_retryable_error, cancelled_error, retry_after
+from limits import MAX_RETRIES, RETRY_MAX_SECONDS, FragmentTuner, HostLimiter
+from metrics import JobMetrics
+
+requires_yt_dlp = pytest.mark.skipif(importlib.util.find_spec('yt_dlp') is None, reason="yt-dlp is not installed")
+
+SEGMENTS = 40
+# Segments fetched before the job is cancelled.
+CANCEL_AFTER = 3
+
+
+class CountingHandler(MediaHandler):
+    """Serves the benchmark media and cancels the job once a few segments were requested."""
+    served = 0
+    cancel = None
+
+    def do_GET(self):
+        if self.path.endswith('.ts'):
+            type(self).served += 1
+            if self.served >= CANCEL_AFTER:
+                self.cancel.set()
+        super().do_GET()
+
+
+def serve(handler, size, segments=1, latency=0.0):
+    handler.block = os.urandom(64 * 1024)
+    handler.size, handler.segments, handler.latency = size, segments, latency
+    server = MediaServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def media_server():
+    server = serve(MediaHandler, 256 * 1024)
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def hls_server():
+    CountingHandler.served = 0
+    CountingHandler.cancel = threading.Event()
+    server = serve(CountingHandler, 64 * 1024 * SEGMENTS, SEGMENTS, 0.05)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    data = tmp_path / 'data'
+    data.mkdir()
+    output = tmp_path / 'out'
+    output.mkdir()
+    archive = DownloadArchive(str(data / 'archive.sqlite'))
+    engine = DownloadEngine(str(output), archive=archive, ydl_params=BENCH_YDL_PARAMS)
+    yield engine
+    engine.close()
+    archive.close()
+
+
+@requires_yt_dlp
+def test_cancel_error_is_not_a_yt_dlp_download_error():
+    import yt_dlp
+    error = cancelled_error()
+    assert not isinstance(error, yt_dlp.utils.DownloadError)
+    assert is_cancel_error(error)
+    assert is_cancel_error(yt_dlp.utils.DownloadError(str(error)))
+
+
+@requires_yt_dlp
+@pytest.mark.parametrize('connections', [1, 8])
+def test_cancelling_a_fragmented_download_stops_it(engine, hls_server, connections):
+    engine.fragment_tuner = FragmentTuner(max_connections=connections, max_per_job=connections)
+    events = []
+    url = f'http://127.0.0.1:{hls_server.server_address[1]}/hls/0/stream.m3u8'
+    state = engine.download(url, 'mp4', 'Best', lambda event, value: events.append(event),
+                            is_cancelled=CountingHandler.cancel.is_set)
+
+    assert state == 'cancelled'
+    assert events[-1] == 'cancelled'
+    # Only fragments already in flight may still be fetched after the cancel
+    assert CountingHandler.served < CANCEL_AFTER + connections + 2
+    assert os.listdir(engine.output_path) == []
+
+
+def two_heights(url):
+    """A video offered at 360p and 720p, both served from `url`."""
+    formats = [{'format_id': f'{height}p', 'url': url, 'ext': 'mp4', 'height': height, 'vcodec': 'avc1', 'acodec': 'mp4a'}
+               for height in (360, 720)]
+    return {'id': 'video0', 'title': 'video0', 'extractor': 'generic', 'extractor_key': 'Generic', 'webpage_url': url,
+            'formats': formats}
+
+
+@requires_yt_dlp
+def test_pooled_downloader_gives_each_job_its_own_options(media_server, tmp_path):
+    pool = DownloaderPool(BENCH_YDL_PARAMS, max_idle=1)
+    url = f'{media_server}/mp4/video0.mp4'
+    seen = {'first': [], 'second': []}
+
+    def job(name, options):
+        # Both jobs come from the same site, so the second gets the context the first gave back
+        folder = tmp_path / name
+        options = dict(options, outtmpl=str(folder / '%(title)s.%(ext)s'),
+                       progress_hooks=[lambda d: seen[name].append(d['status'])])
+        with pool.downloader(url, options) as ydl:
+            result = ydl.process_ie_result(two_heights(url), download=True)
+            assert ydl.params['outtmpl']['default'] == options['outtmpl']
+            assert ydl.merge_formats is options.get('merge_formats')
+            return ydl, result, os.listdir(folder), dict(ydl.params)
+
+    merge = lambda info: ([], info)
+    first = job('first', {'format': 'worst', 'concurrent_fragment_downloads': 4, 'merge_formats': merge})
+    second = job('second', {'format': 'best'})
+
+    assert first[0] is second[0]
+    assert first[1]['format_id'] == '360p' and second[1]['format_id'] == '720p'
+    assert first[2] == second[2] == ['video0.mp4']
+    assert first[3]['concurrent_fragment_downloads'] == 4
+    assert 'concurrent_fragment_downloads' not in second[3]
+    # Each job's hooks only heard about its own download
+    assert seen['first'].count('finished') == 1 and seen['second'].count('finished') == 1
+    # An idle context holds nothing of the last job
+    ydl = second[0]
+    assert ydl.merge_formats is None and ydl.format_selector is None and 'format' not in ydl.params
+    assert ydl.params['outtmpl']['default'] != str(tmp_path / 'second' / '%(title)s.%(ext)s')
+    pool.close()
+
+
+@requires_yt_dlp
+def test_merges_are_handed_to_the_job(tmp_path):
+    import yt_dlp
+    context = DownloaderContext({'quiet': True})
+    merged = []
+    context.prepare({'merge_formats': lambda info: (merged.append(info), ([], info))[1]})
+    info = {'filepath': str(tmp_path / 'video.mp4')}
+    assert context.ydl.run_pp(yt_dlp.postprocessor.FFmpegMergerPP(context.ydl), info) is info
+    assert merged == [info]
+    # Other postprocessors still run as usual
+    assert context.ydl.run_pp(yt_dlp.postprocessor.PostProcessor(context.ydl), info) is info
+    assert len(merged) == 1
+    context.prepare({})
+    assert context.ydl.merge_formats is None
+    context.close()
+
+
+def with_sizes(engine, monkeypatch, **fields):
+    """Makes the engine's lookups report `fields` (e.g. filesize) for the video and its formats."""
+    resolve_info = engine.resolve_info
+
+    def sized(url):
+        info, from_cache = resolve_info(url)
+        info.update(fields)
+        for fmt in info['formats']:
+            fmt.update(fields)
+        return info, from_cache
+    monkeypatch.setattr(engine, 'resolve_info', sized)
+
+
+def write_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+
+
+@requires_yt_dlp
+def test_same_titled_file_of_unknown_size_counts_as_downloaded(engine, media_server):
+    older = os.path.join(engine.output_path, 'video0.mp4')
+    write_file(older, 4)
+    url = f'{media_server}/mp4/video0.mp4'
+
+    # The server gives no size, so like yt-dlp the engine goes by the name
+    assert engine.download(url, 'mp4', 'Best', lambda event, value: None) == 'skipped'
+    assert os.listdir(engine.output_path) == ['video0.mp4']
+    assert engine.archive.lookup_id('generic', 'video0', 'mp4', 'Best') == older
+
+
+@requires_yt_dlp
+def test_same_titled_file_of_another_size_is_kept_and_downloaded_beside(engine, media_server, monkeypatch):
+    with_sizes(engine, monkeypatch, filesize=256 * 1024)
+    older = os.path.join(engine.output_path, 'video0.mp4')
+    write_file(older, 4)
+    url = f'{media_server}/mp4/video0.mp4'
+
+    assert engine.find_downloaded(url, 'mp4', 'Best') is None
+    assert engine.download(url, 'mp4', 'Best', lambda event, value: None) == 'complete'
+    assert os.path.getsize(older) == 4
+    assert os.path.getsize(os.path.join(engine.output_path, 'video0 (Best).mp4')) == 256 * 1024
+    # The new file is in the archive under its quality, so asking again skips it
+    assert engine.download(url, 'mp4', 'Best', lambda event, value: None) == 'skipped'
+
+
+@requires_yt_dlp
+def test_same_titled_file_of_the_selected_size_is_skipped(engine, media_server, monkeypatch):
+    with_sizes(engine, monkeypatch, filesize=256 * 1024)
+    # Within the tolerance for sizes that change when formats are merged
+    write_file(os.path.join(engine.output_path, 'video0.mp4'), 250 * 1024)
+    url = f'{media_server}/mp4/video0.mp4'
+
+    assert engine.download(url, 'mp4', 'Best', lambda event, value: None) == 'skipped'
+    assert os.listdir(engine.output_path) == ['video0.mp4']
+
+
+@requires_yt_dlp
+@pytest.mark.parametrize('name, size, download_format, quality, matches', [
+    ('video0.mp4', 256 * 1024, 'mp4', 'Best', True),
+    ('video0.mp4', 128 * 1024, 'mp4', 'Best', False),
+    ('video0.webm', 256 * 1024, 'mp4', 'Best', False),
+    # 60 seconds at 192 kbit/s
+    ('video0.mp3', 1440000, 'mp3', '192kbps', True),
+    ('video0.mp3', 1440000, 'mp3', '320kbps', False),
+])
+def test_matches_selection(engine, media_server, monkeypatch, name, size, download_format, quality, matches):
+    with_sizes(engine, monkeypatch, filesize=256 * 1024, duration=60)
+    url = f'{media_server}/mp4/video0.mp4'
+    path = os.path.join(engine.output_path, name)
+    write_file(path, size)
+    info, _ = engine.resolve_info(url)
+    assert engine._matches_selection(url, info, download_format, quality, path) is matches
+
+
+def test_resumed_job_accepts_its_own_finished_file(engine):
+    template = os.path.join(engine.output_path, 'video0.%(ext)s')
+    with open(template.replace('%(ext)s', 'mp4'), 'wb') as f:
+        f.write(b'done')
+    assert engine.find_downloaded('http://127.0.0.1/mp4/video0.mp4', 'mp4', 'Best', template) == template.replace('%(ext)s', 'mp4')
+
+
+def test_admit_reserves_the_site_slot_until_the_job_ends(engine, media_server):
+    engine.host_limiter = HostLimiter(limits={'127.0.0.1': 1})
+    url = f'{media_server}/mp4/video0.mp4'
+    assert engine.admit(url) == 0
+    assert engine.admit(url) == SITE_BUSY_RECHECK_SECONDS
+    assert engine.admit('https://vimeo.com/1') == 0
+    assert engine.download(url, 'mp4', 'Best', lambda event, value: None, is_cancelled=lambda: True, reserved=True) == 'cancelled'
+    assert engine.admit(url) == 0
+
+
+def test_admit_holds_back_jobs_for_an_open_circuit(engine):
+    engine.host_limiter = HostLimiter(limits={'vimeo.com': 1})
+    url = 'https://vimeo.com/1'
+    for _ in range(engine.circuit_breaker.threshold):
+        engine.circuit_breaker.record_failure(url)
+    assert engine.admit(url) > 0
+    engine.circuit_breaker.record_success(url)
+    # The held job gave its site slot back
+    assert engine.admit(url) == 0
+
+
+@requires_yt_dlp
+def test_jobs_for_a_busy_site_do_not_hold_up_other_sites(engine, media_server):
+    # One connection to 127.0.0.1 at a time; localhost counts as another site
+    engine.host_limiter = HostLimiter(limits={'127.0.0.1': 1})
+    slow = serve(MediaHandler, 64 * 1024 * 20, 20, 0.05)
+    port = media_server.rsplit(':', 1)[1]
+    jobs = [f'http://127.0.0.1:{slow.server_address[1]}/hls/0/stream.m3u8', f'{media_server}/mp4/video1.mp4',
+            f'http://localhost:{port}/mp4/video2.mp4']
+    finished = []
+    done = threading.Event()
+
+    def run(url):
+        engine.download(url, 'mp4', 'Best', lambda event, value: event == 'complete' and finished.append(url), reserved=True)
+
+    dispatcher = DownloadDispatcher(run, max_workers=2, on_idle=done.set, gate=lambda url: engine.admit(url))
+    dispatcher.pause()
+    for url in jobs:
+        dispatcher.submit(url)
+    dispatcher.resume()
+    try:
+        assert done.wait(30)
+    finally:
+        slow.shutdown()
+        slow.server_close()
+    # The second 127.0.0.1 job waited in the queue, leaving the worker to the localhost job
+    assert finished == [jobs[2], jobs[0], jobs[1]]
+
+
+def test_metadata_lookups_share_one_limit_per_site(engine):
+    assert engine._host_slot('https://youtu.be/dQw4w9WgXcQ') is engine._host_slot('https://www.youtube.com/watch?v=x')
+    assert engine._host_slot('https://m.youtube.com/watch?v=y') is engine._host_slot('https://music.youtube.com/watch?v=z')
+    assert engine._host_slot('https://vimeo.com/1') is not engine._host_slot('https://youtube.com/watch?v=x')
+
+
+# --- Retries ---
+
+class FakeResponse:
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP Error {status}")
+        self.status = status
+        self.response = FakeResponse(status, headers)
+
+
+class WrappingError(Exception):
+    """Carries the original error in exc_info, like yt-dlp's DownloadError."""
+    def __init__(self, message, cause):
+        super().__init__(message)
+        self.exc_info = (type(cause), cause, None)
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (FakeHTTPError(503), True),
+    (FakeHTTPError(429), True),
+    (FakeHTTPError(404), False),
+    (FakeHTTPError(403), False),
+    (TimeoutError("read timed out"), True),
+    (ConnectionResetError(), True),
+    (WrappingError("ERROR: unable to download", FakeHTTPError(502)), True),
+    (WrappingError("ERROR: HTTP Error 503: Service Unavailable", FakeHTTPError(404)), False),
+    (Exception("ERROR: HTTP Error 504: Gateway Timeout"), True),
+    (Exception("ERROR: Connection reset by peer"), True),
+    (Exception("ERROR: Unsupported URL"), False),
+])
+def test_is_retryable_error(error, retryable):
+    assert is_retryable_error(error) is retryable
+
+
+@pytest.mark.parametrize('headers, seconds', [
+    ({'Retry-After': '7'}, 7),
+    ({'Retry-After': ' 12 '}, 12),
+    ({'Retry-After': '99999'}, RETRY_MAX_SECONDS),
+    ({'Retry-After': 'Wed, 21 Oct 2026 07:28:00 GMT'}, 0),
+    ({'Retry-After': '-3'}, 0),
+    ({}, 0),
+])
+def test_retry_after_header(headers, seconds):
+    assert retry_after(WrappingError("ERROR: HTTP Error 503", FakeHTTPError(503, headers))) == seconds
+
+
+def test_retry_after_without_a_response():
+    assert retry_after(TimeoutError()) == 0
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Answers /<status>/<name>.mp4 with that HTTP status and a Retry-After of 7 seconds."""
+    def do_GET(self):
+        self.send_response(int(self.path.split('/')[1]))
+        self.send_header('Retry-After', '7')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def status_server():
+    server = MediaServer(('127.0.0.1', 0), StatusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@requires_yt_dlp
+def test_server_errors_are_retried_until_the_limit(engine, status_server):
+    url = f'{status_server}/503/video.mp4'
+    metrics = JobMetrics(url)
+    for attempt in range(MAX_RETRIES):
+        events = []
+        assert engine.download(url, 'mp4', 'Best', lambda event, value: events.append((event, value)), metrics=metrics) == 'retry'
+        event, delay = events[-1]
+        assert event == 'retry' and delay >= 7
+        assert metrics.retries == attempt + 1
+    events = []
+    assert engine.download(url, 'mp4', 'Best', lambda event, value: events.append(event), metrics=metrics) == 'error'
+    assert events[-1] == 'error'
+    # Six failures in a row have opened the site's circuit
+    assert engine.circuit_breaker.retry_after(url) > 0
+
+
+@requires_yt_dlp
+def test_missing_files_fail_without_a_retry(engine, status_server):
+    url = f'{status_server}/404/video.mp4'
+    events = []
+    assert engine.download(url, 'mp4', 'Best', lambda event, value: events.append(event)) == 'error'
+    assert 'retry' not in events
+    assert engine.circuit_breaker.retry_after(url) == 0
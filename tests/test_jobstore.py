@@ -0,0 +1,68 @@
+from jobstore import ACTIVE_STATES, FINISHED_STATES, JobState, JobStore
+
+
+def test_new_jobs_are_queued_with_increasing_ids():
+    store = JobStore()
+    first = store.add('https://a', 'mp4', 'Best', journal_id=7)
+    second = store.add('https://b', 'mp3', '192kbps')
+    assert (first.id, second.id) == (1, 2)
+    assert first.journal_id == 7 and first.state is JobState.QUEUED and not first.finished
+    assert len(store) == 2 and 1 in store and store.get(3) is None
+    assert store.ids(JobState.QUEUED) == [1, 2]
+
+
+def test_state_index_follows_state_changes():
+    store = JobStore()
+    for n in range(4):
+        store.add(f'https://{n}', 'mp4', 'Best')
+    store.set_state(3, JobState.RUNNING)
+    store.set_state(1, JobState.COMPLETE)
+    store.set_state(2, JobState.ERROR)
+    assert store.ids(JobState.QUEUED) == [4]
+    assert store.ids(*ACTIVE_STATES) == [3, 4]
+    assert store.ids(*FINISHED_STATES) == [1, 2]
+    assert store.count(*FINISHED_STATES) == 2
+    assert store.get(1).finished
+    assert store.set_state(99, JobState.COMPLETE) is None
+
+
+def test_version_changes_only_when_jobs_or_states_change():
+    store = JobStore()
+    start = store.version
+    job = store.add('https://a', 'mp4', 'Best')
+    after_add = store.version
+    assert after_add != start
+    store.set_state(job.id, JobState.QUEUED)
+    assert store.version == after_add
+    store.set_state(job.id, JobState.RUNNING)
+    after_state = store.version
+    assert after_state != after_add
+    assert store.remove([42]) == []
+    assert store.version == after_state
+    store.remove([job.id])
+    assert store.version != after_state
+
+
+def test_remove_finished_leaves_active_jobs():
+    store = JobStore()
+    for n in range(5):
+        store.add(f'https://{n}', 'mp4', 'Best', journal_id=n * 10)
+    store.set_state(2, JobState.SKIPPED)
+    store.set_state(4, JobState.CANCELLED)
+    store.set_state(5, JobState.RETRYING)
+    cleared = store.remove_finished()
+    assert [job.journal_id for job in cleared] == [10, 30]
+    assert store.ids(*JobState) == [1, 3, 5]
+    assert store.count(*FINISHED_STATES) == 0
+    assert store.remove_finished() == []
+
+
+def test_oldest_skips_jobs_that_do_not_match():
+    store = JobStore()
+    for n in range(3):
+        store.add(f'https://{n}', 'mp4', 'Best')
+    store.set_state(1, JobState.RUNNING)
+    store.get(1).cancelled = True
+    assert store.oldest(*ACTIVE_STATES).id == 1
+    assert store.oldest(*ACTIVE_STATES, where=lambda job: not job.cancelled).id == 2
+    assert store.oldest(*FINISHED_STATES) is None
@@ -0,0 +1,35 @@
+from journal import JobJournal
+
+
+def test_only_unfinished_jobs_come_back_after_a_restart(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite')
+    journal = JobJournal(path)
+    queued = journal.add('https://example.com/queued', 'mp3', '192kbps')
+    running = journal.add('https://example.com/running', 'mp4', '720p')
+    journal.update(running, state='running', title='Running', output_template='/music/Running (720p).%(ext)s')
+    for state in ('complete', 'cancelled', 'error'):
+        job_id = journal.add(f'https://example.com/{state}', 'audio', 'Original')
+        journal.update(job_id, state='running', output_template=f'/music/{state}.%(ext)s')
+        journal.update(job_id, state=state)
+    cleared = journal.add('https://example.com/cleared', 'mp3', '320kbps')
+    journal.remove([cleared])
+    journal.close()
+
+    reopened = JobJournal(path)
+    try:
+        assert reopened.unfinished() == [
+            (queued, 'https://example.com/queued', 'mp3', '192kbps', None, None),
+            (running, 'https://example.com/running', 'mp4', '720p', 'Running', '/music/Running (720p).%(ext)s'),
+        ]
+    finally:
+        reopened.close()
+
+
+def test_updates_keep_fields_that_are_not_given(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.sqlite'))
+    job_id = journal.add('https://example.com/a', 'mp3', '192kbps')
+    journal.update(job_id, title='A', output_template='/music/A.%(ext)s')
+    # Marking the job as queued again for a retry must not lose its template
+    journal.update(job_id, state='queued')
+    assert journal.unfinished() == [(job_id, 'https://example.com/a', 'mp3', '192kbps', 'A', '/music/A.%(ext)s')]
+    journal.close()
@@ -0,0 +1,329 @@
+import pytest
+import limits
+from limits import CircuitBreaker, FragmentTuner, HostLimiter, TokenBucket, backoff_delay, parse_rate, site_key
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping only moves the clock forward."""
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(limits, 'time', clock)
+    return clock
+
+
+# --- Retry backoff ---
+
+@pytest.mark.parametrize('attempt', range(8))
+def test_backoff_delay_is_half_fixed_half_jitter(monkeypatch, attempt):
+    full = min(limits.RETRY_MAX_SECONDS, limits.RETRY_BASE_SECONDS * 2 ** attempt)
+    monkeypatch.setattr(limits.random, 'uniform', lambda low, high: low)
+    assert backoff_delay(attempt) == full / 2
+    monkeypatch.setattr(limits.random, 'uniform', lambda low, high: high)
+    assert backoff_delay(attempt) == full
+
+
+def test_backoff_delay_stays_within_bounds():
+    for attempt in range(limits.MAX_RETRIES):
+        full = min(limits.RETRY_MAX_SECONDS, limits.RETRY_BASE_SECONDS * 2 ** attempt)
+        for _ in range(100):
+            assert full / 2 <= backoff_delay(attempt) <= full
+    assert backoff_delay(30) <= limits.RETRY_MAX_SECONDS
+
+
+# --- Circuit breaker ---
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+def open_circuit(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure(URL)
+
+
+def test_circuit_stays_closed_below_the_threshold(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    breaker.record_failure(URL)
+    breaker.record_failure(URL)
+    assert breaker.retry_after(URL) == 0
+    breaker.record_success(URL)
+    breaker.record_failure(URL)
+    breaker.record_failure(URL)
+    assert breaker.retry_after(URL) == 0
+
+
+def test_circuit_opens_for_the_cooldown_then_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    open_circuit(breaker)
+    assert breaker.retry_after(URL) == 30
+    clock.advance(10)
+    assert breaker.retry_after(URL) == 20
+    # Other sites are not affected
+    assert breaker.retry_after('https://vimeo.com/1') == 0
+    clock.advance(20)
+    assert breaker.retry_after(URL) == 0
+    # Half open: everyone else waits while the probe runs
+    assert breaker.retry_after(URL) == 30
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    open_circuit(breaker)
+    clock.advance(30)
+    assert breaker.retry_after(URL) == 0
+    breaker.record_success(URL)
+    assert breaker.retry_after(URL) == 0
+    assert breaker.retry_after(URL) == 0
+
+
+def test_failed_probe_reopens_for_twice_as_long_up_to_the_maximum(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30, max_cooldown=100)
+    open_circuit(breaker)
+    for expected in (60, 100, 100):
+        clock.advance(breaker.retry_after(URL))
+        assert breaker.retry_after(URL) == 0
+        breaker.record_failure(URL)
+        assert breaker.retry_after(URL) == expected
+
+
+def test_failures_of_jobs_started_before_the_circuit_opened_do_not_extend_it(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    open_circuit(breaker)
+    clock.advance(5)
+    breaker.record_failure(URL)
+    breaker.record_failure(URL)
+    assert breaker.retry_after(URL) == 25
+
+
+def test_abandoned_probe_is_replaced_after_a_cooldown(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    open_circuit(breaker)
+    clock.advance(30)
+    assert breaker.retry_after(URL) == 0
+    clock.advance(30)
+    assert breaker.retry_after(URL) == 0
+
+
+def test_circuit_is_shared_by_a_site_and_its_aliases(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=30)
+    breaker.record_failure('https://youtu.be/dQw4w9WgXcQ')
+    breaker.record_failure('https://m.youtube.com/watch?v=x')
+    assert breaker.retry_after(URL) == 30
+
+
+# --- Speed limit ---
+
+@pytest.mark.parametrize('text, rate', [
+    ('500K', 500 * 1024),
+    ('2M', 2 * 1024 ** 2),
+    ('1.5MB', int(1.5 * 1024 ** 2)),
+    ('1G', 1024 ** 3),
+    ('800', 800),
+    ('500k', 500 * 1024),
+    (' 2 MiB/s ', 2 * 1024 ** 2),
+    ('', None),
+    ('   ', None),
+    (None, None),
+])
+def test_parse_rate(text, rate):
+    assert parse_rate(text) == rate
+
+
+@pytest.mark.parametrize('text', ['fast', '2X', '-1M', 'M', '1.M', '1,5M', '2M 3K'])
+def test_parse_rate_rejects_invalid_input(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+
+def test_unlimited_bucket_never_sleeps(clock):
+    bucket = TokenBucket()
+    for _ in range(100):
+        bucket.consume(10 ** 9)
+    assert clock.slept == []
+
+
+def test_bucket_sleeps_off_what_runs_ahead_of_the_rate(clock):
+    bucket = TokenBucket(1000)
+    # The first second's worth is available straight away
+    bucket.consume(1000)
+    assert clock.slept == []
+    bucket.consume(500)
+    assert clock.slept == [0.5]
+    bucket.consume(2000)
+    assert clock.slept == [0.5, 2.0]
+
+
+def test_bucket_refills_at_the_rate(clock):
+    bucket = TokenBucket(1000)
+    bucket.consume(1000)
+    clock.advance(0.25)
+    bucket.consume(250)
+    assert clock.slept == []
+    clock.advance(0.25)
+    bucket.consume(400)
+    assert clock.slept == pytest.approx([0.15])
+
+
+def test_bucket_saves_up_at_most_one_second(clock):
+    bucket = TokenBucket(1000)
+    clock.advance(60)
+    bucket.consume(1000)
+    assert clock.slept == []
+    bucket.consume(1000)
+    assert clock.slept == [1.0]
+
+
+def test_bucket_budget_is_shared_fairly(clock):
+    bucket = TokenBucket(1000)
+    slept = {'a': 0.0, 'b': 0.0}
+    start = clock.now
+    for _ in range(50):
+        for consumer in slept:
+            before = clock.now
+            bucket.consume(1000)
+            slept[consumer] += clock.now - before
+    # Together the downloads get the budget, not twice it, and each pays for its own share
+    assert clock.now - start == pytest.approx(99)
+    assert slept['a'] == pytest.approx(49)
+    assert slept['b'] == pytest.approx(50)
+
+
+def test_changing_the_rate_takes_effect_at_once(clock):
+    bucket = TokenBucket(1000)
+    bucket.consume(1000)
+    bucket.set_rate(4000)
+    bucket.consume(6000)
+    assert clock.slept == [0.5]
+    bucket.set_rate(None)
+    bucket.consume(10 ** 9)
+    assert clock.slept == [0.5]
+
+
+# --- Per-site limits ---
+
+def free_slots(slot):
+    count = 0
+    while slot.acquire(blocking=False):
+        count += 1
+    for _ in range(count):
+        slot.release()
+    return count
+
+
+@pytest.mark.parametrize('url, site', [
+    ('https://www.instagram.com/p/abc/', 'instagram.com'),
+    ('https://instagr.am/p/abc/', 'instagram.com'),
+    ('https://m.facebook.com/watch/?v=1', 'facebook.com'),
+    ('https://fb.watch/abc/', 'facebook.com'),
+    ('https://www.tiktok.com/@user/video/1', 'tiktok.com'),
+    ('https://youtu.be/dQw4w9WgXcQ', 'youtube.com'),
+    ('https://music.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube.com'),
+    ('https://vimeo.com/1', 'vimeo.com'),
+])
+def test_site_caps_follow_host_limits(url, site):
+    assert site_key(url) == site
+    expected = limits.HOST_LIMITS.get(site, limits.DEFAULT_HOST_LIMIT)
+    assert free_slots(HostLimiter().slot(url)) == expected
+
+
+def test_aliases_share_their_site_slot():
+    limiter = HostLimiter()
+    slot = limiter.slot('https://www.instagram.com/p/abc/')
+    assert limiter.slot('https://instagr.am/p/def/') is slot
+    with slot:
+        with limiter.slot('https://instagr.am/p/def/'):
+            assert not slot.acquire(blocking=False)
+    assert free_slots(slot) == 2
+
+
+def test_unlisted_sites_get_their_own_default_slot():
+    limiter = HostLimiter(limits={'example.com': 1}, default_limit=2)
+    assert free_slots(limiter.slot('https://example.com/a')) == 1
+    vimeo = limiter.slot('https://vimeo.com/1')
+    assert vimeo is not limiter.slot('https://dailymotion.com/video/1')
+    assert free_slots(vimeo) == 2
+
+
+# --- Fragment concurrency ---
+
+MB = 1024 ** 2
+
+
+def run_job(tuner, throughput, latency, url=URL, fragments=None):
+    """Runs one job through the tuner at the level it picks and reports the measurement."""
+    count = tuner.acquire(url)
+    elapsed = 10
+    if fragments is None:
+        fragments = round(elapsed * count / latency)
+    tuner.release(url, count, size=throughput * elapsed, elapsed=elapsed, fragments=fragments)
+    return count
+
+
+def test_new_sites_start_at_the_default_level():
+    tuner = FragmentTuner()
+    assert run_job(tuner, MB, 1.0, url='https://vimeo.com/1') == limits.DEFAULT_FRAGMENTS
+    # What was learned about one site does not move another
+    assert run_job(tuner, MB, 1.0) == limits.DEFAULT_FRAGMENTS
+
+
+def test_level_doubles_while_latency_barely_grows():
+    tuner = FragmentTuner(max_connections=64, max_per_job=16)
+    assert run_job(tuner, MB, 1.0) == 4
+    assert run_job(tuner, 2 * MB, 1.25) == 8
+    assert run_job(tuner, 2.05 * MB, 2.0) == 16
+    # Sixteen connections were no faster than eight, so the tuner goes back down
+    assert tuner.acquire(URL) == 8
+
+
+def test_level_stays_when_latency_grows_with_the_connections():
+    tuner = FragmentTuner(max_connections=64, max_per_job=16)
+    run_job(tuner, MB, 1.0)
+    assert run_job(tuner, 1.5 * MB, 2.0) == 8
+    assert tuner.acquire(URL) == 8
+
+
+def test_level_is_lowered_when_more_connections_were_slower():
+    tuner = FragmentTuner()
+    run_job(tuner, 2 * MB, 1.0)
+    assert run_job(tuner, MB, 3.0) == 8
+    assert tuner.acquire(URL) == 4
+
+
+def test_short_downloads_are_not_learned_from():
+    tuner = FragmentTuner()
+    run_job(tuner, MB, 1.0, fragments=limits.MIN_TUNING_FRAGMENTS - 1)
+    assert tuner.acquire(URL) == limits.DEFAULT_FRAGMENTS
+
+
+def test_level_is_capped_per_job():
+    tuner = FragmentTuner(max_connections=64, max_per_job=8)
+    run_job(tuner, MB, 1.0)
+    run_job(tuner, 2 * MB, 1.0)
+    assert tuner.acquire(URL) == 8
+
+
+def test_jobs_share_the_global_cap():
+    tuner = FragmentTuner(max_connections=10)
+    # The first two fit at the default level, the third gets what is left of the pool
+    # and a fourth still gets one connection
+    assert [tuner.acquire(URL) for _ in range(2)] == [4, 4]
+    assert tuner.acquire(URL) == 2
+    assert tuner.acquire(URL) == 1
+    tuner.release(URL, 4)
+    tuner.release(URL, 1)
+    assert tuner.acquire(URL) == 3
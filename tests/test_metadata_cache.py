@@ -0,0 +1,113 @@
+import json
+import pytest
+import metadata_cache
+from metadata_cache import DEFAULT_STREAM_TTL, STREAM_EXPIRY_MARGIN, MetadataCache, normalize_url
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ&si=share'
+HOUR = 3600
+
+
+class FakeClock:
+    """Stands in for the time module."""
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(metadata_cache, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = MetadataCache(str(tmp_path / 'metadata.sqlite'), ttl=24 * HOUR)
+    yield cache
+    cache.close()
+
+
+def video(video_id='dQw4w9WgXcQ', stream_url='https://cdn.example.com/v.mp4', **fields):
+    return {'id': video_id, 'extractor_key': 'Youtube', 'title': f'Video {video_id}',
+            'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+            'formats': [{'format_id': '18', 'url': stream_url}], **fields}
+
+
+def test_info_is_found_through_any_alias(cache):
+    cache.put_info(URL, video(description='long text', thumbnails=[{'url': 'x'}]))
+    for url in (URL, 'https://m.youtube.com/watch?v=dQw4w9WgXcQ', 'https://youtube.com/watch?v=dQw4w9WgXcQ&t=42'):
+        info = cache.get_info(url)
+        assert info['title'] == 'Video dQw4w9WgXcQ'
+    # Fields the downloader never reads are not stored
+    assert 'description' not in info and 'thumbnails' not in info
+    assert cache.get_info('https://www.youtube.com/watch?v=another0000') is None
+
+
+def test_streams_without_an_expiry_are_trusted_for_the_default_time(cache, clock):
+    cache.put_info(URL, video())
+    clock.advance(DEFAULT_STREAM_TTL - 1)
+    assert cache.get_info(URL) is not None
+    clock.advance(2)
+    assert cache.get_info(URL) is None
+
+
+def test_streams_expire_when_the_site_says_so(cache, clock):
+    expires = int(clock.now) + 6 * HOUR
+    cache.put_info(URL, video(stream_url=f'https://rr1.googlevideo.com/videoplayback?expire={expires}&id=1'))
+    clock.advance(6 * HOUR - STREAM_EXPIRY_MARGIN - 1)
+    assert cache.get_info(URL) is not None
+    clock.advance(2)
+    assert cache.get_info(URL) is None
+
+
+def test_invalidated_streams_are_not_handed_out_again(cache):
+    cache.put_info(URL, video())
+    cache.invalidate_streams('https://youtu.be/dQw4w9WgXcQ')
+    assert cache.get_info(URL) is not None
+    cache.invalidate_streams(URL)
+    assert cache.get_info(URL) is None
+    # A fresh lookup replaces the entry
+    cache.put_info(URL, video())
+    assert cache.get_info(URL) is not None
+
+
+def test_entries_expire_after_the_ttl(tmp_path, cache, clock):
+    cache.put_playlist('https://www.youtube.com/playlist?list=PL1', 'Mix', [{'url': URL, 'id': 'dQw4w9WgXcQ', 'title': 'Video'}])
+    clock.advance(24 * HOUR - 1)
+    assert cache.get_playlist('https://youtube.com/playlist?list=PL1') == ('Mix', [
+        {'url': URL, 'id': 'dQw4w9WgXcQ', 'title': 'Video', 'duration': None}])
+    clock.advance(2)
+    assert cache.get_playlist('https://youtube.com/playlist?list=PL1') is None
+
+    cache.put_info(URL, video())
+    clock.advance(24 * HOUR)
+    cache.close()
+    # Opening the cache deletes what has expired
+    reopened = MetadataCache(str(tmp_path / 'metadata.sqlite'), ttl=24 * HOUR)
+    counts = [reopened._db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ('videos', 'urls', 'playlists')]
+    reopened.close()
+    assert counts == [0, 0, 0]
+
+
+def test_least_recently_used_rows_are_evicted_past_max_bytes(tmp_path, clock):
+    size = len(json.dumps(video('aaaaaaaaaaa')))
+    cache = MetadataCache(str(tmp_path / 'metadata.sqlite'), max_bytes=3 * size)
+    urls = [f'https://www.youtube.com/watch?v={c * 11}' for c in 'abc']
+    for url in urls:
+        cache.put_info(url, video(url[-11:]))
+        clock.advance(1)
+    # Reading the oldest entry makes the second one the least recently used
+    assert cache.get_info(urls[0]) is not None
+    clock.advance(1)
+    cache.put_info('https://www.youtube.com/watch?v=ddddddddddd', video('ddddddddddd'))
+
+    assert cache.get_info(urls[1]) is None
+    assert cache.get_info(urls[0]) is not None and cache.get_info(urls[2]) is not None
+    assert cache._db.execute('SELECT COUNT(*) FROM urls WHERE url = ?', (normalize_url(urls[1]),)).fetchone()[0] == 0
+    cache.close()
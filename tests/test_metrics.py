@@ -0,0 +1,65 @@
+import json
+import time
+from metrics import MetricsRegistry
+
+
+def running_urls(registry):
+    return [job['url'] for job in registry.snapshot()['running_jobs']]
+
+
+def test_only_running_jobs_are_listed(tmp_path):
+    registry = MetricsRegistry(str(tmp_path), gauges=lambda: {'queue_depth': 100000})
+    job = registry.new_job('https://example.com/a')
+    assert running_urls(registry) == []
+    job.begin()
+    assert running_urls(registry) == ['https://example.com/a']
+    assert registry.snapshot()['running_jobs'][0]['state'] == 'running'
+    # Queued jobs are only counted
+    assert registry.snapshot()['gauges']['queue_depth'] == 100000
+
+
+def test_jobs_waiting_for_a_retry_are_not_listed(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    job = registry.new_job('https://example.com/a')
+    job.begin()
+    job.add_retry()
+    job.requeue()
+    assert running_urls(registry) == []
+    job.begin()
+    assert running_urls(registry) == ['https://example.com/a']
+    assert job.retries == 1
+
+
+def test_finished_jobs_move_to_the_totals(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    job = registry.new_job('https://example.com/a')
+    job.begin()
+    job.add_bytes(1000)
+    job.finish('complete')
+    # Jobs cancelled before they started are reported the same way
+    registry.new_job('https://example.com/b').finish('cancelled')
+    snapshot = registry.snapshot()
+    assert snapshot['running_jobs'] == []
+    assert [record['state'] for record in snapshot['recent_jobs']] == ['complete', 'cancelled']
+    assert snapshot['totals']['jobs'] == {'complete': 1, 'cancelled': 1}
+    assert snapshot['totals']['bytes'] == 1000
+
+
+def test_queued_phase_starts_when_the_job_was_queued(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    job = registry.new_job('https://example.com/a', queued_since=time.monotonic() - 5)
+    job.begin()
+    record = job.as_dict()
+    assert 5 <= record['phases']['queued'] < 6
+    assert record['phases']['total'] >= 5
+    assert time.time() - record['queued_at'] >= 5
+
+
+def test_write_replaces_both_files(tmp_path):
+    registry = MetricsRegistry(str(tmp_path), gauges=lambda: {'queue_depth': 3})
+    registry.new_job('https://example.com/a').begin()
+    registry.write()
+    assert running_urls(registry) == ['https://example.com/a']
+    assert json.loads((tmp_path / 'metrics.json').read_text())['gauges']['queue_depth'] == 3
+    assert 'ytconverter_queue_depth 3' in (tmp_path / 'metrics.prom').read_text()
+    assert not list(tmp_path.glob('*.tmp'))
@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import threading
+import time
+import pytest
+from engine import DownloadEngine, JobCancelled
+from metrics import JobMetrics
+from transcode import TranscodeCancelled, TranscodeError, Transcoder, merge_streams, mp3_encoding
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason="the fake ffmpeg is a shebang script")
+
+# Records its arguments next to the output, takes FAKE_FFMPEG_SECONDS, then writes the output
+# or fails as told by FAKE_FFMPEG_EXIT.
+FAKE_FFMPEG = '''#!{python}
+import json, os, sys, time
+output = sys.argv[-1]
+with open(output + '.args', 'w') as f:
+    json.dump(sys.argv[1:], f)
+with open(output, 'wb') as f:
+    f.write(b'partial')
+time.sleep(float(os.environ.get('FAKE_FFMPEG_SECONDS', '0')))
+code = int(os.environ.get('FAKE_FFMPEG_EXIT', '0'))
+if code:
+    sys.stderr.write('conversion failed')
+else:
+    with open(output, 'wb') as f:
+        f.write(b'converted')
+sys.exit(code)
+'''
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    path.chmod(0o755)
+    return str(path)
+
+
+def convert(transcoder, source, target):
+    done = threading.Event()
+    errors = []
+    transcoder.submit(str(source), str(target), mp3_encoding(192), lambda error: (errors.append(error), done.set()))
+    assert done.wait(10)
+    return errors[0]
+
+
+def test_thread_limit_applies_to_the_encoder(ffmpeg, tmp_path):
+    source = tmp_path / 'song.source.m4a'
+    source.write_bytes(b'audio')
+    target = tmp_path / 'song.mp3'
+    assert convert(Transcoder(ffmpeg, workers=1, threads=2), source, target) is None
+    assert target.read_bytes() == b'converted'
+
+    with open(str(tmp_path / 'song.part.mp3.args')) as f:
+        args = json.load(f)
+    assert args.index('-threads') > args.index('-i')
+    assert args[args.index('-threads') + 1] == '2'
+
+
+def test_failed_conversion_leaves_no_partial_output(ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_EXIT', '1')
+    source = tmp_path / 'song.source.m4a'
+    source.write_bytes(b'audio')
+    error = convert(Transcoder(ffmpeg, workers=1), source, tmp_path / 'song.mp3')
+    assert isinstance(error, TranscodeError) and 'conversion failed' in str(error)
+    assert not (tmp_path / 'song.part.mp3').exists()
+    assert not (tmp_path / 'song.mp3').exists()
+
+
+def test_engine_removes_the_source_when_conversion_fails(ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_EXIT', '1')
+    idle = threading.Event()
+    engine = DownloadEngine(str(tmp_path), transcoder=Transcoder(ffmpeg, workers=1, on_idle=idle.set))
+    source = tmp_path / 'song.source.m4a'
+    source.write_bytes(b'audio')
+    events = []
+    url = 'https://example.com/song'
+
+    state = engine._transcode(url, {}, 'mp3', '192kbps', str(source), str(tmp_path / 'song.mp3'), mp3_encoding(192),
+                              None, lambda event, value: events.append(event), lambda: False, JobMetrics(url))
+    assert state == 'converting'
+    assert idle.wait(10)
+    assert events[-1] == 'error'
+    assert sorted(os.listdir(tmp_path)) == ['ffmpeg', 'song.part.mp3.args']
+
+
+# A 1080p MP4 video stream and an HLS AAC audio stream, as yt-dlp lists them in requested_formats.
+REQUESTED_FORMATS = [
+    {'format_id': '137', 'vcodec': 'avc1.640028', 'acodec': 'none', 'protocol': 'https'},
+    {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'protocol': 'm3u8_native'},
+]
+
+
+def test_merge_copies_the_video_of_one_format_and_the_audio_of_the_other():
+    args = merge_streams(REQUESTED_FORMATS)
+    assert args[:2] == ['-c', 'copy']
+    assert args[2:] == ['-map', '0:v:0', '-map', '1:a:0', '-bsf:a:0', 'aac_adtstoasc', '-movflags', '+faststart']
+
+
+def test_merge_runs_ffmpeg_on_the_calling_thread(ffmpeg, tmp_path):
+    sources = [str(tmp_path / 'video.f137.mp4'), str(tmp_path / 'video.f140.mp4')]
+    target = tmp_path / 'video.mp4'
+    Transcoder(ffmpeg, workers=1).merge(sources, str(target), merge_streams(REQUESTED_FORMATS))
+    assert target.read_bytes() == b'converted'
+    with open(str(tmp_path / 'video.part.mp4.args')) as f:
+        args = json.load(f)
+    assert args[args.index('-i') + 1] == sources[0]
+    assert args[args.index('-i', args.index('-i') + 1) + 1] == sources[1]
+
+
+def test_cancelling_a_merge_kills_ffmpeg(ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_SECONDS', '30')
+    cancelled = threading.Event()
+    threading.Timer(0.5, cancelled.set).start()
+    started = time.monotonic()
+    with pytest.raises(TranscodeCancelled):
+        Transcoder(ffmpeg, workers=1).merge([str(tmp_path / 'video.f137.mp4')], str(tmp_path / 'video.mp4'),
+                                            ['-c', 'copy'], cancelled.is_set)
+    assert time.monotonic() - started < 5
+    assert not (tmp_path / 'video.part.mp4').exists()
+    assert not (tmp_path / 'video.mp4').exists()
+
+
+def test_engine_merge_reports_a_cancelled_job(ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_FFMPEG_SECONDS', '30')
+    engine = DownloadEngine(str(tmp_path), transcoder=Transcoder(ffmpeg, workers=1))
+    files = [str(tmp_path / 'video.f137.mp4'), str(tmp_path / 'video.f140.mp4')]
+    info = {'filepath': str(tmp_path / 'video.mp4'), '__files_to_merge': files, 'requested_formats': REQUESTED_FORMATS}
+    cancelled = threading.Event()
+    threading.Timer(0.5, cancelled.set).start()
+    events = []
+    with pytest.raises(JobCancelled):
+        engine._merge_formats(info, lambda event, value: events.append(value), cancelled.is_set, JobMetrics('https://example.com/v'))
+    assert events == ["Merging..."]
+    assert not (tmp_path / 'video.part.mp4').exists()
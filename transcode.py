@@ -0,0 +1,170 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads each ffmpeg process may use; with one process per core this keeps the CPU busy without oversubscribing it.
+FFMPEG_THREADS = 1
+# How often a running conversion checks whether its job was cancelled, in seconds.
+CANCEL_POLL_SECONDS = 0.25
+
+# Copies the audio track as it is, without decoding or encoding it.
+COPY_AUDIO = ['-codec:a', 'copy']
+
+# File extension for an audio track copied out of its container, by codec. Other codecs,
+# MP3 among them, go into .mka so the copy is never mistaken for an MP3 conversion.
+AUDIO_EXTENSIONS = {'mp4a': 'm4a', 'aac': 'm4a', 'opus': 'opus', 'vorbis': 'ogg', 'flac': 'flac'}
+
+
+def ffmpeg_executable(location=None):
+    """Returns the ffmpeg program to run for a configured file or folder (None means PATH)."""
+    if not location:
+        return 'ffmpeg'
+    if os.path.isdir(location):
+        return os.path.join(location, 'ffmpeg.exe' if os.name == 'nt' else 'ffmpeg')
+    return location
+
+
+def mp3_encoding(bitrate):
+    """Returns the ffmpeg arguments that encode audio as MP3 at `bitrate` kbps."""
+    return ['-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k']
+
+
+def merge_streams(formats):
+    """Returns the ffmpeg arguments that copy the streams of separately downloaded `formats`,
+    given as yt-dlp format dicts in input order, into one file without re-encoding them."""
+    args = ['-c', 'copy']
+    audio_streams = 0
+    for i, fmt in enumerate(formats):
+        if fmt.get('acodec') != 'none':
+            args += ['-map', f'{i}:a:0']
+            # AAC cut into HLS segments carries ADTS headers that MP4 cannot hold
+            if (fmt.get('protocol') or '').startswith('m3u8') and (fmt.get('acodec') or '').startswith('mp4a'):
+                args += [f'-bsf:a:{audio_streams}', 'aac_adtstoasc']
+            audio_streams += 1
+        if fmt.get('vcodec') != 'none':
+            args += ['-map', f'{i}:v:0']
+    return args + ['-movflags', '+faststart']
+
+
+def audio_extension(acodec):
+    """Returns the extension for a stream-copied audio track with codec `acodec` (e.g. 'mp4a.40.2')."""
+    return AUDIO_EXTENSIONS.get((acodec or '').split('.')[0], 'mka')
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class TranscodeCancelled(TranscodeError):
+    pass
+
+
+class Transcoder:
+    """Converts downloaded media on a pool sized to the CPU count.
+
+    The pool threads only start and wait on ffmpeg child processes, so the
+    encoding itself runs in separate processes, each limited to `threads`
+    threads. `on_idle` is called whenever the last queued conversion finishes.
+    `merge` runs on the calling thread instead, since it only copies streams.
+    """
+    def __init__(self, ffmpeg_location=None, workers=None, threads=FFMPEG_THREADS, on_idle=None):
+        self.ffmpeg = ffmpeg_executable(ffmpeg_location)
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.on_idle = on_idle
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def pending(self):
+        """Returns the number of conversions queued or running."""
+        with self._lock:
+            return self._pending
+
+    def is_idle(self):
+        with self._lock:
+            return self._pending == 0
+
+    def submit(self, source, target, codec_args, on_done, on_start=None, is_cancelled=None):
+        """Queues the extraction of the audio of `source` into `target`, encoded with `codec_args`.
+
+        `on_start()` is called when ffmpeg starts and `on_done(error)` when it
+        ends, with error None on success. Both run on a pool thread. If
+        `is_cancelled()` becomes true before or during the conversion, ffmpeg is
+        killed and the job finishes with TranscodeCancelled.
+        """
+        with self._lock:
+            self._pending += 1
+        self._pool.submit(self._run, source, target, codec_args, on_done, on_start, is_cancelled or (lambda: False))
+
+    def _run(self, source, target, codec_args, on_done, on_start, is_cancelled):
+        try:
+            if is_cancelled():
+                error = TranscodeCancelled("Conversion cancelled.")
+            else:
+                if on_start:
+                    on_start()
+                error = self._convert(source, target, codec_args, is_cancelled)
+            on_done(error)
+        except Exception as e:
+            print(f"Unhandled error in transcoder: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                idle = self._pending == 0
+            if idle and self.on_idle:
+                self.on_idle()
+
+    def merge(self, sources, target, stream_args, is_cancelled=None):
+        """Muxes `sources` into `target` with the ffmpeg output arguments `stream_args` (see merge_streams).
+
+        Raises TranscodeCancelled, after killing ffmpeg, as soon as
+        `is_cancelled()` becomes true, and TranscodeError if ffmpeg fails.
+        """
+        error = self._ffmpeg(sources, stream_args, target, is_cancelled or (lambda: False))
+        if error:
+            raise error
+
+    def _convert(self, source, target, codec_args, is_cancelled):
+        # -threads is an output option here, so it limits the encoder rather than the decoder
+        return self._ffmpeg([source], ['-vn', *codec_args, '-threads', str(self.threads)], target, is_cancelled)
+
+    def _ffmpeg(self, sources, output_args, target, is_cancelled):
+        """Runs ffmpeg from `sources` into `target`; returns None on success or the error."""
+        # Keep the real extension last so ffmpeg still picks the right container
+        base, ext = os.path.splitext(target)
+        partial = f'{base}.part{ext}'
+        inputs = [arg for source in sources for arg in ('-i', source)]
+        command = [self.ffmpeg, '-y', '-hide_banner', '-loglevel', 'error', *inputs, *output_args, partial]
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                       text=True, creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        except OSError as e:
+            return TranscodeError(f"Could not start ffmpeg: {e}")
+        # stderr is read on a helper thread so a chatty ffmpeg cannot block on a full pipe
+        errors = []
+        reader = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+        reader.start()
+        while True:
+            try:
+                process.wait(timeout=CANCEL_POLL_SECONDS)
+                break
+            except subprocess.TimeoutExpired:
+                if is_cancelled():
+                    process.kill()
+                    process.wait()
+                    reader.join()
+                    self._remove(partial)
+                    return TranscodeCancelled("Conversion cancelled.")
+        reader.join()
+        if process.returncode != 0:
+            self._remove(partial)
+            return TranscodeError(''.join(errors).strip() or f"ffmpeg exited with code {process.returncode}")
+        os.replace(partial, target)
+        return None
+
+    @staticmethod
+    def _remove(path):
+        if os.path.exists(path):
+            os.remove(path)
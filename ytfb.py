@@ -1,12 +1,45 @@
-import yt_dlp
+import startup # First, so start-up timing covers the imports below
 import sys
 import os
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, font
-import queue
-import re
 import subprocess
+import queue
+from collections import deque
+from archive import DownloadArchive
+from dispatcher import DEFAULT_PRIORITY, DownloadDispatcher
+from engine import DownloadEngine, describe_title, get_data_path, warm_up
+from metadata_cache import MetadataCache
+from journal import JobJournal
+from jobstore import ACTIVE_STATES, EVENT_STATES, JobState, JobStore
+from limits import parse_rate
+from metrics import MetricsRegistry
+from transcode import Transcoder
+
+# How often queued row updates are pushed into the Treeview (~7 Hz).
+UI_REFRESH_MS = 150
+# Playlist entries are inserted in chunks of this size, one chunk per poll.
+PLAYLIST_CHUNK = 200
+PLAYLIST_POLL_MS = 100
+# Lines the queue list scrolls per mouse wheel step.
+WHEEL_LINES = 3
+# Priorities offered by the queue list's right-click menu; higher ones start first.
+QUEUE_PRIORITIES = {'High': 1, 'Normal': DEFAULT_PRIORITY, 'Low': -1}
+# Queue list columns and their heading text.
+QUEUE_HEADINGS = {'Title': 'Title', 'Status': 'Download Status'}
+# Row colour tag of the job states that have one.
+STATE_TAGS = {JobState.COMPLETE: 'success', JobState.SKIPPED: 'success', JobState.ERROR: 'error'}
+# Sorting by status groups jobs by state in this order.
+STATE_ORDER = {state: rank for rank, state in enumerate(JobState)}
+# Queue list filters and the job states each one shows (None shows every job).
+STATUS_FILTERS = {
+    'All': None,
+    'Active': ACTIVE_STATES,
+    'Complete': (JobState.COMPLETE, JobState.SKIPPED),
+    'Failed': (JobState.ERROR,),
+    'Cancelled': (JobState.CANCELLED,),
+}
 
 def get_output_path():
     """Creates and returns the output path: 'Downloads/YTConverter'."""
@@ -20,28 +53,65 @@ def get_output_path():
         os.makedirs(fallback_folder, exist_ok=True)
         return fallback_folder
 
+def get_ffmpeg_location():
+    """Returns the path of the ffmpeg.exe bundled with (or next to) the app."""
+    if getattr(sys, 'frozen', False):
+        return os.path.join(sys._MEIPASS, 'ffmpeg.exe')
+    return 'ffmpeg.exe'
+
 class TextRedirector:
-    """A class to redirect stdout/stderr to a tkinter Text widget."""
-    def __init__(self, widget, tag="stdout"):
+    """A class to redirect stdout/stderr to a tkinter Text widget.
+
+    Writes from any thread land in a bounded ring buffer that is flushed to the
+    widget in batches on a timer. The widget keeps only the last `max_lines` lines.
+    """
+    def __init__(self, widget, tag="stdout", max_lines=2000, interval_ms=250):
         self.widget = widget
         self.tag = tag
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        # print() writes the text and the newline separately, hence the doubled size
+        self._buffer = deque(maxlen=max_lines * 2)
+        self._lock = threading.Lock()
+        self.widget.after(self.interval_ms, self._flush_to_widget)
 
     def write(self, str_val):
-        self.widget.configure(state='normal')
-        self.widget.insert('end', str_val, (self.tag,))
-        self.widget.configure(state='disabled')
-        self.widget.see('end')
+        with self._lock:
+            self._buffer.append(str_val)
 
     def flush(self):
         pass
 
+    def _flush_to_widget(self):
+        """Moves buffered text into the widget and trims it to `max_lines`."""
+        with self._lock:
+            text = ''.join(self._buffer)
+            self._buffer.clear()
+        if text:
+            self.widget.configure(state='normal')
+            self.widget.insert('end', text, (self.tag,))
+            excess = int(self.widget.index('end-1c').split('.')[0]) - self.max_lines
+            if excess > 0:
+                self.widget.delete('1.0', f'{excess + 1}.0')
+            self.widget.configure(state='disabled')
+            self.widget.see('end')
+        self.widget.after(self.interval_ms, self._flush_to_widget)
+
 class PlaylistWindow(tk.Toplevel):
-    """A Toplevel window to display and select videos from a playlist."""
-    def __init__(self, master, entries, download_format, quality):
+    """A Toplevel window to display and select videos from a playlist.
+
+    Entries are enumerated on a background thread and inserted in chunks as pages
+    arrive, so early entries can be queued while the rest are still loading.
+    """
+    def __init__(self, master, url, download_format, quality):
         super().__init__(master)
         self.master_app = master
         self.download_format = download_format
         self.quality = quality
+        self.entry_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.is_loading = True
+        self.entry_count = 0 # Rows in the list, kept so polls need not count them
         
         self.title("Select Videos from Playlist")
         self.geometry("600x400")
@@ -59,14 +129,15 @@ class PlaylistWindow(tk.Toplevel):
         self.tree.configure(yscroll=scrollbar.set)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-        self.video_entries = entries
-        for entry in self.video_entries:
-            self.tree.insert('', 'end', values=(entry.get('title', 'N/A'),), iid=entry.get('url'))
-
         # --- Bottom control buttons ---
         button_frame = ttk.Frame(self, style="Main.TFrame")
         button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
 
+        self.status_var = tk.StringVar(value="Fetching playlist contents...")
+        ttk.Label(button_frame, textvariable=self.status_var, style="White.TLabel").pack(side=tk.RIGHT, padx=10)
+        self.stop_button = ttk.Button(button_frame, text="Stop Loading", command=self.stop_loading, style="Secondary.TButton")
+        self.stop_button.pack(side=tk.RIGHT)
+
         add_button = ttk.Button(button_frame, text="Add Selected to Queue", command=self.add_selected, style="Accent.TButton")
         add_button.pack(side=tk.RIGHT)
 
@@ -76,6 +147,59 @@ class PlaylistWindow(tk.Toplevel):
         deselect_all_button = ttk.Button(button_frame, text="Deselect All", command=self.deselect_all, style="Secondary.TButton")
         deselect_all_button.pack(side=tk.LEFT, padx=10)
 
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        threading.Thread(target=self.enumerate_entries, args=(url,), daemon=True).start()
+        self.after(PLAYLIST_POLL_MS, self.insert_pending_entries)
+
+    def enumerate_entries(self, url):
+        """Feeds playlist entries to the UI as they are listed; runs on a background thread."""
+        try:
+            for entry in self.master_app.engine.iter_playlist(url):
+                if self.cancel_event.is_set():
+                    break
+                self.entry_queue.put(entry)
+        except Exception as e:
+            self.entry_queue.put(e)
+        self.entry_queue.put(None)
+
+    def insert_pending_entries(self):
+        """Inserts the next chunk of enumerated entries into the list."""
+        if not self.winfo_exists():
+            return
+        for _ in range(PLAYLIST_CHUNK):
+            try:
+                entry = self.entry_queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self.finish_loading()
+                return
+            if isinstance(entry, Exception):
+                self.finish_loading()
+                messagebox.showerror("Error", f"Failed to fetch playlist:\n{entry}", parent=self)
+                return
+            url = entry.get('url')
+            if url and not self.tree.exists(url):
+                self.tree.insert('', 'end', values=(entry.get('title', 'N/A'),), iid=url)
+                self.entry_count += 1
+        self.status_var.set(f"Loading... {self.entry_count} videos")
+        self.after(PLAYLIST_POLL_MS, self.insert_pending_entries)
+
+    def finish_loading(self):
+        self.is_loading = False
+        self.stop_button.config(state='disabled')
+        self.status_var.set(f"{self.entry_count} videos" if self.entry_count else "No videos found")
+
+    def stop_loading(self):
+        """Stops enumerating; entries already listed stay selectable."""
+        self.cancel_event.set()
+        self.stop_button.config(state='disabled')
+        self.status_var.set("Stopping...")
+
+    def close(self):
+        self.cancel_event.set()
+        self.destroy()
+
     def select_all(self):
         self.tree.selection_set(self.tree.get_children())
 
@@ -89,7 +213,237 @@ class PlaylistWindow(tk.Toplevel):
             return
         
         self.master_app.add_multiple_links_to_queue(selected_urls, self.download_format, self.quality)
-        self.destroy()
+        if self.is_loading:
+            # Keep listing the rest; drop the queued rows so they cannot be added twice
+            self.tree.delete(*selected_urls)
+            self.entry_count -= len(selected_urls)
+        else:
+            self.destroy()
+
+
+class VirtualJobList:
+    """The download queue list, drawn from the job store one screenful at a time.
+
+    The Treeview only holds as many items as there are visible lines, and
+    scrolling, sorting and filtering change which jobs those lines show, so
+    redrawing the list costs the same for ten jobs or ten thousand. The
+    selection is kept as job ids, since a line shows another job once the list
+    scrolls.
+    """
+    def __init__(self, parent, jobs, colors):
+        self.jobs = jobs
+        self.order = [] # Every job id, in queue order
+        self.rows = self.order # The job ids shown, in display order
+        self.lines = []
+        self.drawn = [] # Values and tags last drawn on each line
+        self.offset = 0
+        self.selected = set()
+        self.anchor = None
+        self.status_filter = None
+        self.sort_column = None
+        self.sort_reverse = False
+        self.built_version = None # Job store version the filtered/sorted rows were built from
+        self.dirty = False
+        self.titles_changed = False
+
+        self.tree = ttk.Treeview(parent, columns=tuple(QUEUE_HEADINGS), show='headings', style="Custom.Treeview", selectmode='none')
+        for column, text in QUEUE_HEADINGS.items():
+            self.tree.heading(column, text=text, command=lambda column=column: self.sort_by(column))
+        self.tree.column('Title', width=560, anchor='w')
+        self.tree.column('Status', width=150, anchor='center')
+
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.yview, style="Custom.Vertical.TScrollbar")
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.tree.bind('<Configure>', self.fit_lines)
+        self.tree.bind('<Button-1>', self.on_click)
+        self.tree.bind('<Shift-Button-1>', lambda event: self.on_click(event, extend=True))
+        self.tree.bind('<Control-Button-1>', lambda event: self.on_click(event, toggle=True))
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self.on_wheel)
+        self.apply_colors(colors)
+
+    def apply_colors(self, colors):
+        self.tree.tag_configure('oddrow', background=colors['bg_light'])
+        self.tree.tag_configure('evenrow', background=colors['bg_lighter'])
+        self.tree.tag_configure('success', foreground=colors['success'])
+        self.tree.tag_configure('error', foreground=colors['error'])
+
+    # --- Contents ---
+
+    def add(self, job_id):
+        self.order.append(job_id)
+        self.dirty = True
+
+    def remove(self, job_ids):
+        removed = set(job_ids)
+        self.order = [job_id for job_id in self.order if job_id not in removed]
+        self.selected -= removed
+        self.rebuild()
+        self.render()
+
+    def move(self, job_ids, to_top):
+        """Moves `job_ids` to the start or end of the queue order, keeping their order."""
+        moved = set(job_ids)
+        rest = [job_id for job_id in self.order if job_id not in moved]
+        self.order = list(job_ids) + rest if to_top else rest + list(job_ids)
+        self.rebuild()
+        self.render()
+
+    def sort_queued(self, priorities):
+        """Reorders the queued jobs in `priorities` (job id -> priority) to match the dispatcher.
+
+        They only swap places among themselves; a stable sort keeps jobs of equal
+        priority in their queue order, as the dispatcher does.
+        """
+        slots = [index for index, job_id in enumerate(self.order) if job_id in priorities]
+        ranked = sorted((self.order[index] for index in slots), key=lambda job_id: -priorities[job_id])
+        for index, job_id in zip(slots, ranked):
+            self.order[index] = job_id
+        self.rebuild()
+        self.render()
+
+    def selection(self):
+        """Returns the selected job ids in queue order."""
+        return [job_id for job_id in self.order if job_id in self.selected]
+
+    def set_filter(self, states):
+        """Shows only the jobs in `states`; None shows every job."""
+        self.status_filter = states
+        self.offset = 0
+        self.rebuild()
+        self.render()
+
+    def sort_by(self, column):
+        """Cycles `column` through ascending, descending and queue order."""
+        if self.sort_column != column:
+            self.sort_column, self.sort_reverse = column, False
+        elif not self.sort_reverse:
+            self.sort_reverse = True
+        else:
+            self.sort_column = None
+        for name, text in QUEUE_HEADINGS.items():
+            arrow = (' ▼' if self.sort_reverse else ' ▲') if name == self.sort_column else ''
+            self.tree.heading(name, text=text + arrow)
+        self.rebuild()
+        self.render()
+
+    def refresh(self):
+        """Redraws the list after jobs changed, re-filtering and re-sorting only if that can change the rows."""
+        titles_changed = self.titles_changed and self.sort_column == 'Title'
+        self.dirty = self.titles_changed = False
+        if (self.status_filter or self.sort_column) and (titles_changed or self.jobs.version != self.built_version):
+            self.rebuild()
+        self.render()
+
+    def rebuild(self):
+        self.built_version = self.jobs.version
+        rows = self.order
+        if self.status_filter:
+            shown = set(self.jobs.ids(*self.status_filter))
+            rows = [job_id for job_id in rows if job_id in shown]
+        if self.sort_column:
+            jobs = {job.id: job for job in self.jobs.jobs()}
+            if self.sort_column == 'Title':
+                key = lambda job_id: (jobs[job_id].title is None, (jobs[job_id].title or '').casefold())
+            else:
+                key = lambda job_id: STATE_ORDER[jobs[job_id].state]
+            # Sorting is stable, so jobs with equal keys stay in queue order
+            rows = sorted(rows, key=key, reverse=self.sort_reverse)
+        self.rows = rows
+
+    # --- Drawing ---
+
+    def render(self):
+        """Draws the visible slice of the list, touching only the lines whose contents changed."""
+        self.offset = max(0, min(self.offset, len(self.rows) - len(self.lines)))
+        selection = []
+        for line, item in enumerate(self.lines):
+            index = self.offset + line
+            job = self.jobs.get(self.rows[index]) if index < len(self.rows) else None
+            if job is None:
+                drawn = (('', ''), ())
+            else:
+                stripe = 'evenrow' if index % 2 == 0 else 'oddrow'
+                tags = (stripe, STATE_TAGS[job.state]) if job.state in STATE_TAGS else (stripe,)
+                drawn = ((f"  {job.title or 'Fetching title...'}", job.status), tags)
+                if job.id in self.selected:
+                    selection.append(item)
+            if drawn != self.drawn[line]:
+                self.tree.item(item, values=drawn[0], tags=drawn[1])
+                self.drawn[line] = drawn
+        self.tree.selection_set(selection)
+        if self.rows:
+            self.scrollbar.set(self.offset / len(self.rows), min(1.0, (self.offset + len(self.lines)) / len(self.rows)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def fit_lines(self, event=None, retry=True):
+        """Keeps one Treeview item per line that fits in the widget."""
+        row_height = int(ttk.Style(self.tree).lookup('Custom.Treeview', 'rowheight') or 28)
+        box = self.tree.bbox(self.lines[0]) if self.lines else ''
+        heading_height = box[1] if box else row_height
+        count = max(1, (self.tree.winfo_height() - heading_height) // row_height)
+        while len(self.lines) < count:
+            self.lines.append(self.tree.insert('', 'end', values=('', '')))
+            self.drawn.append(None)
+        if len(self.lines) > count:
+            self.tree.delete(*self.lines[count:])
+            del self.lines[count:], self.drawn[count:]
+        self.render()
+        if not box and retry:
+            # The heading height is only known once the first line has been laid out
+            self.tree.after_idle(lambda: self.fit_lines(retry=False))
+
+    # --- Scrolling and selection ---
+
+    def yview(self, *args):
+        """Scrollbar command: 'moveto fraction' or 'scroll n units|pages'."""
+        if args[0] == 'moveto':
+            self.offset = round(float(args[1]) * len(self.rows))
+        elif args[0] == 'scroll':
+            step = max(1, len(self.lines) - 1) if args[2] == 'pages' else 1
+            self.offset += int(args[1]) * step
+        self.render()
+
+    def on_wheel(self, event):
+        # X11 reports the wheel as buttons 4 and 5, Windows and macOS as a signed delta
+        up = event.num == 4 or event.delta > 0
+        self.yview('scroll', -WHEEL_LINES if up else WHEEL_LINES, 'units')
+        return 'break'
+
+    def row_at(self, event):
+        """Returns the index in `rows` of the line under the pointer, or len(rows) below the last row."""
+        item = self.tree.identify_row(event.y)
+        return self.offset + self.lines.index(item) if item in self.lines else len(self.rows)
+
+    def on_click(self, event, extend=False, toggle=False):
+        if self.tree.identify_region(event.x, event.y) not in ('cell', 'nothing'):
+            return None # Headings keep their sort command and column resizing
+        self.tree.focus_set()
+        index = self.row_at(event)
+        if index >= len(self.rows):
+            self.selected, self.anchor = set(), None
+        elif extend and self.anchor in self.selected and self.anchor in self.rows:
+            start = self.rows.index(self.anchor)
+            low, high = sorted((start, index))
+            self.selected = set(self.rows[low:high + 1])
+        elif toggle:
+            self.selected ^= {self.rows[index]}
+            self.anchor = self.rows[index]
+        else:
+            self.selected = {self.rows[index]}
+            self.anchor = self.rows[index]
+        self.render()
+        return 'break'
+
+    def on_menu_click(self, event):
+        """Selects the row under the pointer unless it is already selected; returns whether any job is selected."""
+        index = self.row_at(event)
+        if index >= len(self.rows) or self.rows[index] not in self.selected:
+            self.on_click(event)
+        return bool(self.selected)
 
 
 class YouTubeConverterApp:
@@ -104,10 +458,20 @@ class YouTubeConverterApp:
         self.root.geometry("800x760")
         self.root.resizable(True, True)
 
-        self.download_queue = queue.Queue()
-        self.active_downloads = 0
+        # Set from worker and transcoder threads when they run out of work; the UI tick acts on it
+        self.queue_idle = threading.Event()
+        self.dispatcher = DownloadDispatcher(self.process_job, max_workers=3, on_idle=self.queue_idle.set,
+                                             gate=lambda job: self.engine.admit(job.url))
         self.is_paused = False
-        self.item_map = {}
+        self.jobs = JobStore()
+        self.metadata_cache = MetadataCache(os.path.join(get_data_path(), 'metadata.sqlite'))
+        self.journal = JobJournal(os.path.join(get_data_path(), 'jobs.sqlite'))
+        self.archive = DownloadArchive(os.path.join(get_data_path(), 'archive.sqlite'))
+        self.transcoder = Transcoder(get_ffmpeg_location(), on_idle=self.queue_idle.set)
+        self.metrics = MetricsRegistry(get_data_path(), gauges=self.queue_gauges)
+        self.metrics.start()
+        self.engine = DownloadEngine(get_output_path(), self.metadata_cache, self.journal, ffmpeg_location=get_ffmpeg_location(),
+                                     archive=self.archive, transcoder=self.transcoder, metrics=self.metrics)
         
         self.font_main = font.Font(family="Roboto", size=10)
         self.font_bold = font.Font(family="Roboto", size=10, weight="bold")
@@ -159,23 +523,32 @@ class YouTubeConverterApp:
         self.create_log_tab_widgets(self.log_tab)
         self.create_about_tab_widgets(self.about_tab)
 
+        filter_frame = ttk.Frame(main_frame, style="Main.TFrame")
+        filter_frame.pack(fill='x', pady=(0, 5))
+        self.status_filter_var = tk.StringVar(value="All")
+        status_filter_menu = ttk.Combobox(filter_frame, textvariable=self.status_filter_var, values=list(STATUS_FILTERS), width=10, state='readonly', style="Custom.TCombobox")
+        status_filter_menu.pack(side=tk.RIGHT)
+        status_filter_menu.bind("<<ComboboxSelected>>", self.change_status_filter)
+        ttk.Label(filter_frame, text="Show:", style="White.TLabel").pack(side=tk.RIGHT, padx=(0, 5))
+
         list_frame = ttk.Frame(main_frame, style="Main.TFrame")
         list_frame.pack(fill=tk.BOTH, expand=True)
+        self.queue_view = VirtualJobList(list_frame, self.jobs, self.colors)
+
+        self.priority_var = tk.IntVar(value=DEFAULT_PRIORITY)
+        priority_menu = tk.Menu(self.root, tearoff=0)
+        for text, priority in QUEUE_PRIORITIES.items():
+            priority_menu.add_radiobutton(label=text, value=priority, variable=self.priority_var, command=self.set_selected_priority)
+        self.queue_menu = tk.Menu(self.root, tearoff=0)
+        self.queue_menu.add_command(label="Move to Top", command=self.move_selected_to_top)
+        self.queue_menu.add_command(label="Move to Bottom", command=self.move_selected_to_bottom)
+        self.queue_menu.add_cascade(label="Priority", menu=priority_menu)
+        self.queue_menu.add_separator()
+        self.queue_menu.add_command(label="Cancel", command=self.cancel_selected_download)
+        # Button-2 is the right button on macOS
+        for sequence in ('<Button-3>', '<Button-2>'):
+            self.queue_view.tree.bind(sequence, self.show_queue_menu)
 
-        self.tree = ttk.Treeview(list_frame, columns=('Title', 'Status'), show='headings', style="Custom.Treeview")
-        self.tree.heading('Title', text='Title')
-        self.tree.heading('Status', text='Download Status')
-        self.tree.column('Title', width=560, anchor='w')
-        self.tree.column('Status', width=150, anchor='center')
-        
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.tree.yview, style="Custom.Vertical.TScrollbar")
-        self.tree.configure(yscroll=scrollbar.set)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        self.tree.tag_configure('oddrow', background=self.colors['bg_light'])
-        self.tree.tag_configure('evenrow', background=self.colors['bg_lighter'])
-        
         bottom_controls_frame = ttk.Frame(main_frame, style="Main.TFrame")
         bottom_controls_frame.pack(fill='x', pady=(10, 0))
 
@@ -185,6 +558,12 @@ class YouTubeConverterApp:
         cancel_button = ttk.Button(bottom_controls_frame, text="Cancel Selected", command=self.cancel_selected_download, style="Error.TButton")
         cancel_button.pack(side=tk.LEFT, padx=10)
 
+        top_button = ttk.Button(bottom_controls_frame, text="⤒ Move to Top", command=self.move_selected_to_top, style="Secondary.TButton")
+        top_button.pack(side=tk.LEFT)
+
+        bottom_button = ttk.Button(bottom_controls_frame, text="⤓ Move to Bottom", command=self.move_selected_to_bottom, style="Secondary.TButton")
+        bottom_button.pack(side=tk.LEFT, padx=10)
+
         clear_button = ttk.Button(bottom_controls_frame, text="Clear Finished", command=self.clear_finished, style="Secondary.TButton")
         clear_button.pack(side=tk.LEFT)
 
@@ -198,6 +577,28 @@ class YouTubeConverterApp:
         post_dl_menu = ttk.Combobox(post_dl_frame, textvariable=self.post_dl_action_var, values=["Do Nothing", "Shutdown", "Sleep"], width=10, state='readonly', style="Custom.TCombobox")
         post_dl_menu.pack(side=tk.LEFT)
 
+        self.root.after(UI_REFRESH_MS, self.flush_row_updates)
+        self.root.after_idle(self.on_window_shown)
+        self.restore_unfinished_jobs()
+
+    def on_window_shown(self):
+        """Loads yt-dlp in the background once the window is on screen."""
+        startup.mark("Window shown")
+        loader = threading.Thread(target=self.warm_up_engine, daemon=True)
+        loader.start()
+        if startup.timing_enabled():
+            self.quit_when_loaded(loader)
+
+    def warm_up_engine(self):
+        warm_up()
+        startup.mark("yt-dlp ready")
+
+    def quit_when_loaded(self, loader):
+        """Closes the window once `loader` is done; polled on the Tk thread."""
+        if loader.is_alive():
+            self.root.after(UI_REFRESH_MS, self.quit_when_loaded, loader)
+        else:
+            self.root.destroy()
 
     def create_youtube_tab_widgets(self, parent_frame):
         """Creates all the widgets for the YouTube downloader tab."""
@@ -238,6 +639,10 @@ class YouTubeConverterApp:
         self.yt_bitrate_var = tk.StringVar(value='192kbps')
         self.yt_bitrate_menu = ttk.Combobox(self.yt_bitrate_frame, textvariable=self.yt_bitrate_var, values=['128kbps', '192kbps', '256kbps', '320kbps'], width=10, state='readonly', style="Custom.TCombobox")
         self.yt_bitrate_menu.pack(side=tk.LEFT)
+        self.yt_keep_audio_var = tk.BooleanVar()
+        self.yt_keep_audio_var.trace_add("write", self.toggle_keep_audio)
+        keep_audio_check = ttk.Checkbutton(self.yt_bitrate_frame, text="Keep original audio (no re-encode)", variable=self.yt_keep_audio_var, style="White.TCheckbutton")
+        keep_audio_check.pack(side=tk.LEFT, padx=(10, 0))
 
         self.yt_resolution_frame = ttk.Frame(self.yt_quality_frame, style="Main.TFrame")
         ttk.Label(self.yt_resolution_frame, text="Resolution", style="Title.TLabel").pack(anchor="w", pady=(0,5))
@@ -361,6 +766,7 @@ class YouTubeConverterApp:
         concurrency_frame.pack(anchor='w', pady=(0, 20))
         ttk.Label(concurrency_frame, text="Concurrent Downloads (Workers):", style="Title.TLabel").pack(anchor="w", pady=(0,5))
         self.max_concurrent_var = tk.IntVar(value=3)
+        self.max_concurrent_var.trace_add("write", self.update_max_concurrent)
         self.max_concurrent_spinbox = ttk.Spinbox(
             concurrency_frame, from_=1, to=20, 
             textvariable=self.max_concurrent_var, width=5,
@@ -487,113 +893,84 @@ class YouTubeConverterApp:
         else:
             self.yt_resolution_frame.pack()
 
-    def progress_hook(self, d, item_id):
-        if self.item_map.get(item_id, {}).get('cancelled'):
-            raise yt_dlp.utils.DownloadError("Download cancelled by user.")
-
-        if d['status'] == 'downloading':
-            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
-            if total_bytes:
-                percent = (d['downloaded_bytes'] / total_bytes) * 100
-                self.tree.set(item_id, 'Status', f"Downloading {percent:.1f}%")
-        elif d['status'] == 'finished':
-            self.tree.set(item_id, 'Status', "Processing...")
-        elif d['status'] == 'error':
-             self.tree.set(item_id, 'Status', "Error")
-
-    def run_download(self, url, download_format, quality, item_id):
-        try:
-            if self.item_map.get(item_id, {}).get('cancelled'):
-                self.tree.set(item_id, 'Status', "Cancelled")
-                return
+    def toggle_keep_audio(self, *args):
+        self.yt_bitrate_menu.configure(state='disabled' if self.yt_keep_audio_var.get() else 'readonly')
 
-            output_path = get_output_path()
-            
-            self.tree.set(item_id, 'Status', "Fetching...")
-            
-            with yt_dlp.YoutubeDL({'noplaylist': True, 'quiet': True}) as ydl:
-                info_dict = ydl.extract_info(url, download=False)
-                video_title = info_dict.get('title', 'Unknown Title')
-                video_id = info_dict.get('id', 'unknown_id')
-                self.tree.set(item_id, 'Title', f"  {video_title}")
-
-            safe_title = re.sub(r'[\\/*?:"<>|]', "", video_title)
-            safe_title = safe_title.encode('ascii', 'ignore').decode('ascii').strip()
-            if len(safe_title) > 80:
-                safe_title = safe_title[:80].strip()
-            if not safe_title:
-                safe_title = video_id
-            
-            output_template = os.path.join(output_path, f'{safe_title}.%(ext)s')
-
-            ydl_opts = {
-                'noplaylist': True,
-                'progress_hooks': [lambda d: self.progress_hook(d, item_id)],
-                'outtmpl': output_template,
-            }
-
-            rate_limit = self.rate_limit_var.get().strip()
-            if rate_limit:
-                ydl_opts['ratelimit'] = rate_limit
-
-            if download_format == 'mp3':
-                if getattr(sys, 'frozen', False):
-                    ffmpeg_location = os.path.join(sys._MEIPASS, 'ffmpeg.exe')
-                else:
-                    ffmpeg_location = 'ffmpeg.exe'
-                if not os.path.exists(ffmpeg_location):
-                    raise FileNotFoundError("ffmpeg.exe not found!")
-                
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': quality.replace('kbps', '')}],
-                    'ffmpeg_location': ffmpeg_location,
-                })
-            else: # MP4
-                if quality == 'Best':
-                    format_string = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-                else:
-                    height = quality.replace('p', '')
-                    format_string = f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<={height}]'
-                ydl_opts['format'] = format_string
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            
-            self.tree.set(item_id, 'Status', "✅ Complete")
-            self.tree.item(item_id, tags=(self.tree.item(item_id, 'tags')[0], 'success'))
-            self.tree.tag_configure('success', foreground=self.colors['success'])
-
-        except Exception as e:
-            if "cancelled by user" in str(e).lower():
-                self.tree.set(item_id, 'Status', "Cancelled")
-            else:
-                self.tree.set(item_id, 'Status', "❌ Error")
-                self.tree.item(item_id, tags=(self.tree.item(item_id, 'tags')[0], 'error'))
-                self.tree.tag_configure('error', foreground=self.colors['error'])
-                print(f"Error downloading {url}: {e}", file=sys.stderr)
-        finally:
-            self.download_queue.task_done()
-            self.active_downloads -= 1
+    def queue_row_update(self, job_id, title=None, status=None):
+        """Records the latest title/status of a job for the next redraw; safe to call from any thread."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        if title is not None:
+            job.title = title
+            self.queue_view.titles_changed = True
+        if status is not None:
+            job.status = status
+        self.queue_view.dirty = True
+
+    def flush_row_updates(self):
+        """Redraws the queue list if any job changed since the last tick and handles a finished queue."""
+        if self.queue_view.dirty:
+            self.queue_view.refresh()
+        if self.queue_idle.is_set():
+            self.queue_idle.clear()
             self.check_queue_finished()
-            self.start_next_download()
-
-    def worker(self):
-        while True:
-            item_id, url, download_format, quality = self.download_queue.get()
-            if self.item_map.get(item_id, {}).get('cancelled'):
-                self.download_queue.task_done()
-                self.active_downloads -= 1
-                self.start_next_download()
-                continue
-            self.run_download(url, download_format, quality, item_id)
+        self.root.after(UI_REFRESH_MS, self.flush_row_updates)
+
+    def change_status_filter(self, event=None):
+        self.queue_view.set_filter(STATUS_FILTERS[self.status_filter_var.get()])
+
+    def on_engine_event(self, job_id, event, value):
+        """Turns download engine events into job and row updates; called on worker threads."""
+        if event in EVENT_STATES:
+            self.jobs.set_state(job_id, EVENT_STATES[event])
+            job = self.jobs.get(job_id)
+            if job is not None and event != 'retry':
+                job.metrics = None # The engine reports finished jobs to the registry itself
+        if event == 'title':
+            self.queue_row_update(job_id, title=value)
+        elif event == 'status':
+            self.queue_row_update(job_id, status=value)
+        elif event == 'complete':
+            self.queue_row_update(job_id, status="✅ Complete")
+        elif event == 'skipped':
+            self.queue_row_update(job_id, status="⏭ Already downloaded")
+            print(f"Already downloaded: {value}")
+        elif event == 'cancelled':
+            self.queue_row_update(job_id, status="Cancelled")
+        elif event == 'error':
+            self.queue_row_update(job_id, status="❌ Error")
+            print(value, file=sys.stderr)
+        elif event == 'retry':
+            self.queue_row_update(job_id, status=f"Retrying in {value:.0f}s")
+            self.dispatcher.submit(self.jobs.get(job_id), key=job_id, delay=value)
+
+    def process_job(self, job):
+        """Runs one queued Job; called by the dispatcher on a worker thread."""
+        self.jobs.set_state(job.id, JobState.RUNNING)
+        if job.metrics is None:
+            job.metrics = self.metrics.new_job(job.url, job.queued_at)
+        self.engine.download(
+            job.url, job.download_format, job.quality,
+            lambda event, value: self.on_engine_event(job.id, event, value),
+            job_id=job.journal_id,
+            output_template=job.output_template,
+            is_cancelled=lambda: job.cancelled,
+            metrics=job.metrics,
+            reserved=True,
+        )
 
-    def start_next_download(self):
-        if self.is_paused:
-            return
-        while self.active_downloads < self.max_concurrent_var.get() and not self.download_queue.empty():
-            self.active_downloads += 1
-            # A worker will automatically pick up the next item
+    def queue_gauges(self):
+        """Queue-wide values for the metrics export."""
+        return {'active_jobs': self.dispatcher.active, 'queue_depth': self.dispatcher.pending(),
+                'converting_jobs': self.transcoder.pending()}
+
+    def update_max_concurrent(self, *args):
+        """Applies the 'Concurrent Downloads' setting to the dispatcher."""
+        try:
+            self.dispatcher.set_max_workers(self.max_concurrent_var.get())
+        except (tk.TclError, ValueError):
+            pass # Ignore partial input while the user is typing
 
     def add_links_to_queue(self):
         active_tab_index = self.notebook.index(self.notebook.select())
@@ -603,6 +980,8 @@ class YouTubeConverterApp:
             url_text_widget = self.yt_url_text
             download_format = self.yt_format_var.get()
             quality = self.yt_bitrate_var.get() if download_format == 'mp3' else self.yt_resolution_var.get()
+            if download_format == 'mp3' and self.yt_keep_audio_var.get():
+                download_format, quality = 'audio', 'Original'
             is_playlist = self.yt_playlist_var.get()
         elif active_tab_index == 1: # Facebook
             urls = self.fb_url_text.get("1.0", tk.END).strip().splitlines()
@@ -642,62 +1021,96 @@ class YouTubeConverterApp:
 
     def add_multiple_links_to_queue(self, urls, download_format, quality):
         """Adds a list of URLs to the main download queue."""
-        for i, url in enumerate(urls):
-            tag = 'evenrow' if (len(self.tree.get_children()) % 2 == 0) else 'oddrow'
-            item_id = self.tree.insert('', 'end', values=('  Fetching title...', 'Queued'), tags=(tag,))
-            self.item_map[item_id] = {'url': url, 'cancelled': False}
-            self.download_queue.put((item_id, url, download_format, quality))
-        self.start_next_download()
+        job_ids = {} # url -> ids of the jobs queued for it; a URL may be pasted more than once
+        for url in urls:
+            journal_id = self.journal.add(url, download_format, quality)
+            job_ids.setdefault(url, []).append(self.enqueue_job(journal_id, url, download_format, quality))
+        if len(urls) > 1:
+            self.engine.prefetch(job_ids, self.on_prefetched(job_ids))
+
+    def on_prefetched(self, job_ids):
+        """Returns the prefetch callback that titles every job queued for a resolved URL."""
+        def on_resolved(url, info):
+            for job_id in job_ids[url]:
+                self.queue_row_update(job_id, title=describe_title(info))
+        return on_resolved
+
+    def enqueue_job(self, journal_id, url, download_format, quality, title=None, output_template=None):
+        """Adds a journaled job to the store and the list and hands it to the dispatcher; returns its id."""
+        job = self.jobs.add(url, download_format, quality, journal_id=journal_id, title=title, output_template=output_template)
+        self.queue_view.add(job.id)
+        self.dispatcher.submit(job, key=job.id)
+        return job.id
+
+    def restore_unfinished_jobs(self):
+        """Re-queues the jobs a previous session left unfinished, resuming their partial files."""
+        for journal_id, url, download_format, quality, title, output_template in self.journal.unfinished():
+            self.enqueue_job(journal_id, url, download_format, quality, title, output_template)
 
     def fetch_playlist(self, url, download_format, quality):
-        """Fetches playlist contents in a new thread."""
-        progress_window = tk.Toplevel(self.root)
-        progress_window.title("Fetching Playlist")
-        progress_window.geometry("300x100")
-        progress_window.configure(bg=self.colors['bg'])
-        
-        ttk.Label(progress_window, text="Fetching playlist contents...", style="White.TLabel").pack(pady=10)
-        progress_bar = ttk.Progressbar(progress_window, mode='indeterminate')
-        progress_bar.pack(pady=10, padx=20, fill='x')
-        progress_bar.start(10)
-
-        def do_fetch():
-            try:
-                ydl_opts = {'extract_flat': True, 'quiet': True}
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                
-                progress_window.destroy()
-                if 'entries' in info:
-                    self.root.after(0, lambda: PlaylistWindow(self, info['entries'], download_format, quality))
-                else:
-                    messagebox.showerror("Error", "Could not find any videos in the playlist.", parent=self.root)
-            except Exception as e:
-                progress_window.destroy()
-                messagebox.showerror("Error", f"Failed to fetch playlist:\n{e}", parent=self.root)
-
-        threading.Thread(target=do_fetch, daemon=True).start()
+        """Opens the playlist window, which lists the playlist's videos as they are fetched."""
+        PlaylistWindow(self, url, download_format, quality)
 
     def cancel_selected_download(self):
-        """Cancels the currently selected download in the treeview."""
-        selected_items = self.tree.selection()
-        if not selected_items:
+        """Cancels the downloads selected in the queue list."""
+        selected_ids = self.queue_view.selection()
+        if not selected_ids:
             messagebox.showwarning("No Selection", "Please select a download to cancel.")
             return
         
-        for item_id in selected_items:
-            if item_id in self.item_map:
-                self.item_map[item_id]['cancelled'] = True
-                self.tree.set(item_id, 'Status', "Cancelling...")
+        for job_id in selected_ids:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                continue
+            job.cancelled = True
+            if self.dispatcher.remove(job.id):
+                # It never started, so there is nothing to wait for
+                self.jobs.set_state(job.id, JobState.CANCELLED)
+                self.journal.update(job.journal_id, state='cancelled')
+                (job.metrics or self.metrics.new_job(job.url, job.queued_at)).finish('cancelled')
+                job.metrics = None
+                self.queue_row_update(job.id, status="Cancelled")
+            else:
+                self.queue_row_update(job.id, status="Cancelling...")
+
+    def move_selected_to_top(self):
+        """Makes the selected queued downloads the next ones to start, keeping their order."""
+        moved = [job_id for job_id in reversed(self.queue_view.selection()) if self.dispatcher.move_to_top(job_id)]
+        self.queue_view.move(moved[::-1], to_top=True)
+
+    def move_selected_to_bottom(self):
+        """Sends the selected queued downloads to the end of the queue, keeping their order."""
+        moved = [job_id for job_id in self.queue_view.selection() if self.dispatcher.move_to_bottom(job_id)]
+        self.queue_view.move(moved, to_top=False)
+
+    def show_queue_menu(self, event):
+        """Opens the queue list's right-click menu for the selection, or the row under the pointer."""
+        if not self.queue_view.on_menu_click(event):
+            return 'break'
+        priorities = self.dispatcher.priorities()
+        selected = [priorities[job_id] for job_id in self.queue_view.selection() if job_id in priorities]
+        # Only jobs still waiting in the queue have a priority to change
+        self.priority_var.set(selected[0] if selected else DEFAULT_PRIORITY)
+        self.queue_menu.entryconfigure("Priority", state=tk.NORMAL if selected else tk.DISABLED)
+        try:
+            self.queue_menu.tk_popup(event.x_root, event.y_root)
+        finally:
+            self.queue_menu.grab_release()
+        return 'break'
+
+    def set_selected_priority(self):
+        """Gives the selected queued downloads the priority picked in the right-click menu."""
+        priority = self.priority_var.get()
+        changed = [job_id for job_id in self.queue_view.selection() if self.dispatcher.set_priority(job_id, priority)]
+        if changed:
+            self.queue_view.sort_queued(self.dispatcher.priorities())
 
     def clear_finished(self):
-        """Removes all completed or errored items from the list."""
-        for item_id in list(self.tree.get_children()):
-            status = self.tree.set(item_id, 'Status')
-            if "Complete" in status or "Error" in status or "Cancelled" in status:
-                self.tree.delete(item_id)
-                if item_id in self.item_map:
-                    del self.item_map[item_id]
+        """Removes all finished jobs from the store and the list."""
+        cleared = self.jobs.remove_finished()
+        if cleared:
+            self.queue_view.remove([job.id for job in cleared])
+        self.journal.remove([job.journal_id for job in cleared])
 
     def open_download_folder(self):
         """Opens the output folder in the default file explorer."""
@@ -716,17 +1129,17 @@ class YouTubeConverterApp:
         """Pauses or resumes the download queue."""
         self.is_paused = not self.is_paused
         if self.is_paused:
+            self.dispatcher.pause()
             self.pause_button.config(text="▶ Resume")
             self.pause_button.config(style="Accent.TButton")
         else:
+            self.dispatcher.resume()
             self.pause_button.config(text="❚❚ Pause")
             self.pause_button.config(style="Warning.TButton")
-            for _ in range(self.max_concurrent_var.get()):
-                self.start_next_download()
 
     def check_queue_finished(self):
         """Checks if the queue is empty and performs post-download actions."""
-        if self.active_downloads == 0 and self.download_queue.empty():
+        if self.dispatcher.is_idle() and self.transcoder.is_idle():
             action = self.post_dl_action_var.get()
             if action == "Do Nothing":
                 return
@@ -753,19 +1166,18 @@ class YouTubeConverterApp:
         self.colors = self.themes[selected_theme]
         self.root.configure(bg=self.colors["bg"])
         self.setup_styles()
-        for i, item_id in enumerate(self.tree.get_children()):
-            tag = 'evenrow' if (i % 2 == 0) else 'oddrow'
-            current_tags = list(self.tree.item(item_id, 'tags'))
-            if 'evenrow' in current_tags: current_tags.remove('evenrow')
-            if 'oddrow' in current_tags: current_tags.remove('oddrow')
-            current_tags.insert(0, tag)
-            self.tree.item(item_id, tags=tuple(current_tags))
+        self.queue_view.apply_colors(self.colors)
 
     def confirm_rate_limit(self):
-        """Shows a confirmation message for the rate limit."""
+        """Applies the global rate limit and shows a confirmation message."""
         limit = self.rate_limit_var.get().strip()
+        try:
+            self.engine.bandwidth.set_rate(parse_rate(limit))
+        except ValueError as e:
+            messagebox.showerror("Invalid Speed Limit", f"{e}\nUse a number with an optional K, M or G suffix, e.g. 500K or 2M.")
+            return
         if limit:
-            messagebox.showinfo("Speed Limit Set", f"The speed limit has been set to {limit}.\nThis will apply to all new downloads.")
+            messagebox.showinfo("Speed Limit Set", f"The speed limit has been set to {limit}.\nIt is shared by all active downloads.")
         else:
             messagebox.showinfo("Speed Limit Removed", "The speed limit has been removed.")
 
@@ -788,11 +1200,6 @@ class YouTubeConverterApp:
 
 
     def start_app(self):
-        num_threads = 20
-        for _ in range(num_threads):
-            thread = threading.Thread(target=self.worker, daemon=True)
-            thread.start()
-        
         self.root.mainloop()
 
 if __name__ == '__main__':